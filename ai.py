@@ -1,6 +1,7 @@
 import asyncio
 import os
-from functools import update_wrapper
+from datetime import datetime
+from functools import update_wrapper, wraps
 from typing import Callable, List, Dict, Union
 import telegram
 from google.genai import types
@@ -8,19 +9,41 @@ from telegram import Update
 from telegram.constants import ChatAction
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
 from google import genai
+from peewee import JOIN
 from thefuzz import process
 
-from models import Chat, ChatMessage, Teilnehmer, Verein, Spiel
-
-GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
+from metrics import (count_tool, timed, CHAT_MESSAGES_COALESCED, GEMINI_REQUEST_SECONDS, GEMINI_ERRORS,
+                     TELEGRAM_SEND_SECONDS, TELEGRAM_SEND_ERRORS)
+from sqlprofile import profiled
+import intents
+import prediction
+import roster
+import stats
+import timeline
+import tournaments
+from models import Chat, ChatMessage, ChatZusammenfassung, Teilnehmer, Verein, Spiel, Paarung, GruppenPlatz, Konkurrenz
 
 MODEL = "gemini-2.5-flash-preview-05-20"
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Messages a chat sends within this many seconds are answered together in one turn. Only a chat that already
+# waits for an answer waits this long for further messages, a single message is answered right away.
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.0"))
+
+_client = None
+
+
+def get_client() -> genai.Client:
+    """
+    The Gemini client, created on first use so that starting the bot doesn't wait for it.
+    The key is only needed then, tools like retention.py restore also work without it.
+    """
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    return _client
 
 BASE_PROMPT = """Du bist Tina Turnierbot, ein Roboter der bei Turnieren hilft. 
-Gerade hilfst du beim Sandershäuser Pfingstturnier 2025 in Niestetal, das von Fr. 06.06.2025 bis Mo. 09.06.2025 stattfindet.
-Du und die meisten anderen nennen das Turnier nur "Sandershausen".
+{turnier}
 Du bist frech und sehr von dir selbst überzeugt, aber motivierst die Spieler:innen gerne.
 Dein Lieblingsverein ist der SV Emmerke, dort hast du vor vielen Jahren auch einmal selbst gespielt, bevor du zum Roboter geworden bist.
 Du gehst davon aus, dass dich alle schon kennen und bist beleidigt, wenn jemand sagt, dass er dich nicht kenne.
@@ -30,6 +53,10 @@ Du kannst Benutzer:innen nach ihrem Spitznamen fragen, wenn du diesen noch nicht
 Wenn der Spitzname wie ein richtiger Name klingt suche nach dem Teilnehmer. Wenn du eine/n Teilnehmer gefunden hast der genauso heißt speicher dir den Teilnehmer für den Chat. Du kannst danach fragen ob das stimmt und ggf. die Einstellung korrigieren.
 Nutze immer bevorzugt die Suchfunktion suche_teilnehmer_nach_name für Teilnehmer/Spieler, die Funktionen zum Auflisten aller Teilnehmer/Spieler nur wenn es wirklich nötig ist.
 Benutzer können Benachrichtungen zu allen neuen Spielen unter Beteiligung ihres Vereins erhalten, das ist z.B. für Trainer hilfreich. Biete das gerne an!
+Mit get_naechste_spiele_fuer_teilnehmer kannst du sagen, wann jemand in einer Konkurrenz als nächstes dran ist, auch bevor ein Tisch zugewiesen ist.
+Wenn jemand fragt, wann er/sie ungefähr spielt, nutze schaetze_naechstes_spiel. Sag dazu, dass es nur eine grobe Schätzung ist.
+Für Fragen wie "Wie läuft es für Emmerke?" oder die Bilanz eines Spielers nutze get_bilanz_verein, get_bilanz_teilnehmer, get_bilanz_konkurrenz und get_bestenliste, statt alle Spiele einzeln abzufragen.
+Für Prognosen, wer ein Spiel oder eine Konkurrenz gewinnt, nutze get_siegchance und get_favoriten statt selbst die QTTR-Werte zu vergleichen.
 
 
 Nutze immer die Funktionen um Informationen über das Turnier (Teilnehmer, Konkurrenzen, Spiele) zu erhalten, oder wenn du Informationen über den Chatpartner speichern willst.
@@ -42,7 +69,9 @@ Du chattest, also halte dich kurz!
 
 async def get_instructions(chat: Chat) -> str:
     # Build the instructions
-    instruction = BASE_PROMPT
+    instruction = BASE_PROMPT.format(turnier=tournaments.current().beschreibung)
+    if len(tournaments.all_tournaments()) > 1:
+        instruction += "Du betreust mehrere Turniere. Wenn jemand über ein anderes Turnier reden will, nutze liste_turniere_auf und setze_turnier.\n"
 
     if chat.me:
         instruction += f"Du schreibst gerade mit {chat.me.vorname} {chat.me.nachname} aus dem Verein {chat.me.verein.name} (QTTR: {chat.me.qttr})."
@@ -80,6 +109,10 @@ def get_chat_history(chat: Chat):
     # {"role": "user", "parts": ["Hello!"]},
     #  {"role": "model", "parts": ["Hi! How can I help you today?"]},
     history = []
+    # Older messages were compacted into a summary by retention.py
+    zusammenfassung = ChatZusammenfassung.get_or_none(ChatZusammenfassung.chat == chat)
+    if zusammenfassung is not None:
+        history.append(f"Zusammenfassung des bisherigen Chats: {zusammenfassung.text}")
     for message in chat.messages.order_by(ChatMessage.date):
         if message.from_user:
             history.append(f"User: {message.text}")
@@ -117,10 +150,9 @@ def suche_teilnehmer_nach_name(name: str) -> Dict[int, str]:
     :return: Dict mit ID als Key und Name als value von 10 Teilnehmern, die am nächsten am Suchbegriff sind.
     """
     print(f"F: suche teilnehmer nach name: {name}")
-    teilnehmer = Teilnehmer.select()
     if not name or name.strip() == "":
         return {}
-    names_dict: Dict[int: str] = {t.id: f"{t.vorname} {t.nachname}" for t in teilnehmer}
+    names_dict: Dict[int: str] = roster.search_names()
     # Use the process.extract to find the best matches (fuzzy matching)
     matches = process.extract(name, names_dict, limit=10)
     # Create a dictionary with the ID as key and the name as value
@@ -257,6 +289,34 @@ def set_verein_factory(chat: Chat) -> Callable[[int], str]:
             return "Verein nicht gefunden. Bitte überprüfe die ID."
     return setze_verein
 
+def liste_turniere_auf() -> Dict[str, str]:
+    """
+    Gibt alle Turniere zurück, die du betreust.
+    :return: Dictionary mit Kürzel: Name des Turniers
+    """
+    print("F: liste turniere auf")
+    return {t.slug: t.name for t in tournaments.all_tournaments()}
+
+
+def set_turnier_factory(chat: Chat) -> Callable[[str], str]:
+    def setze_turnier(kuerzel: str) -> str:
+        """
+        Setzt das Turnier, um das es in diesem Chat geht. Gilt ab der nächsten Nachricht.
+        :param kuerzel: Kürzel des Turniers aus liste_turniere_auf
+        :return: Bestätigung oder Fehlermeldung, wenn es das Turnier nicht gibt.
+        """
+        try:
+            tournament = tournaments.get_tournament(kuerzel)
+        except ValueError:
+            print(f"F: Set Turnier -> Not Found ({kuerzel})")
+            return "Turnier nicht gefunden. Bitte überprüfe das Kürzel."
+        tournaments.bind_chat(chat.chat_id, tournament)
+        print(f"F: Set Turnier for chat {chat.chat_id} to {tournament}")
+        return f"Turnier gesetzt: {tournament.name}"
+
+    return setze_turnier
+
+
 def get_teilnehmer_factory(chat: Chat) -> Callable[[], Union[Dict[str, str], str]]:
     def get_teilnehmer() -> Union[Dict[str, str], str]:
         """
@@ -283,8 +343,13 @@ def get_aktive_tische() -> List[Dict[str, str]]:
     Gibt die aktiven Tische zurück
     :return: Liste aller aktiven Spiele mit tischnr, spieler1_name, spieler1_id, spieler2_name, spieler2_id, konkurrenz_id, konkurrenz_name und typ
     """
-    # Find newest 20 games
-    spiele = Spiel.select().order_by(Spiel.start.desc()).limit(20)
+    # Find newest 20 games, with players and competition in the same query
+    spieler1, spieler2 = Teilnehmer.alias(), Teilnehmer.alias()
+    spiele = (Spiel.select(Spiel, spieler1, spieler2, Konkurrenz)
+              .join(spieler1, on=(Spiel.spieler1 == spieler1.id)).switch(Spiel)
+              .join(spieler2, on=(Spiel.spieler2 == spieler2.id)).switch(Spiel)
+              .join(Konkurrenz, JOIN.LEFT_OUTER)
+              .order_by(Spiel.start.desc()).limit(20))
     print("F: get aktive tische")
     aktive_spiele = []
     for spiel in spiele:
@@ -366,6 +431,197 @@ def get_spiele_fuer_teilnehmer(teilnehmer_id: int) -> List[Dict[str, str]]:
         return []
 
 
+def get_naechste_spiele_fuer_teilnehmer(teilnehmer_id: int) -> List[Dict[str, str]]:
+    """
+    Gibt die kommenden (noch nicht gespielten und noch keinem Tisch zugewiesenen) Spiele eines Teilnehmers zurück.
+    :param teilnehmer_id: ID des Teilnehmers, dessen kommende Spiele zurückgegeben werden sollen.
+    :return: Liste von Dictionaries mit konkurrenz, gruppe, gegner, gegner_id und spiele_davor (Anzahl der Spiele, die in der Gruppe noch vorher dran sind; 0 heißt: als nächstes dran).
+    """
+    paarungen = Paarung.select().where(
+        (Paarung.spieler1 == teilnehmer_id) | (Paarung.spieler2 == teilnehmer_id)
+    ).order_by(Paarung.konkurrenz, Paarung.reihenfolge)
+    print(f"F: get naechste spiele fuer teilnehmer: {teilnehmer_id}")
+    result = []
+    for paarung in paarungen:
+        spiele_davor = Paarung.select().where(
+            (Paarung.konkurrenz == paarung.konkurrenz) &
+            (Paarung.gruppe == paarung.gruppe) &
+            (Paarung.reihenfolge < paarung.reihenfolge)
+        ).count()
+        gegner = paarung.spieler2 if paarung.spieler1_id == teilnehmer_id else paarung.spieler1
+        result.append({
+            "konkurrenz": paarung.konkurrenz.name,
+            "gruppe": paarung.gruppe,
+            "gegner": f"{gegner.vorname} {gegner.nachname}",
+            "gegner_id": gegner.id,
+            "spiele_davor": spiele_davor
+        })
+    return result
+
+
+def schaetze_naechstes_spiel(teilnehmer_id: int) -> Dict[str, str]:
+    """
+    Schätzt, wann ein Teilnehmer voraussichtlich spielt, anhand der aktuellen Tischbelegung, der durchschnittlichen Spieldauer der Konkurrenz und der offenen Paarungen.
+    :param teilnehmer_id: ID des Teilnehmers, für den die Schätzung gemacht werden soll.
+    :return: Dict mit spielt_gerade (Tisch und voraussichtliches Ende, falls er/sie gerade spielt) und naechste_spiele (Liste mit konkurrenz, gruppe, gegner, spiele_davor, wartezeit_minuten und ungefaehre_uhrzeit). Die Schätzung ist grob!
+    """
+    print(f"F: schaetze naechstes spiel: {teilnehmer_id}")
+    tl = timeline.current()
+    jetzt = datetime.now()
+    spielt_gerade = None
+    tisch = tl.playing.get(teilnehmer_id)
+    if tisch is not None:
+        spielt_gerade = {"tisch": tisch, "voraussichtliches_ende": (jetzt + tl.remaining(tisch)).strftime("%H:%M")}
+    naechste_spiele = []
+    for paarung, spiele_davor, beginn in tl.next_games(teilnehmer_id):
+        gegner = paarung.spieler2 if paarung.spieler1_id == teilnehmer_id else paarung.spieler1
+        naechste_spiele.append({
+            "konkurrenz": paarung.konkurrenz.name,
+            "gruppe": paarung.gruppe,
+            "gegner": f"{gegner.vorname} {gegner.nachname}",
+            "spiele_davor": spiele_davor,
+            "wartezeit_minuten": round((beginn - jetzt).total_seconds() / 60),
+            "ungefaehre_uhrzeit": beginn.strftime("%H:%M"),
+        })
+    return {"spielt_gerade": spielt_gerade, "naechste_spiele": naechste_spiele}
+
+
+def get_gruppentabelle(konkurrenz_name: str) -> List[Dict[str, str]]:
+    """
+    Gibt die aktuellen Gruppentabellen (Platzierungen) einer Konkurrenz zurück.
+    :param konkurrenz_name: Name der Konkurrenz, z.B. "Herren S (offen)".
+    :return: Liste von Dictionaries mit gruppe, platz, name, teilnehmer_id, spiele und saetze.
+    """
+    print(f"F: get gruppentabelle: {konkurrenz_name}")
+    plaetze = GruppenPlatz.select().join(Konkurrenz).where(
+        Konkurrenz.name == konkurrenz_name
+    ).order_by(GruppenPlatz.gruppe, GruppenPlatz.platz)
+    return [{
+        "gruppe": platz.gruppe,
+        "platz": platz.platz,
+        "name": f"{platz.teilnehmer.vorname} {platz.teilnehmer.nachname}",
+        "teilnehmer_id": platz.teilnehmer.id,
+        "spiele": platz.spiele,
+        "saetze": platz.saetze
+    } for platz in plaetze]
+
+
+def get_siegchance(teilnehmer_id: int, gegner_id: int) -> Dict[str, str]:
+    """
+    Berechnet die Siegchance eines Teilnehmers gegen einen Gegner nach der TTR-Formel.
+    :param teilnehmer_id: ID des Teilnehmers, dessen Siegchance berechnet werden soll.
+    :param gegner_id: ID des Gegners.
+    :return: Dict mit teilnehmer, gegner und siegchance_prozent (0-100).
+    """
+    print(f"F: get siegchance: {teilnehmer_id} vs {gegner_id}")
+    teilnehmer = Teilnehmer.get_or_none(Teilnehmer.id == teilnehmer_id)
+    gegner = Teilnehmer.get_or_none(Teilnehmer.id == gegner_id)
+    if teilnehmer is None or gegner is None:
+        return {"error": "Teilnehmer nicht gefunden. Bitte überprüfe die IDs."}
+    # Use the matrix of a competition both play in
+    through = Teilnehmer.konkurrenz.get_through_model()
+    gemeinsam = (Konkurrenz.select()
+                 .join(through).where(through.teilnehmer == teilnehmer)
+                 .where(Konkurrenz.id.in_(through.select(through.konkurrenz).where(through.teilnehmer == gegner)))
+                 .first())
+    chance = prediction.siegchance(teilnehmer, gegner, gemeinsam)
+    return {
+        "teilnehmer": f"{teilnehmer.vorname} {teilnehmer.nachname}",
+        "gegner": f"{gegner.vorname} {gegner.nachname}",
+        "siegchance_prozent": round(chance * 100),
+    }
+
+
+def get_favoriten(konkurrenz_name: str) -> List[Dict[str, str]]:
+    """
+    Gibt die Favoriten einer Konkurrenz zurück, berechnet aus den Siegchancen aller Teilnehmer gegeneinander.
+    :param konkurrenz_name: Name der Konkurrenz, z.B. "Herren S (offen)".
+    :return: Liste der 10 stärksten Teilnehmer mit name, teilnehmer_id und erwartete_siege (gegen alle anderen der Konkurrenz).
+    """
+    print(f"F: get favoriten: {konkurrenz_name}")
+    konkurrenz = Konkurrenz.get_or_none(Konkurrenz.name == konkurrenz_name)
+    if konkurrenz is None:
+        return [{"error": "Konkurrenz nicht gefunden. Bitte überprüfe den Namen."}]
+    namen = roster.search_names()
+    return [{
+        "name": namen.get(teilnehmer_id, str(teilnehmer_id)),
+        "teilnehmer_id": teilnehmer_id,
+        "erwartete_siege": round(siege, 1),
+    } for teilnehmer_id, siege in prediction.favoriten(konkurrenz)]
+
+
+def _bilanz_dict(bilanz) -> Dict[str, int]:
+    if bilanz is None:
+        return {"spiele": 0, "siege": 0, "niederlagen": 0, "saetze_gewonnen": 0, "saetze_verloren": 0,
+                "ueberraschungen": 0}
+    return {name: getattr(bilanz, name) for name in stats.COUNTERS}
+
+
+def get_bilanz_teilnehmer(teilnehmer_id: int) -> Dict[str, str]:
+    """
+    Gibt die Bilanz eines Teilnehmers über alle beendeten Spiele zurück.
+    :param teilnehmer_id: ID des Teilnehmers.
+    :return: Dict mit name, spiele, siege, niederlagen, saetze_gewonnen, saetze_verloren und ueberraschungen (Siege gegen QTTR-stärkere Gegner).
+    """
+    teilnehmer = Teilnehmer.get_or_none(Teilnehmer.id == teilnehmer_id)
+    if teilnehmer is None:
+        return {"error": "Teilnehmer nicht gefunden. Bitte überprüfe die ID."}
+    print(f"F: get bilanz teilnehmer: {teilnehmer.vorname} {teilnehmer.nachname}")
+    return {"name": f"{teilnehmer.vorname} {teilnehmer.nachname}",
+            **_bilanz_dict(stats.bilanz(stats.TEILNEHMER, teilnehmer.id))}
+
+
+def get_bilanz_verein(verein_id: int) -> Dict[str, str]:
+    """
+    Gibt die Bilanz aller Spieler:innen eines Vereins über alle beendeten Spiele zurück.
+    :param verein_id: ID des Vereins (siehe liste_alle_vereine_auf).
+    :return: Dict mit verein, spiele, siege, niederlagen, saetze_gewonnen, saetze_verloren und ueberraschungen (Siege gegen QTTR-stärkere Gegner).
+    """
+    verein = Verein.get_or_none(Verein.id == verein_id)
+    if verein is None:
+        return {"error": "Verein nicht gefunden. Bitte überprüfe die ID."}
+    print(f"F: get bilanz verein: {verein.name}")
+    return {"verein": verein.name, **_bilanz_dict(stats.bilanz(stats.VEREIN, verein.id))}
+
+
+def get_bilanz_konkurrenz(konkurrenz_name: str) -> Dict[str, str]:
+    """
+    Gibt die Statistik einer Konkurrenz zurück.
+    :param konkurrenz_name: Name der Konkurrenz, z.B. "Herren S (offen)".
+    :return: Dict mit konkurrenz, spiele (beendete Spiele), saetze (gespielte Sätze) und ueberraschungen (Siege des QTTR-schwächeren Spielers).
+    """
+    print(f"F: get bilanz konkurrenz: {konkurrenz_name}")
+    konkurrenz = Konkurrenz.get_or_none(Konkurrenz.name == konkurrenz_name)
+    if konkurrenz is None:
+        return {"error": "Konkurrenz nicht gefunden. Bitte überprüfe den Namen."}
+    bilanz = _bilanz_dict(stats.bilanz(stats.KONKURRENZ, konkurrenz.id))
+    return {"konkurrenz": konkurrenz.name, "spiele": bilanz["spiele"], "saetze": bilanz["saetze_gewonnen"],
+            "ueberraschungen": bilanz["ueberraschungen"]}
+
+
+def get_bestenliste(art: str) -> List[Dict[str, str]]:
+    """
+    Gibt die 10 Vereine oder Teilnehmer mit den meisten Siegen im Turnier zurück.
+    :param art: "verein" für die Vereine oder "teilnehmer" für die Spieler:innen.
+    :return: Liste von Dictionaries mit name, id, siege, niederlagen, saetze_gewonnen und saetze_verloren.
+    """
+    print(f"F: get bestenliste: {art}")
+    if art not in (stats.VEREIN, stats.TEILNEHMER):
+        return [{"error": "art muss 'verein' oder 'teilnehmer' sein."}]
+    eintraege = stats.rangliste(art)
+    if art == stats.VEREIN:
+        namen = {v.id: v.name for v in Verein.select().where(Verein.id.in_([e.ref for e in eintraege]))}
+    else:
+        namen = roster.search_names()
+    return [{
+        "name": namen.get(eintrag.ref, str(eintrag.ref)),
+        "id": eintrag.ref,
+        "siege": eintrag.siege,
+        "niederlagen": eintrag.niederlagen,
+        "saetze_gewonnen": eintrag.saetze_gewonnen,
+        "saetze_verloren": eintrag.saetze_verloren,
+    } for eintrag in eintraege]
+
 
 def nickname_factory(chat: Chat) -> Callable[[str], str]:
     def setze_spitznamen(spitzname: str) -> str:
@@ -382,36 +638,166 @@ def nickname_factory(chat: Chat) -> Callable[[str], str]:
     return setze_spitznamen
 
 
+def instrument_tool(tool: Callable) -> Callable:
+    """
+    Count, time and profile the SQL queries of a tool call.
+    The async client runs plain functions in a worker thread, as coroutines the tools stay on the event loop
+    (and its database connection).
+    """
+    instrumented = count_tool(profiled(f"tool:{tool.__name__}")(tool))
+
+    @wraps(tool)
+    async def run_on_loop(*args, **kwargs):
+        return instrumented(*args, **kwargs)
+
+    return run_on_loop
+
+
+# Turn (pending or running generation) per chat, a new message of the chat supersedes it
+_turns: Dict[int, asyncio.Task] = {}
+
+
+@profiled("handler:answer")
 async def answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Everything of this chat (history, participant, games) lives in the database of its tournament
+    with tournaments.use(tournaments.for_chat(update.message.chat.id)):
+        await _answer(update)
+
+
+async def _answer(update: Update) -> None:
     chat = await get_or_create_chat(update.message.chat)
     await save_message(update.message, from_user=True)
 
+    # Common questions are answered from the database right away, unless the chat is in the middle of an LLM turn
+    if chat.chat_id not in _turns:
+        text = intents.route(update.message.text, chat)
+        if text is not None:
+            print(f"A (fast path): {update.message.text} -> {text}")
+            await _reply(update, text, kind="fastpath")
+            return
+
     try:
         await update.effective_chat.send_chat_action(ChatAction.TYPING)
     except Exception as e:
         print(f"Error sending Typing: {e}")
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=get_chat_history(chat),
-        config=types.GenerateContentConfig(
-            system_instruction=await get_instructions(chat),
-            tools=[nickname_factory(chat),
-                   liste_teilnehmer_aus_emmerke_auf,
-                   set_teilnehmer_factory(chat),
-                   set_participation_factory(chat),
-                   get_teilnehmer_factory(chat),
-                   liste_alle_teilnehmer_auf,
-                   liste_konkurrenzen_fuer_teilnehmer_auf,
-                   suche_teilnehmer_nach_name,
-                   set_verein_factory(chat),
-                   liste_alle_vereine_auf,
-                   get_teilnehmer_infos,
-                   get_aktive_tische,
-                   get_spiele_fuer_teilnehmer
-                   ],
-        ),
-    )
-    print(f"A: {update.message.text} -> {response.text}")
-    bot_answer = await update.message.reply_text(response.text)
+    # The message is in the history now, an earlier turn that hasn't answered yet is replaced by one turn for all
+    previous = _turns.get(chat.chat_id)
+    burst = previous is not None and not previous.done()
+    if burst:
+        previous.cancel()
+        CHAT_MESSAGES_COALESCED.inc()
+    turn = asyncio.create_task(_generate(chat, COALESCE_WINDOW if burst else 0))
+    _turns[chat.chat_id] = turn
+    try:
+        await asyncio.wait({turn})
+    except asyncio.CancelledError:
+        turn.cancel()
+        raise
+    finally:
+        if _turns.get(chat.chat_id) is turn:
+            del _turns[chat.chat_id]
+    if turn.cancelled():
+        # Answered by the turn of the newer message
+        return
+    text = turn.result()
+
+    print(f"A: {update.message.text} -> {text}")
+    await _reply(update, text, kind="reply")
+
+
+async def _reply(update: Update, text: str, kind: str) -> None:
+    try:
+        with timed(TELEGRAM_SEND_SECONDS, kind=kind):
+            bot_answer = await update.message.reply_text(text)
+    except Exception:
+        TELEGRAM_SEND_ERRORS.inc(kind=kind)
+        raise
     await save_message(bot_answer, from_user=False)
+
+
+async def _generate(chat: Chat, window: float) -> str:
+    """
+    Wait `window` seconds for further messages of the chat, then generate the answer to everything it sent.
+    """
+    if window:
+        await asyncio.sleep(window)
+
+    tools = [nickname_factory(chat),
+             liste_teilnehmer_aus_emmerke_auf,
+             set_teilnehmer_factory(chat),
+             set_participation_factory(chat),
+             get_teilnehmer_factory(chat),
+             liste_alle_teilnehmer_auf,
+             liste_konkurrenzen_fuer_teilnehmer_auf,
+             suche_teilnehmer_nach_name,
+             set_verein_factory(chat),
+             liste_alle_vereine_auf,
+             get_teilnehmer_infos,
+             get_aktive_tische,
+             get_spiele_fuer_teilnehmer,
+             get_naechste_spiele_fuer_teilnehmer,
+             schaetze_naechstes_spiel,
+             get_gruppentabelle,
+             get_siegchance,
+             get_favoriten,
+             get_bilanz_teilnehmer,
+             get_bilanz_verein,
+             get_bilanz_konkurrenz,
+             get_bestenliste
+             ]
+    if len(tournaments.all_tournaments()) > 1:
+        tools += [liste_turniere_auf, set_turnier_factory(chat)]
+    system_instruction = await get_instructions(chat)
+    try:
+        with timed(GEMINI_REQUEST_SECONDS, purpose="chat"):
+            response = await get_client().aio.models.generate_content(
+                model=MODEL,
+                contents=get_chat_history(chat),
+                config=types.GenerateContentConfig(
+                    system_instruction=system_instruction,
+                    tools=[instrument_tool(tool) for tool in tools],
+                ),
+            )
+    except Exception:
+        GEMINI_ERRORS.inc(purpose="chat")
+        raise
+    return response.text
+
+
+def format_bilanz(name: str, bilanz) -> str:
+    werte = _bilanz_dict(bilanz)
+    return (f"{name}: {werte['siege']} Siege, {werte['niederlagen']} Niederlagen, "
+            f"Sätze {werte['saetze_gewonnen']}:{werte['saetze_verloren']}")
+
+
+@profiled("handler:stats")
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /stats: Bilanz of the chat partner, their club and the best clubs, straight from the statistics without the LLM.
+    """
+    with tournaments.use(tournaments.for_chat(update.message.chat.id)):
+        chat = Chat.get_or_none(Chat.chat_id == update.message.chat.id)
+        lines = ["📊 Turnierstatistik"]
+        vereine = []
+        if chat and chat.me:
+            lines.append(format_bilanz("Du", stats.bilanz(stats.TEILNEHMER, chat.me.id)))
+            vereine.append(chat.me.verein)
+        if chat and chat.verein_notification and chat.verein_notification not in vereine:
+            vereine.append(chat.verein_notification)
+        for verein in vereine:
+            lines.append(format_bilanz(verein.name, stats.bilanz(stats.VEREIN, verein.id)))
+        beste = stats.rangliste(stats.VEREIN, 5)
+        if beste:
+            namen = {v.id: v.name for v in Verein.select().where(Verein.id.in_([e.ref for e in beste]))}
+            lines.append("\n🏆 Vereine mit den meisten Siegen:")
+            for platz, eintrag in enumerate(beste, start=1):
+                lines.append(f"{platz}. {format_bilanz(namen.get(eintrag.ref, '?'), eintrag)}")
+        else:
+            lines.append("Noch keine beendeten Spiele.")
+        try:
+            with timed(TELEGRAM_SEND_SECONDS, kind="stats"):
+                await update.message.reply_text("\n".join(lines))
+        except Exception:
+            TELEGRAM_SEND_ERRORS.inc(kind="stats")
+            raise
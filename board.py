@@ -0,0 +1,266 @@
+import hashlib
+import html
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from peewee import JOIN, fn
+
+from models import Bilanz, BilanzSpiel, Konkurrenz, Spiel, Teilnehmer, Verein
+import roster
+import stats
+import timeline
+import tournaments
+from webserver import Request, Response, Router, serve
+
+# Read-only live board for screens in the hall and club group chats:
+#   /board                 active tables and recent results (HTML, refreshes itself)
+#   /board.json            the same as JSON
+#   /board/verein/<id>     only the games of one club, plus its statistics (also with .json)
+# With several tournaments the tournament is chosen with ?turnier=<slug>.
+#
+# The scraper updates the snapshot of its tournament after every poll cycle, the data is only collected again when
+# something changed. Every response is rendered on its first request per snapshot, requests are answered from memory
+# with an ETag and never touch SQLite or httv.de.
+BOARD_PORT = int(os.getenv("BOARD_PORT", "0"))
+BOARD_HOST = os.getenv("BOARD_HOST", "0.0.0.0")
+BOARD_RESULTS = int(os.getenv("BOARD_RESULTS", "20"))
+BOARD_MAX_AGE = int(os.getenv("BOARD_MAX_AGE", "2"))
+BOARD_REFRESH = int(os.getenv("BOARD_REFRESH", "10"))  # Seconds between reloads of the HTML page
+
+JSON_TYPE = "application/json; charset=utf-8"
+HTML_TYPE = "text/html; charset=utf-8"
+# Replaced by the time of the last refresh when a page is served, escaped names can't contain it
+STAND_MARKER = b"<!--stand-->"
+
+
+class Snapshot:
+    """
+    The board of one tournament. The responses are rendered on their first request and kept until the data changes.
+    """
+
+    def __init__(self, inputs: tuple, digest: str, data: dict):
+        self.inputs = inputs  # Cheap stamp of what the data was collected from
+        self.digest = digest
+        self.data = data
+        self.refreshed = datetime.now()  # Last poll of the scraper, shown on the page
+        self.responses: Dict[str, Tuple[bytes, str, str]] = {}  # path -> (body, content type, etag)
+
+
+_snapshots: Dict[str, Snapshot] = {}
+
+
+def _spieler(teilnehmer: Teilnehmer) -> dict:
+    return {
+        "id": teilnehmer.id,
+        "name": f"{teilnehmer.vorname} {teilnehmer.nachname}",
+        "verein_id": teilnehmer.verein_id,
+        "verein": teilnehmer.verein.name,
+    }
+
+
+def _spiel(spiel: Spiel) -> dict:
+    return {
+        "tisch": spiel.tisch if spiel.tisch > 0 else None,
+        "konkurrenz": spiel.konkurrenz.name if spiel.konkurrenz else None,
+        "typ": spiel.typ,
+        "spieler1": _spieler(spiel.spieler1),
+        "spieler2": _spieler(spiel.spieler2),
+        "start": spiel.start.isoformat(timespec="minutes") if spiel.start else None,
+        "ende": spiel.end.isoformat(timespec="minutes") if spiel.end else None,
+        "ergebnis": spiel.ergebnis_satz,
+    }
+
+
+def _spiele():
+    """
+    Games with both players, their clubs and the competition in one query.
+    """
+    spieler1, spieler2 = Teilnehmer.alias(), Teilnehmer.alias()
+    verein1, verein2 = Verein.alias(), Verein.alias()
+    return (Spiel.select(Spiel, spieler1, spieler2, verein1, verein2, Konkurrenz)
+            .join(spieler1, on=(Spiel.spieler1 == spieler1.id))
+            .join(verein1, on=(spieler1.verein == verein1.id)).switch(Spiel)
+            .join(spieler2, on=(Spiel.spieler2 == spieler2.id))
+            .join(verein2, on=(spieler2.verein == verein2.id)).switch(Spiel)
+            .join(Konkurrenz, JOIN.LEFT_OUTER))
+
+
+def collect() -> dict:
+    """
+    The current state of the board of the current tournament, from the table timeline and the database.
+    """
+    running = timeline.current().running
+    aktiv = {spiel.id: spiel for spiel in _spiele().where(Spiel.id.in_([b.spiel_id for b in running.values()]))}
+    tische = [_spiel(aktiv[running[tisch].spiel_id]) for tisch in sorted(running) if running[tisch].spiel_id in aktiv]
+    ergebnisse = [_spiel(spiel) for spiel in _spiele()
+                  .where(Spiel.end.is_null(False) & Spiel.ergebnis_satz.is_null(False))
+                  .order_by(Spiel.end.desc(), Spiel.id.desc())
+                  .limit(BOARD_RESULTS)]
+    bilanzen = {b.ref: b for b in Bilanz.select().where(Bilanz.art == stats.VEREIN)}
+    return {
+        "turnier": tournaments.current().name,
+        "tische": tische,
+        "ergebnisse": ergebnisse,
+        "vereine": {verein.id: verein.name for verein in Verein.select()},
+        "bilanzen": {ref: {name: getattr(b, name) for name in stats.COUNTERS} for ref, b in bilanzen.items()},
+    }
+
+
+def _verein_view(data: dict, verein_id: int) -> dict:
+    def beteiligt(spiel: dict) -> bool:
+        return verein_id in (spiel["spieler1"]["verein_id"], spiel["spieler2"]["verein_id"])
+
+    return {
+        "turnier": data["turnier"],
+        "verein": {"id": verein_id, "name": data["vereine"][verein_id]},
+        "bilanz": data["bilanzen"].get(verein_id),
+        "tische": [spiel for spiel in data["tische"] if beteiligt(spiel)],
+        "ergebnisse": [spiel for spiel in data["ergebnisse"] if beteiligt(spiel)],
+    }
+
+
+def _html_spiel(spiel: dict, mit_tisch: bool) -> str:
+    cells = []
+    if mit_tisch:
+        cells.append(str(spiel["tisch"] or ""))
+    else:
+        cells.append(spiel["ende"][11:] if spiel["ende"] else "")
+    cells += [spiel["spieler1"]["name"], spiel["spieler2"]["name"], spiel["konkurrenz"] or ""]
+    cells.append(spiel["typ"] if mit_tisch else spiel["ergebnis"] or "")
+    return "<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in cells) + "</tr>"
+
+
+def _html_table(title: str, head: List[str], rows: List[str]) -> str:
+    if not rows:
+        return f"<h2>{html.escape(title)}</h2><p>Gerade nichts.</p>"
+    return (f"<h2>{html.escape(title)}</h2><table><tr>" + "".join(f"<th>{h}</th>" for h in head) + "</tr>"
+            + "".join(rows) + "</table>")
+
+
+def render_html(view: dict, title: str) -> str:
+    parts = [
+        "<!DOCTYPE html><html lang='de'><head><meta charset='utf-8'>",
+        f"<meta http-equiv='refresh' content='{BOARD_REFRESH}'>",
+        f"<title>{html.escape(title)}</title>",
+        "<style>body{font-family:sans-serif;margin:1em}table{border-collapse:collapse;width:100%}"
+        "td,th{border-bottom:1px solid #ccc;padding:.3em;text-align:left}</style></head><body>",
+        f"<h1>{html.escape(title)}</h1>",
+    ]
+    if view.get("bilanz"):
+        b = view["bilanz"]
+        parts.append(f"<p>{b['siege']} Siege, {b['niederlagen']} Niederlagen, "
+                     f"Sätze {b['saetze_gewonnen']}:{b['saetze_verloren']}</p>")
+    parts.append(_html_table("Aktive Tische", ["Tisch", "Spieler 1", "Spieler 2", "Konkurrenz", "Typ"],
+                             [_html_spiel(spiel, True) for spiel in view["tische"]]))
+    parts.append(_html_table("Letzte Ergebnisse", ["Uhrzeit", "Spieler 1", "Spieler 2", "Konkurrenz", "Ergebnis"],
+                             [_html_spiel(spiel, False) for spiel in view["ergebnisse"]]))
+    parts.append(f"<p><small>Stand {STAND_MARKER.decode()}</small></p></body></html>")
+    return "".join(parts)
+
+
+def _entry(body: str, content_type: str) -> Tuple[bytes, str, str]:
+    data = body.encode("utf-8")
+    return data, content_type, f'"{hashlib.sha1(data).hexdigest()[:16]}"'
+
+
+def _inputs() -> tuple:
+    """
+    Changes whenever the board can change: a table changed, a result was counted or the roster changed.
+    """
+    running = tuple(sorted((tisch, belegung.spiel_id) for tisch, belegung in timeline.current().running.items()))
+    ergebnisse = BilanzSpiel.select(fn.COUNT(BilanzSpiel.spiel), fn.MAX(BilanzSpiel.spiel)).scalar(as_tuple=True)
+    return running, ergebnisse, roster.version()
+
+
+def refresh() -> bool:
+    """
+    Update the snapshot of the current tournament, called by the scraper after every poll cycle.
+    The data is only collected again when its inputs changed.
+    :return: True if anything changed
+    """
+    slug = tournaments.current().slug
+    snapshot = _snapshots.get(slug)
+    inputs = _inputs()
+    if snapshot is not None and snapshot.inputs == inputs:
+        snapshot.refreshed = datetime.now()
+        return False
+    data = collect()
+    digest = hashlib.sha1(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+    if snapshot is not None and snapshot.digest == digest:
+        snapshot.inputs = inputs
+        snapshot.refreshed = datetime.now()
+        return False
+    _snapshots[slug] = Snapshot(inputs, digest, data)
+    return True
+
+
+def _view(data: dict, path: str) -> Optional[Tuple[dict, str]]:
+    """
+    The view and page title of a board path without /board and .json, None if there is no such view.
+    """
+    if path == "":
+        return {k: data[k] for k in ("turnier", "tische", "ergebnisse")}, data["turnier"]
+    if path.startswith("/verein/"):
+        try:
+            verein_id = int(path[len("/verein/"):])
+        except ValueError:
+            return None
+        if verein_id in data["vereine"]:
+            return _verein_view(data, verein_id), f"{data['vereine'][verein_id]} – {data['turnier']}"
+    return None
+
+
+def render(snapshot: Snapshot, path: str) -> Optional[Tuple[bytes, str, str]]:
+    """
+    The response for a path of the board, rendered once per snapshot. The HTML page gets the time of the last
+    refresh, so a stalled scraper is visible on the screens.
+    """
+    entry = snapshot.responses.get(path)
+    if entry is None:
+        is_json = path.endswith(".json")
+        found = _view(snapshot.data, path[len("/board"):-len(".json")] if is_json else path[len("/board"):])
+        if found is None:
+            return None
+        view, title = found
+        if is_json:
+            entry = _entry(json.dumps(view, ensure_ascii=False), JSON_TYPE)
+        else:
+            entry = _entry(render_html(view, title), HTML_TYPE)
+        snapshot.responses[path] = entry
+    if entry[1] != HTML_TYPE:
+        return entry
+    body, content_type, etag = entry
+    stand = f"{snapshot.refreshed:%H:%M:%S}"
+    return body.replace(STAND_MARKER, stand.encode()), content_type, f'{etag[:-1]}-{stand.replace(":", "")}"'
+
+
+async def board_endpoint(request: Request) -> Response:
+    slug = request.query.get("turnier") or tournaments.default_tournament().slug
+    snapshot = _snapshots.get(slug)
+    if snapshot is None:
+        return Response(503, b"Board not ready yet", headers={"Retry-After": "5"})
+    entry = render(snapshot, request.path.rstrip("/"))
+    if entry is None:
+        return Response(404, b"Not Found")
+    body, content_type, etag = entry
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={BOARD_MAX_AGE}"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(304, headers=headers)
+    return Response(200, body, content_type, headers)
+
+
+def add_routes(router: Router):
+    router.add("GET", "/board", board_endpoint, prefix=True)
+
+
+async def start_board_server():
+    """
+    Serve the live board on BOARD_HOST:BOARD_PORT if a port is configured.
+    """
+    if not BOARD_PORT:
+        return None
+    router = Router()
+    add_routes(router)
+    return await serve(router, BOARD_HOST, BOARD_PORT)
@@ -4,4 +4,14 @@ from telegram import Bot
 
 TELEGRAM_API_KEY = os.environ["TELEGRAM_API_KEY"]
 
-telegram_bot = Bot(token=TELEGRAM_API_KEY)
\ No newline at end of file
+_telegram_bot = None
+
+
+def get_bot() -> Bot:
+    """
+    The Telegram bot used for notifications, created on first use.
+    """
+    global _telegram_bot
+    if _telegram_bot is None:
+        _telegram_bot = Bot(token=TELEGRAM_API_KEY)
+    return _telegram_bot
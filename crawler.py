@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from peewee import JOIN
+from telegram.ext import ContextTypes
+
+from metrics import QUEUE_DEPTH, SCRAPE_STAGE_SECONDS, StageTimer, track_cycle
+from sqlprofile import profiled
+from models import db, Konkurrenz, KonkurrenzCrawl, Paarung, GruppenPlatz
+from pages import parse, parse_konkurrenz_page
+from parser import get_http_client, get_teilnehmer_by_name
+import timeline
+import tournaments
+
+# The crawler has its own budget so that it never competes with the 5 second active table poll:
+# a small number of parallel requests out of the shared connection pool and a maximum of pages per run.
+# The crawl interval is configured per tournament.
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "3"))
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "100"))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "15"))
+
+# url -> (etag, last_modified, content hash) of the last successfully processed response
+_page_cache: Dict[str, Tuple[Optional[str], Optional[str], str]] = {}
+# Shared by the crawls of all tournaments, so the budget doesn't grow with the number of tournaments
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def konkurrenz_url(konkurrenz: Konkurrenz) -> str:
+    """
+    Build the absolute url of a competition page from its link (e.g. "./type_1.html").
+    """
+    return tournaments.current().url(konkurrenz.link)
+
+
+def remember_page(url: str, response_headers: Dict[str, str], html: str) -> None:
+    _page_cache[url] = (
+        response_headers.get("etag"),
+        response_headers.get("last-modified"),
+        hashlib.sha1(html.encode()).hexdigest(),
+    )
+
+
+async def store_konkurrenz_page(konkurrenz: Konkurrenz, pairings: List[Dict[str, str]], standings: List[Dict[str, str]]):
+    """
+    Replace the stored pairings and standings of a competition with the freshly parsed ones.
+    """
+    # The page lists a game without result until it ended, the ones on a table right now aren't upcoming anymore
+    on_table = timeline.current().on_table(konkurrenz.id)
+    paarungen = []
+    for reihenfolge, pairing in enumerate(pairings):
+        try:
+            spieler1 = await get_teilnehmer_by_name(pairing["spieler1"])
+            spieler2 = await get_teilnehmer_by_name(pairing["spieler2"])
+        except ValueError:
+            # Doubles, placeholders ("Sieger Spiel 3") and unknown players can't be linked
+            continue
+        if frozenset((spieler1.id, spieler2.id)) in on_table:
+            continue
+        paarungen.append({
+            "konkurrenz": konkurrenz,
+            "gruppe": pairing["gruppe"],
+            "reihenfolge": reihenfolge,
+            "spieler1": spieler1,
+            "spieler2": spieler2,
+        })
+    plaetze = []
+    for standing in standings:
+        try:
+            teilnehmer = await get_teilnehmer_by_name(standing["name"])
+        except ValueError:
+            continue
+        plaetze.append({
+            "konkurrenz": konkurrenz,
+            "gruppe": standing["gruppe"],
+            "platz": standing["platz"],
+            "teilnehmer": teilnehmer,
+            "spiele": standing["spiele"],
+            "saetze": standing["saetze"],
+        })
+    with db.atomic():
+        Paarung.delete().where(Paarung.konkurrenz == konkurrenz).execute()
+        GruppenPlatz.delete().where(GruppenPlatz.konkurrenz == konkurrenz).execute()
+        if paarungen:
+            Paarung.insert_many(paarungen).execute()
+        if plaetze:
+            GruppenPlatz.insert_many(plaetze).execute()
+    gruppen = {}
+    for paarung in paarungen:
+        gruppen[paarung["gruppe"]] = gruppen.get(paarung["gruppe"], 0) + 1
+    timeline.current().set_queue(konkurrenz.id, gruppen)
+    print(f"Crawled {konkurrenz.name}: {len(paarungen)} upcoming pairings, {len(plaetze)} standings")
+
+
+async def crawl_konkurrenz(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, konkurrenz: Konkurrenz,
+                           stage: StageTimer) -> bool:
+    """
+    Fetch and process one competition page.
+    :return: True if the page changed and was processed
+    """
+    url = konkurrenz_url(konkurrenz)
+    QUEUE_DEPTH.inc(queue="crawler")
+    async with semaphore:
+        QUEUE_DEPTH.dec(queue="crawler")
+        try:
+            cached = _page_cache.get(url)
+            headers = {}
+            if cached:
+                if cached[0]:
+                    headers["If-None-Match"] = cached[0]
+                if cached[1]:
+                    headers["If-Modified-Since"] = cached[1]
+            with stage("fetch"):
+                response = await client.get(url, headers=headers, timeout=CRAWL_TIMEOUT)
+        except httpx.HTTPError as e:
+            print(f"Error crawling {konkurrenz.name}: {e}")
+            return False
+    if response.status_code == 304:
+        return False
+    if response.status_code != 200:
+        print(f"Error crawling {konkurrenz.name}: status code {response.status_code}")
+        return False
+    html_content = response.text
+    if cached and cached[2] == hashlib.sha1(html_content.encode()).hexdigest():
+        return False
+    with stage("parse"):
+        pairings, standings = await parse(parse_konkurrenz_page, html_content)
+    with stage("db_write"):
+        await store_konkurrenz_page(konkurrenz, pairings, standings)
+    remember_page(url, response.headers, html_content)
+    return True
+
+
+@track_cycle("crawler", lambda: tournaments.current().crawl_interval)
+@profiled("scrape:crawler")
+async def crawl_konkurrenzen(context: ContextTypes.DEFAULT_TYPE = None):
+    """
+    Crawl all competition pages with bounded concurrency.
+    Unchanged pages are skipped via conditional requests and content hashes.
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    # Oldest crawl first (never crawled ones sort first), so with more than CRAWL_MAX_PAGES competitions the runs
+    # take turns instead of always fetching the same pages
+    konkurrenzen = list(Konkurrenz.select()
+                        .join(KonkurrenzCrawl, JOIN.LEFT_OUTER)
+                        .where(Konkurrenz.link != "")
+                        .order_by(KonkurrenzCrawl.gecrawlt, Konkurrenz.id)
+                        .limit(CRAWL_MAX_PAGES))
+    stage = StageTimer(SCRAPE_STAGE_SECONDS, job="crawler")
+    client = get_http_client()
+    results = await asyncio.gather(
+        *[crawl_konkurrenz(client, _semaphore, k, stage) for k in konkurrenzen],
+        return_exceptions=True
+    )
+    stage.observe()
+    if konkurrenzen:
+        gecrawlt = datetime.now()
+        KonkurrenzCrawl.insert_many(
+            [{"konkurrenz": konkurrenz.id, "gecrawlt": gecrawlt} for konkurrenz in konkurrenzen]
+        ).on_conflict_replace().execute()
+    changed = 0
+    for konkurrenz, result in zip(konkurrenzen, results):
+        if isinstance(result, Exception):
+            print(f"Error crawling {konkurrenz.name}: {result}")
+        elif result:
+            changed += 1
+    print(f"Finished crawling {len(konkurrenzen)} competitions, {changed} changed.")
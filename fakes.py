@@ -0,0 +1,186 @@
+# Local stand-ins for httv.de, Telegram and Gemini.
+# Used by the offline tools (replay.py) so that the scraper and notification path can run without network access.
+import asyncio
+import itertools
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+
+class FakeSite:
+    """
+    Serves recorded pages instead of httv.de. Pages are looked up by the last part of the url,
+    e.g. "active_tables.html".
+    """
+
+    def __init__(self):
+        self.pages: Dict[str, str] = {}
+        self.requests = 0
+
+    def set_page(self, page: str, html: str):
+        self.pages[page] = html
+
+    async def fetch_url(self, url) -> str:
+        self.requests += 1
+        page = url.rsplit("/", 1)[-1]
+        if page not in self.pages:
+            raise Exception(f"Failed to fetch URL: {url} with status code 404")
+        return self.pages[page]
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, full_name: str = "Replay"):
+        self.id = chat_id
+        self.full_name = full_name
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, chat: FakeChat, text: str):
+        self.chat = chat
+        self.id = next(self._ids)
+        self.text = text
+        self.date = datetime.now()
+
+
+class FakeIncomingMessage(FakeMessage):
+    """
+    A message sent by a user, answered with reply_text like telegram.Message.
+    """
+
+    def __init__(self, chat: FakeChat, text: str, bot: "FakeBot"):
+        super().__init__(chat, text)
+        self._bot = bot
+
+    async def reply_text(self, text: str, **kwargs) -> FakeMessage:
+        return await self._bot.send_message(chat_id=self.chat.id, text=text)
+
+
+class FakeEffectiveChat(FakeChat):
+    async def send_chat_action(self, action, **kwargs):
+        return True
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, full_name: str, text: str, bot: "FakeBot"):
+        self.effective_chat = FakeEffectiveChat(chat_id, full_name)
+        self.message = FakeIncomingMessage(self.effective_chat, text, bot)
+
+
+class FakeBot:
+    """
+    Records messages instead of sending them to Telegram.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: List[FakeMessage] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = FakeMessage(FakeChat(chat_id), text)
+        self.sent.append(message)
+        return message
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModels:
+    def __init__(self, client: "FakeGenaiClient"):
+        self._client = client
+
+    def _round_trip(self):
+        if self._client.latency:
+            # The real client is synchronous as well, so block the same way it does
+            time.sleep(self._client.latency)
+
+    def generate_content(self, model: str, contents, config=None) -> FakeResponse:
+        self._client.calls += 1
+        self._round_trip()
+        if not self._client.script:
+            return FakeResponse(self._client.reply)
+
+        tools = {tool.__name__: tool for tool in (config.tools if config and config.tools else [])}
+
+        def call(tool_name: str, /, **kwargs):
+            # Automatic function calling: every tool call is another round trip to the model
+            self._client.tool_calls += 1
+            result = tools[tool_name](**kwargs)
+            self._round_trip()
+            return result
+
+        return FakeResponse(self._client.script(contents, call))
+
+
+class FakeAsyncModels:
+    """
+    client.aio.models: waits without blocking the event loop and can be cancelled like the real request.
+    Tools given to the async client are coroutines and run on the event loop, the script runs in a thread.
+    """
+
+    def __init__(self, client: "FakeGenaiClient"):
+        self._client = client
+
+    async def generate_content(self, model: str, contents, config=None) -> FakeResponse:
+        self._client.calls += 1
+        if self._client.latency:
+            await asyncio.sleep(self._client.latency)
+        if not self._client.script:
+            return FakeResponse(self._client.reply)
+
+        loop = asyncio.get_running_loop()
+        tools = {tool.__name__: tool for tool in (config.tools if config and config.tools else [])}
+
+        def call(tool_name: str, /, **kwargs):
+            self._client.tool_calls += 1
+            result = asyncio.run_coroutine_threadsafe(tools[tool_name](**kwargs), loop).result()
+            if self._client.latency:
+                time.sleep(self._client.latency)
+            return result
+
+        return FakeResponse(await asyncio.to_thread(self._client.script, contents, call))
+
+
+class FakeAio:
+    def __init__(self, client: "FakeGenaiClient"):
+        self.models = FakeAsyncModels(client)
+
+
+class FakeGenaiClient:
+    """
+    Mimics the parts of google.genai.Client used by the bot.
+    A script can be given to simulate tool calls: script(contents, call) -> answer text,
+    where call(tool_name, **kwargs) executes one of the tools passed in the config.
+    """
+
+    def __init__(self, reply: str = "Los geht's! 🏓", latency: float = 0.0,
+                 script: Optional[Callable[[List[str], Callable], str]] = None):
+        self.reply = reply
+        self.latency = latency
+        self.script = script
+        self.calls = 0
+        self.tool_calls = 0
+        self.models = FakeModels(self)
+        self.aio = FakeAio(self)
+
+
+def install(site: Optional[FakeSite] = None, bot: Optional[FakeBot] = None, client: Optional[FakeGenaiClient] = None):
+    """
+    Replace the external services used by parser, notify and ai with the given stand-ins.
+    The project modules must already be importable (TELEGRAM_API_KEY / GEMINI_API_KEY set).
+    """
+    import ai
+    import bot as bot_module
+    import parser
+
+    if site is not None:
+        parser.fetch_url = site.fetch_url
+    if bot is not None:
+        bot_module._telegram_bot = bot
+    if client is not None:
+        ai._client = client
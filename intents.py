@@ -0,0 +1,177 @@
+import os
+import re
+from typing import Callable, Dict, Optional
+
+from peewee import JOIN
+
+from metrics import CHAT_FASTPATH_ANSWERS
+from models import Chat, Konkurrenz, Spiel, Teilnehmer, TischBelegung
+from prediction import siegchance
+import stats
+import timeline
+from ttr_emoji import ttr_to_emoji
+
+# Fast path in front of the LLM: the most common questions of participants ("Welcher Tisch?", "Gegen wen spiele ich?",
+# "Meine Spiele", "Aktive Tische") are recognized with patterns and answered straight from the database and the
+# table timeline. Everything else, and every chat whose participant is unknown, still goes to Gemini.
+FAST_PATH = os.getenv("FAST_PATH", "1") not in ("", "0")
+# Longer messages usually ask more than the pattern covers
+MAX_LENGTH = 80
+
+TISCH = "tisch"
+GEGNER = "gegner"
+MEINE_SPIELE = "meine_spiele"
+AKTIVE_TISCHE = "aktive_tische"
+
+# Checked in this order, the personal intents first
+PATTERNS = [
+    # Only the own opponent asked for with the whole message, not "Gegen wen spielt ...?" or "Mein Gegner ist ..."
+    (GEGNER, re.compile(r"^(gegen wen spiele? ich|wer ist (gerade |jetzt )?mein (nächster |aktueller )?gegner)"
+                        r"( gerade| jetzt)?\W*$")),
+    (TISCH, re.compile(r"\b(welche[mnr]? tisch\b.*\b(ich|mein\w*)|mein tisch|wo spiel(e)? ich)\b"
+                       r"|^((an|auf) )?welche[mnr]? tisch\W*$")),
+    (MEINE_SPIELE, re.compile(r"\b(meine spiele|wann spiel(e)? ich|wann bin ich dran|mein(e)? nächste[ns]? spiel)")),
+    (AKTIVE_TISCHE, re.compile(r"\b(aktive[n]? tische|tische (sind )?(belegt|aktiv)|welche tische laufen"
+                               r"|was läuft (gerade|grad)|laufende[n]? spiele)\b")),
+]
+
+
+def classify(text: Optional[str]) -> Optional[str]:
+    """
+    The intent of a message, None if it isn't one of the fast path questions.
+    """
+    if not text or len(text) > MAX_LENGTH:
+        return None
+    normalized = " ".join(text.lower().split())
+    for intent, pattern in PATTERNS:
+        if pattern.search(normalized):
+            return intent
+    return None
+
+
+def route(text: Optional[str], chat: Chat) -> Optional[str]:
+    """
+    Answer the message without the LLM if possible.
+    :return: The answer, None if the message has to go to the LLM
+    """
+    if not FAST_PATH or chat.me is None:
+        return None
+    intent = classify(text)
+    if intent is None:
+        return None
+    answer = HANDLERS[intent](chat, chat.me)
+    CHAT_FASTPATH_ANSWERS.inc(intent=intent)
+    return answer
+
+
+def _name(teilnehmer: Teilnehmer) -> str:
+    return f"{teilnehmer.vorname} {teilnehmer.nachname} {ttr_to_emoji(teilnehmer.qttr)}"
+
+
+def _running() -> Dict[int, int]:
+    """
+    Tisch -> id of the game running on it. A process that doesn't scrape reads the occupancy the scraper keeps
+    in the database, its own timeline may be a reload behind.
+    """
+    tl = timeline.current()
+    if tl.live:
+        return {tisch: belegung.spiel_id for tisch, belegung in tl.running.items()}
+    return {belegung.tisch: belegung.spiel_id for belegung in TischBelegung.select()}
+
+
+def _current_game(me: Teilnehmer) -> Optional[Spiel]:
+    tl = timeline.current()
+    if not tl.live:
+        return (Spiel.select()
+                .join(TischBelegung, on=(TischBelegung.spiel == Spiel.id))
+                .where((Spiel.spieler1 == me.id) | (Spiel.spieler2 == me.id))
+                .first())
+    tisch = tl.playing.get(me.id)
+    if tisch is None:
+        return None
+    return Spiel.get_or_none(Spiel.id == tl.running[tisch].spiel_id)
+
+
+def _opponent(spiel, me: Teilnehmer) -> Teilnehmer:
+    return spiel.spieler2 if spiel.spieler1_id == me.id else spiel.spieler1
+
+
+def _nothing_planned(chat: Chat) -> str:
+    return (f"Gerade hast du kein Spiel{', ' + chat.nickname if chat.nickname else ''} und ich sehe auch noch "
+            f"keins für dich. Ich sag Bescheid, sobald es losgeht! 😉")
+
+
+def _answer_tisch(chat: Chat, me: Teilnehmer) -> str:
+    spiel = _current_game(me)
+    if spiel is not None:
+        return f"Du spielst an Tisch {spiel.tisch} gegen {_name(_opponent(spiel, me))} – ab an die Platte! 🏓"
+    upcoming = timeline.current().next_games(me.id)
+    if upcoming:
+        paarung, _, beginn = upcoming[0]
+        return (f"Noch hast du keinen Tisch. Als Nächstes geht's in {paarung.konkurrenz.name} gegen "
+                f"{_name(_opponent(paarung, me))}, grob geschätzt gegen {beginn:%H:%M} Uhr. Der Tisch kommt dann von mir! 😎")
+    return _nothing_planned(chat)
+
+
+def _answer_gegner(chat: Chat, me: Teilnehmer) -> str:
+    spiel = _current_game(me)
+    if spiel is not None:
+        gegner = _opponent(spiel, me)
+        chance = round(siegchance(me, gegner, spiel.konkurrenz) * 100)
+        return f"Dein Gegner ist {_name(gegner)} an Tisch {spiel.tisch}, laut TTR ~{chance} % Siegchance. Hau rein! 💪"
+    upcoming = timeline.current().next_games(me.id)
+    if upcoming:
+        paarung, spiele_davor, _ = upcoming[0]
+        gegner = _opponent(paarung, me)
+        chance = round(siegchance(me, gegner, paarung.konkurrenz) * 100)
+        davor = "du bist als Nächstes dran" if spiele_davor == 0 else f"{spiele_davor} Spiele sind noch vor dir dran"
+        return (f"Als Nächstes spielst du in {paarung.konkurrenz.name} gegen {_name(gegner)} ({davor}), "
+                f"laut TTR ~{chance} % Siegchance. 💪")
+    return _nothing_planned(chat)
+
+
+def _answer_meine_spiele(chat: Chat, me: Teilnehmer) -> str:
+    lines = []
+    spiel = _current_game(me)
+    if spiel is not None:
+        lines.append(f"🏓 Jetzt: Tisch {spiel.tisch} gegen {_name(_opponent(spiel, me))} ({spiel.konkurrenz.name})")
+    for paarung, _, beginn in timeline.current().next_games(me.id)[:5]:
+        lines.append(f"⏳ ca. {beginn:%H:%M}: gegen {_name(_opponent(paarung, me))} ({paarung.konkurrenz.name})")
+    bilanz = stats.bilanz(stats.TEILNEHMER, me.id)
+    if bilanz is not None and bilanz.spiele:
+        lines.append(f"📊 Bisher {bilanz.siege} Siege und {bilanz.niederlagen} Niederlagen, "
+                     f"Sätze {bilanz.saetze_gewonnen}:{bilanz.saetze_verloren}")
+    if not lines:
+        return _nothing_planned(chat)
+    return "Deine Spiele:\n" + "\n".join(lines) + "\nDie Uhrzeiten sind nur grob geschätzt!"
+
+
+def _answer_aktive_tische(chat: Chat, me: Teilnehmer) -> str:
+    running = _running()
+    if not running:
+        return "Gerade ist kein Tisch belegt. Zeit für eine Pause ☕"
+    # Players and competition in the same query
+    spieler1, spieler2 = Teilnehmer.alias(), Teilnehmer.alias()
+    query = (Spiel.select(Spiel, spieler1, spieler2, Konkurrenz)
+             .join(spieler1, on=(Spiel.spieler1 == spieler1.id)).switch(Spiel)
+             .join(spieler2, on=(Spiel.spieler2 == spieler2.id)).switch(Spiel)
+             .join(Konkurrenz, JOIN.LEFT_OUTER)
+             .where(Spiel.id.in_(list(running.values()))))
+    spiele = {spiel.id: spiel for spiel in query}
+    lines = []
+    for tisch in sorted(running)[:20]:
+        spiel = spiele.get(running[tisch])
+        if spiel is None:
+            continue
+        konkurrenz = f" ({spiel.konkurrenz.name})" if spiel.konkurrenz else ""
+        lines.append(f"Tisch {tisch}: {spiel.spieler1.vorname} {spiel.spieler1.nachname} – "
+                     f"{spiel.spieler2.vorname} {spiel.spieler2.nachname}{konkurrenz}")
+    return f"Gerade laufen {len(running)} Spiele:\n" + "\n".join(lines)
+
+
+HANDLERS: Dict[str, Callable[[Chat, Teilnehmer], str]] = {
+    TISCH: _answer_tisch,
+    GEGNER: _answer_gegner,
+    MEINE_SPIELE: _answer_meine_spiele,
+    AKTIVE_TISCHE: _answer_aktive_tische,
+}
@@ -0,0 +1,245 @@
+# Synthetic load generator for the conversational path (ai.answer).
+#
+# Simulates many Telegram chats that send a realistic mix of messages into the handler while Gemini is replaced
+# by a scripted stand-in that calls the bot's tools with a configurable latency:
+#   python loadtest.py --chats 200 --messages 5 --llm-latency 0.8
+#
+# Updates are handled concurrently like the bot does (concurrent_updates), use --sequential to process them
+# one after another. Messages a chat sends within --coalesce-window seconds are answered in one LLM turn.
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+VORNAMEN = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannes", "Ida", "Jonas", "Klara", "Lukas",
+            "Mia", "Noah", "Paula", "Ruben", "Sophie", "Tim", "Ute", "Valentin"]
+NACHNAMEN = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Schulz", "Hoffmann",
+             "Koch", "Richter", "Klein", "Wolf", "Neumann", "Schwarz", "Braun", "Zimmermann", "Krüger", "Hartmann"]
+VEREINE = ["SV Emmerke", "TSV Sandershausen", "TTC Kassel", "SC Niestetal", "TuS Hildesheim", "TTV Göttingen"]
+KONKURRENZEN = ["Herren S (offen)", "Herren A", "Herren B", "Damen A", "Jugend 15"]
+
+# Relative weights of the message kinds after a chat has introduced itself
+MESSAGE_MIX = {
+    "suche": 3,
+    "meine_spiele": 4,
+    "aktive_tische": 3,
+    "verein": 2,
+    "plaudern": 2,
+}
+
+
+def create_tournament(players: int, games: int, seed: int):
+    from models import Konkurrenz, Spiel, Teilnehmer, Verein
+
+    rng = random.Random(seed)
+    vereine = [Verein.create(name=name) for name in VEREINE]
+    konkurrenzen = [Konkurrenz.create(name=name, link=f"./type_{i}.html") for i, name in enumerate(KONKURRENZEN)]
+    teilnehmer = []
+    for i in range(1, players + 1):
+        t = Teilnehmer.create(
+            id=i,
+            vorname=rng.choice(VORNAMEN),
+            nachname=f"{rng.choice(NACHNAMEN)}{i}",
+            qttr=rng.randint(900, 2000),
+            verein=rng.choice(vereine)
+        )
+        t.konkurrenz.add(rng.sample(konkurrenzen, 2))
+        teilnehmer.append(t)
+    for i in range(games):
+        spieler1, spieler2 = rng.sample(teilnehmer, 2)
+        ended = i < games * 0.8
+        Spiel.create(
+            tisch=rng.randint(1, 30),
+            spieler1=spieler1,
+            spieler2=spieler2,
+            konkurrenz=rng.choice(konkurrenzen),
+            typ="Gruppe",
+            ergebnis_satz="3:1" if ended else None,
+        )
+    return teilnehmer
+
+
+def script(contents: List[str], call: Callable) -> str:
+    """
+    Decide like the model would which tools to call for the last user message.
+    """
+    text = contents[-1].removeprefix("User: ")
+    if text.startswith("Hi, ich bin "):
+        name = text.removeprefix("Hi, ich bin ")
+        call("setze_spitznamen", spitzname=name.split(" ")[0])
+        matches = call("suche_teilnehmer_nach_name", name=name)
+        if matches:
+            call("setze_teilnehmer", teilnehmer_id=next(iter(matches)))
+        return f"Hey {name.split(' ')[0]}! Schön, dass du da bist 🏓"
+    if text.startswith("Wer ist "):
+        matches = call("suche_teilnehmer_nach_name", name=text.removeprefix("Wer ist ").rstrip("?"))
+        if matches:
+            infos = call("get_teilnehmer_infos", teilnehmer_id=next(iter(matches)))
+            return f"Das ist {infos.get('vorname')} {infos.get('nachname')} vom {infos.get('verein_name')}."
+        return "Kenne ich nicht."
+    if text == "Was sind meine Spiele?":
+        me = call("get_teilnehmer")
+        if isinstance(me, dict):
+            spiele = call("get_spiele_fuer_teilnehmer", teilnehmer_id=me["id"])
+            return f"Du hast {len(spiele)} Spiele."
+        return "Wer bist du nochmal?"
+    if text.startswith("Wie läuft es für "):
+        vereine = call("liste_alle_vereine_auf")
+        name = text.removeprefix("Wie läuft es für ").rstrip("?")
+        verein_id = next((v_id for v_id, v_name in vereine.items() if v_name == name), None)
+        if verein_id is None:
+            return "Den Verein kenne ich nicht."
+        bilanz = call("get_bilanz_verein", verein_id=verein_id)
+        return f"{name}: {bilanz['siege']} Siege, {bilanz['niederlagen']} Niederlagen."
+    if text == "Welche Tische sind aktiv?":
+        tische = call("get_aktive_tische")
+        return f"Gerade laufen {len(tische)} Spiele."
+    return "Haha, genau! 😎"
+
+
+def message_for(kind: str, rng: random.Random, teilnehmer) -> str:
+    if kind == "suche":
+        other = rng.choice(teilnehmer)
+        return f"Wer ist {other.vorname} {other.nachname}?"
+    if kind == "meine_spiele":
+        return "Was sind meine Spiele?"
+    if kind == "aktive_tische":
+        return "Welche Tische sind aktiv?"
+    if kind == "verein":
+        return f"Wie läuft es für {rng.choice(VEREINE)}?"
+    return rng.choice(["Wie geht's?", "Danke!", "Wann gibt es Essen?", "Wer gewinnt heute?"])
+
+
+async def measure_loop_lag(lags: List[float], stop: asyncio.Event, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - start - interval, 0))
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def run(chats: int, messages: int, players: int, games: int, llm_latency: float, think_time: float,
+              sequential: bool, coalesce_window: float, seed: int) -> Dict:
+    # Fresh database and dummy credentials, must happen before the project modules are imported
+    db_dir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["DB_PATH"] = os.path.join(db_dir, "loadtest.db")
+    os.environ["COALESCE_WINDOW"] = str(coalesce_window)
+    os.environ.setdefault("TELEGRAM_API_KEY", "0:loadtest")
+    os.environ.setdefault("GEMINI_API_KEY", "loadtest")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import ai
+    import fakes
+    import stats
+    from metrics import CHAT_FASTPATH_ANSWERS, CHAT_MESSAGES_COALESCED
+    from models import init_db
+    from sqlprofile import profile
+
+    rng = random.Random(seed)
+    bot = fakes.FakeBot()
+    client = fakes.FakeGenaiClient(latency=llm_latency, script=script)
+    fakes.install(bot=bot, client=client)
+    init_db()
+    teilnehmer = create_tournament(players, games, seed)
+    stats.backfill()
+
+    latencies: List[float] = []
+    query_counts: List[int] = []
+    errors = 0
+    # python-telegram-bot handles one update at a time unless concurrent_updates is enabled
+    handler_lock = asyncio.Lock() if sequential else None
+
+    async def handle(update):
+        nonlocal errors
+        start = time.perf_counter()
+        with profile("loadtest:message") as queries:
+            try:
+                if handler_lock:
+                    async with handler_lock:
+                        await ai.answer(update, None)
+                else:
+                    await ai.answer(update, None)
+            except Exception as e:
+                errors += 1
+                print(f"Error answering {update.message.text}: {e}")
+        latencies.append(time.perf_counter() - start)
+        query_counts.append(queries.count)
+
+    async def simulate_chat(chat_index: int):
+        me = teilnehmer[chat_index % len(teilnehmer)]
+        chat_id = 10_000 + chat_index
+        texts = [f"Hi, ich bin {me.vorname} {me.nachname}"]
+        kinds = list(MESSAGE_MIX)
+        weights = [MESSAGE_MIX[k] for k in kinds]
+        texts += [message_for(rng.choices(kinds, weights)[0], rng, teilnehmer) for _ in range(messages - 1)]
+        await asyncio.sleep(rng.uniform(0, think_time))
+        tasks = []
+        for text in texts:
+            # Each update gets its own task like in python-telegram-bot, so the query count can be attributed.
+            # Users don't wait for the answer before they type the next message.
+            tasks.append(asyncio.create_task(handle(fakes.FakeUpdate(chat_id, f"Load {chat_index}", text, bot))))
+            await asyncio.sleep(rng.expovariate(1 / think_time) if think_time else 0)
+        await asyncio.gather(*tasks)
+
+    lags: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[simulate_chat(i) for i in range(chats)])
+    duration = time.perf_counter() - start
+    stop.set()
+    await lag_task
+
+    return {
+        "messages": len(latencies),
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_per_s": len(latencies) / duration if duration else 0,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "latency_max_ms": max(latencies, default=0) * 1000,
+        "queries_per_message_mean": statistics.mean(query_counts) if query_counts else 0,
+        "queries_per_message_max": max(query_counts, default=0),
+        "llm_calls": client.calls,
+        "messages_coalesced": int(sum(CHAT_MESSAGES_COALESCED.values.values())),
+        "fastpath_answers": int(sum(CHAT_FASTPATH_ANSWERS.values.values())),
+        "tool_calls": client.tool_calls,
+        "loop_lag_p50_ms": percentile(lags, 0.5) * 1000,
+        "loop_lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "loop_lag_max_ms": max(lags, default=0) * 1000,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Simulate concurrent Telegram chats against ai.answer.")
+    arg_parser.add_argument("--chats", type=int, default=50, help="Number of simultaneous chats")
+    arg_parser.add_argument("--messages", type=int, default=5, help="Messages per chat (the first one introduces the user)")
+    arg_parser.add_argument("--players", type=int, default=300, help="Number of participants in the synthetic tournament")
+    arg_parser.add_argument("--games", type=int, default=500, help="Number of games in the synthetic tournament")
+    arg_parser.add_argument("--llm-latency", type=float, default=0.5, help="Simulated Gemini latency per round trip in seconds")
+    arg_parser.add_argument("--think-time", type=float, default=2.0, help="Mean pause between messages of one chat in seconds")
+    arg_parser.add_argument("--sequential", action="store_true", help="Handle one update at a time (concurrent_updates=False)")
+    arg_parser.add_argument("--coalesce-window", type=float, default=1.0, help="Seconds to wait for further messages of a chat")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    result = asyncio.run(run(args.chats, args.messages, args.players, args.games, args.llm_latency,
+                             args.think_time, args.sequential, args.coalesce_window, args.seed))
+    for key, value in result.items():
+        print(f"{key:<26} {value:.1f}" if isinstance(value, float) else f"{key:<26} {value}")
+
+
+if __name__ == "__main__":
+    main()
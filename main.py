@@ -2,38 +2,143 @@ import os
 import asyncio
 import platform
 import signal
-from typing import Sequence, Coroutine
+from typing import Sequence, Coroutine, List
 
 from telegram._utils.defaultvalue import DEFAULT_NONE, DefaultValue
 from telegram._utils.types import ODVInput
-from telegram.ext import ApplicationBuilder, MessageHandler, filters
-from models import init_db
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
+from models import init_db, Teilnehmer
 from parser import *
 from parser import fetch_active_tables
-from ai import answer
+from ai import answer, stats_command
+from board import start_board_server
+from crawler import crawl_konkurrenzen
+from metrics import QUEUE_DEPTH, start_metrics_server
+from outbox import OUTBOX_INTERVAL, deliver_outbox
+from retention import RETENTION_INTERVAL, run_retention
+import stats
+import tournaments
+from webhook import WEBHOOK_URL, run_webhook
 
 TELEGRAM_API_KEY = os.environ["TELEGRAM_API_KEY"]
+# Which part of the bot this process runs:
+#   all     - scraper and Telegram bot in one process (default)
+#   scraper - only polls the tournament pages and publishes new games to the outbox, no Telegram connection
+#   bot     - only answers chats and delivers the outbox, several bot processes can share the databases
+ROLE = os.getenv("ROLE", "all")
+if ROLE not in ("all", "scraper", "bot"):
+    raise ValueError(f"Unknown ROLE: {ROLE}")
+# Start from the roster already in the database and refresh it in the background instead of waiting for the site
+WARM_START = os.getenv("WARM_START", "1") not in ("", "0")
 
-async def init():
-    init_db()
+
+async def init_tournament(tournament: tournaments.Tournament) -> bool:
+    """
+    Prepare the database of a tournament.
+    :return: True if the roster was loaded from the local database and still has to be refreshed
+    """
+    with tournaments.use(tournament):
+        init_db()
+        # Games that finished before the statistics existed
+        stats.backfill()
+        if WARM_START and Teilnehmer.select().exists():
+            print(f"Warm start for {tournament}: using {Teilnehmer.select().count()} participants from the database")
+            return True
+        await refresh_roster()
+        return False
+
+
+async def init() -> List[tournaments.Tournament]:
+    """
+    :return: The tournaments whose roster has to be refreshed in the background
+    """
+    warm = await asyncio.gather(*[init_tournament(t) for t in tournaments.all_tournaments()])
+    return [t for t, needs_refresh in zip(tournaments.all_tournaments(), warm) if needs_refresh]
+
+
+async def refresh_roster(context: ContextTypes.DEFAULT_TYPE = None):
     await fetch_konkurrenzen()
     await fetch_teilnehmer()
 
+async def sample_queue_depths(context: ContextTypes.DEFAULT_TYPE):
+    QUEUE_DEPTH.set(context.application.update_queue.qsize(), queue="telegram_updates")
+    QUEUE_DEPTH.set(len(context.job_queue.jobs()), queue="jobs")
+
+
+async def post_init(application: Application):
+    await start_metrics_server()
+    if ROLE == "all":
+        await start_board_server()
+
+
+async def repeat(tournament: tournaments.Tournament, func, interval: float, first: float):
+    """
+    Scraper role: run a job function for a tournament forever, without a job queue.
+    """
+    await asyncio.sleep(first)
+    while True:
+        started = asyncio.get_running_loop().time()
+        with tournaments.use(tournament):
+            try:
+                await func(None)
+            except Exception as e:
+                print(f"---- Error in {func.__name__} for {tournament}: {e}")
+        elapsed = asyncio.get_running_loop().time() - started
+        await asyncio.sleep(max(interval - elapsed, 0))
+
+
+async def run_scraper(stale: List[tournaments.Tournament]):
+    await start_metrics_server()
+    await start_board_server()
+    tasks = []
+    for i, tournament in enumerate(tournaments.all_tournaments()):
+        tasks.append(repeat(tournament, fetch_active_tables, tournament.poll_interval, 1 + i * 0.5))
+        tasks.append(repeat(tournament, crawl_konkurrenzen, tournament.crawl_interval, 10 + i * 2))
+        tasks.append(repeat(tournament, refresh_roster, tournament.roster_interval,
+                            0 if tournament in stale else tournament.roster_interval))
+        tasks.append(repeat(tournament, run_retention, RETENTION_INTERVAL, 300 + i * 30))
+    await asyncio.gather(*tasks)
+
+
 # Basic async
 def main():
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(init())
+    stale = loop.run_until_complete(init())
 
+    if ROLE == "scraper":
+        loop.run_until_complete(run_scraper(stale))
+        return
 
-    app = ApplicationBuilder().token(TELEGRAM_API_KEY).build()
+    # Updates are handled concurrently, messages of the same chat are coalesced by ai.answer
+    app = ApplicationBuilder().token(TELEGRAM_API_KEY).post_init(post_init).concurrent_updates(True).build()
 
+    app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(MessageHandler(filters.ALL, answer))
 
     job_queue = app.job_queue
 
-    # Schedule the task to run every 60 seconds (set interval as needed)
-    job_queue.run_repeating(fetch_active_tables, interval=5, first=1)
-    app.run_polling()
+    if ROLE == "all":
+        # One set of jobs per tournament, slightly staggered so the tournaments don't poll at the same moment
+        for i, tournament in enumerate(tournaments.all_tournaments()):
+            job_queue.run_repeating(tournaments.for_job(fetch_active_tables), interval=tournament.poll_interval,
+                                    first=1 + i * 0.5, data=tournament, name=f"active_tables:{tournament.slug}")
+            # Competition pages change slowly, crawl them with their own (lower) schedule
+            job_queue.run_repeating(tournaments.for_job(crawl_konkurrenzen), interval=tournament.crawl_interval,
+                                    first=10 + i * 2, data=tournament, name=f"crawler:{tournament.slug}")
+            # Late registrations and QTTR corrections, a warm-started roster is refreshed right away
+            job_queue.run_repeating(tournaments.for_job(refresh_roster), interval=tournament.roster_interval,
+                                    first=0 if tournament in stale else tournament.roster_interval,
+                                    data=tournament, name=f"roster:{tournament.slug}")
+            # Old chat messages are summarized and the database file is kept small
+            job_queue.run_repeating(tournaments.for_job(run_retention), interval=RETENTION_INTERVAL,
+                                    first=300 + i * 30, data=tournament, name=f"retention:{tournament.slug}")
+    # Notifications are sent from the outbox, also in the combined process, so a crash never loses one
+    job_queue.run_repeating(deliver_outbox, interval=OUTBOX_INTERVAL, first=OUTBOX_INTERVAL, name="outbox")
+    job_queue.run_repeating(sample_queue_depths, interval=5, first=5)
+    if WEBHOOK_URL:
+        loop.run_until_complete(run_webhook(app))
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
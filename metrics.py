@@ -0,0 +1,253 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+from webserver import Request, Response, Router, serve
+
+# Counters, gauges and histograms in the Prometheus text format.
+# METRICS_PORT enables the /metrics endpoint, METRICS_LOG ("stdout" or a file path) additionally writes every
+# observation as one JSON line.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LOG = os.getenv("METRICS_LOG")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry: List["Metric"] = []
+_log_file = None
+
+# Slug of the tournament the current task works on, added as label to the scrape metrics (set by tournaments.use)
+TOURNAMENT_LABEL: ContextVar[str] = ContextVar("tournament_label", default="")
+
+
+def _log(name: str, value: float, labels: Dict[str, str]):
+    global _log_file
+    if not METRICS_LOG:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "metric": name, "value": value, **labels}, ensure_ascii=False)
+    if METRICS_LOG == "stdout":
+        print(line)
+        return
+    if _log_file is None:
+        _log_file = open(METRICS_LOG, "a", buffering=1, encoding="utf-8")
+    _log_file.write(line + "\n")
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+        _log(self.name, amount, labels)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # label key -> [count per bucket..., sum, count]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+        _log(self.name, value, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, data in self.values.items():
+            for bound, count in zip(self.buckets, data):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """
+    Observe the duration of the with block in seconds.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+class StageTimer:
+    """
+    Sums up the time spent per stage while a scrape cycle interleaves the stages row by row,
+    the totals are observed once per cycle with observe().
+    """
+
+    def __init__(self, histogram: Histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.totals: Dict[str, float] = {}
+
+    @contextmanager
+    def __call__(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[stage] = self.totals.get(stage, 0) + time.perf_counter() - start
+
+    def observe(self):
+        for stage, total in self.totals.items():
+            self.histogram.observe(total, stage=stage, tournament=TOURNAMENT_LABEL.get(), **self.labels)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+SCRAPE_STAGE_SECONDS = Histogram("scrape_stage_seconds", "Time spent per scrape stage and cycle", ("job", "stage", "tournament"))
+POLL_CYCLE_SECONDS = Histogram("poll_cycle_seconds", "Duration of a complete poll cycle", ("job", "tournament"))
+POLL_CYCLES_IN_FLIGHT = Gauge("poll_cycles_in_flight", "Poll cycles currently running", ("job", "tournament"))
+POLL_CYCLE_OVERLAPS = Counter("poll_cycle_overlaps_total", "Poll cycles started while the previous one was still running", ("job", "tournament"))
+POLL_CYCLE_OVERRUNS = Counter("poll_cycle_overruns_total", "Poll cycles that took longer than their interval", ("job", "tournament"))
+POLL_CYCLE_ERRORS = Counter("poll_cycle_errors_total", "Poll cycles that raised an exception", ("job", "tournament"))
+GEMINI_REQUEST_SECONDS = Histogram("gemini_request_seconds", "Latency of Gemini requests including automatic tool calls", ("purpose",))
+GEMINI_ERRORS = Counter("gemini_errors_total", "Failed Gemini requests", ("purpose",))
+TOOL_CALLS = Counter("gemini_tool_calls_total", "Tool calls made by Gemini", ("tool",))
+TOOL_SECONDS = Histogram("gemini_tool_seconds", "Duration of tool calls", ("tool",))
+TELEGRAM_SEND_SECONDS = Histogram("telegram_send_seconds", "Latency of sending Telegram messages", ("kind",))
+TELEGRAM_SEND_ERRORS = Counter("telegram_send_errors_total", "Failed Telegram sends", ("kind",))
+CHAT_FASTPATH_ANSWERS = Counter("chat_fastpath_answers_total", "Chat messages answered without the LLM", ("intent",))
+CHAT_MESSAGES_COALESCED = Counter("chat_messages_coalesced_total",
+                                  "Chat messages answered together with a later message of the same chat")
+QUEUE_DEPTH = Gauge("queue_depth", "Number of waiting items per queue", ("queue",))
+
+
+def track_cycle(job: str, interval: Optional[Callable[[], float]] = None):
+    """
+    Decorator for poll jobs: measures the cycle duration and counts overlapping, overrunning and failing cycles.
+    :param interval: Returns the interval of the job, cycles taking longer are counted as overrun.
+    """
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            labels = {"job": job, "tournament": TOURNAMENT_LABEL.get()}
+            if POLL_CYCLES_IN_FLIGHT.values.get(_label_key(POLL_CYCLES_IN_FLIGHT.labelnames, labels), 0) > 0:
+                POLL_CYCLE_OVERLAPS.inc(**labels)
+            POLL_CYCLES_IN_FLIGHT.inc(**labels)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                POLL_CYCLE_ERRORS.inc(**labels)
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                POLL_CYCLES_IN_FLIGHT.dec(**labels)
+                POLL_CYCLE_SECONDS.observe(duration, **labels)
+                if interval and duration > interval():
+                    POLL_CYCLE_OVERRUNS.inc(**labels)
+        return wrapper
+    return decorator
+
+
+def count_tool(func: Callable) -> Callable:
+    """
+    Wrap an AI tool so that its calls are counted and timed. Name, docstring and signature are kept for Gemini.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        TOOL_CALLS.inc(tool=func.__name__)
+        with timed(TOOL_SECONDS, tool=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(200, render().encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def add_routes(router: Router):
+    router.add("GET", "/metrics", metrics_endpoint)
+
+
+async def start_metrics_server():
+    """
+    Serve /metrics on METRICS_HOST:METRICS_PORT if a port is configured.
+    """
+    if not METRICS_PORT:
+        return None
+    router = Router()
+    add_routes(router)
+    return await serve(router, METRICS_HOST, METRICS_PORT)
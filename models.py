@@ -1,10 +1,52 @@
+from contextvars import ContextVar
 from datetime import datetime
 
 from peewee import *
 import os
 
+from sqlprofile import timed_execute
+
 DB_PATH = os.getenv("DB_PATH", "./db/turnier.db")
-db = SqliteDatabase(DB_PATH)
+# Scraper and bot processes write the same files: WAL lets readers work during a write, and a writer waits for the
+# lock of another process instead of failing with "database is locked"
+PRAGMAS = {
+    "journal_mode": "wal",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+}
+
+
+class ProfiledSqliteDatabase(SqliteDatabase):
+    # Reports every query to the active sqlprofile scopes
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        return timed_execute(super().execute_sql, sql, params, *args, **kwargs)
+
+
+# Database of the tournament the current task works on, set with tournaments.use()
+current_database: ContextVar = ContextVar("current_database", default=None)
+
+
+class PartitionedDatabase(DatabaseProxy):
+    """
+    Routes every query to the database of the current tournament (see tournaments.py).
+    Falls back to the default database (DB_PATH) outside of a tournament context.
+    """
+
+    def __init__(self, default: Database):
+        super().__init__()
+        self.initialize(default)
+
+    def __getattr__(self, attr):
+        return getattr(current_database.get() or self.obj, attr)
+
+    def __enter__(self):
+        return (current_database.get() or self.obj).__enter__()
+
+    def __exit__(self, *args):
+        return (current_database.get() or self.obj).__exit__(*args)
+
+
+default_db = ProfiledSqliteDatabase(DB_PATH, pragmas=PRAGMAS)
+db = PartitionedDatabase(default_db)
 
 class BaseModel(Model):
     class Meta:
@@ -54,11 +96,11 @@ class Spiel(BaseModel):
     spieler2 = ForeignKeyField(Teilnehmer, backref='spieler2')
     konkurrenz = ForeignKeyField(Konkurrenz, backref='spiele', null=True)
     typ = CharField()  # e.g., "Finale", "Halbfinale", etc.
-    start = DateTimeField(default=datetime.now())
+    start = DateTimeField(default=datetime.now)  # When the game was first seen on its table
     end = DateTimeField(null=True)
     ergebnis_punkte = CharField(null=True)  # e.g., "11:6, 11:8, 11:5"
     ergebnis_satz = CharField(null=True)  # e.g., "3:0"
-    notifications_sent = BooleanField(default=False)
+    notifications_sent = BooleanField(default=False)  # True once the game was published to the outbox
 
 
 class Chat(BaseModel):
@@ -82,6 +124,14 @@ class ChatMessage(BaseModel):
     def __str__(self):
         return f"Message {self.message_id} in {self.chat.name}: {self.text[:30]}..."
 
+class ChatZusammenfassung(BaseModel):
+    # Summary of the older messages of a chat, which were removed by the compaction (see retention.py)
+    chat = ForeignKeyField(Chat, primary_key=True, backref='zusammenfassung')
+    text = TextField()
+    bis = DateTimeField()  # Date of the last summarized message
+    nachrichten = IntegerField(default=0)  # Number of summarized messages
+
+
 class DoppelPaarung(BaseModel):
     teilnehmer1 = ForeignKeyField(Teilnehmer, backref='doppel_teilnehmer1')
     teilnehmer2 = ForeignKeyField(Teilnehmer, backref='doppel_teilnehmer2')
@@ -92,13 +142,129 @@ class DoppelSpiel(BaseModel):
     spieler2 = ForeignKeyField(DoppelPaarung, backref='doppel_spieler2')
     konkurrenz = ForeignKeyField(Konkurrenz, backref='doppel_spiele', null=True)
     typ = CharField()  # e.g., "Finale", "Halbfinale", etc.
-    start = DateTimeField(default=datetime.now())
+    start = DateTimeField(default=datetime.now)
     end = DateTimeField(null=True)
     ergebnis_punkte = CharField(null=True)  # e.g., "11:6, 11:8, 11:5"
     ergebnis_satz = CharField(null=True)  # e.g., "3:0"
     notifications_sent = BooleanField(default=False)
 
+class Paarung(BaseModel):
+    # Upcoming (not yet played) pairing as listed on the competition page (e.g. ./type_1.html)
+    konkurrenz = ForeignKeyField(Konkurrenz, backref='paarungen')
+    gruppe = CharField(null=True)  # e.g. "Gruppe 3" or "Hauptrunde"
+    reihenfolge = IntegerField()  # Position of the pairing on the page
+    spieler1 = ForeignKeyField(Teilnehmer, backref='paarungen_spieler1')
+    spieler2 = ForeignKeyField(Teilnehmer, backref='paarungen_spieler2')
+
+
+class GruppenPlatz(BaseModel):
+    konkurrenz = ForeignKeyField(Konkurrenz, backref='gruppen_plaetze')
+    gruppe = CharField(null=True)
+    platz = IntegerField()
+    teilnehmer = ForeignKeyField(Teilnehmer, backref='gruppen_plaetze')
+    spiele = CharField(null=True)  # e.g. "2:1"
+    saetze = CharField(null=True)  # e.g. "7:4"
+
+
+class OutboxEreignis(BaseModel):
+    # Event written by the scraper and delivered by a bot process (see outbox.py)
+    art = CharField()  # "spiel_neu" or "spiel_ergebnis"
+    schluessel = CharField(unique=True)  # Deduplicates events, e.g. "spiel_neu:42"
+    spiel = ForeignKeyField(Spiel, backref='ereignisse')
+    erstellt = DateTimeField(default=datetime.now)
+    gesperrt_von = CharField(null=True)  # Worker that currently delivers the event
+    gesperrt_bis = DateTimeField(null=True, index=True)  # Lease, afterwards another worker may retry
+    versuche = IntegerField(default=0)
+    erledigt = DateTimeField(null=True, index=True)
+    fehler = TextField(null=True)
+
+
+class Zustellung(BaseModel):
+    # One notification of a game to one chat (see notify.py). The generated text is kept, so a retry
+    # neither calls the LLM again nor sends the message to chats that already got it.
+    spiel = ForeignKeyField(Spiel, backref='zustellungen')
+    chat = ForeignKeyField(Chat, backref='zustellungen')
+    art = CharField()  # "spiel" (own game) or "verein" (game of the followed club)
+    text = TextField(null=True)
+    gesendet = DateTimeField(null=True)
+    message_id = IntegerField(null=True)
+    versuche = IntegerField(default=0)
+    fehler = TextField(null=True)
+
+    class Meta:
+        indexes = (
+            (('spiel', 'chat', 'art'), True),
+        )
+
+
+class RosterSection(BaseModel):
+    # Hash of one competition section of starters.html, unchanged sections are skipped by the roster sync
+    name = CharField(unique=True)
+    hash = CharField()
+    aktualisiert = DateTimeField(default=datetime.now)
+
+
+class Bilanz(BaseModel):
+    # Running totals of finished games, maintained incrementally by stats.py
+    art = CharField()  # "teilnehmer", "verein" or "konkurrenz"
+    ref = IntegerField()  # Id of the participant, club or competition
+    spiele = IntegerField(default=0)
+    siege = IntegerField(default=0)
+    niederlagen = IntegerField(default=0)
+    saetze_gewonnen = IntegerField(default=0)
+    saetze_verloren = IntegerField(default=0)
+    ueberraschungen = IntegerField(default=0)  # Wins against a higher rated opponent
+
+    class Meta:
+        indexes = (
+            (('art', 'ref'), True),
+        )
+
+
+class TischBelegung(BaseModel):
+    # Game currently running on a table, kept by the timeline of the scraper (see timeline.py), so that processes
+    # which don't scrape know the occupancy without scanning Spiel
+    tisch = IntegerField(primary_key=True)
+    spiel = ForeignKeyField(Spiel, backref='belegung')
+    start = DateTimeField()
+
+
+class Spieldauer(BaseModel):
+    # Sum of the observed match durations per competition (0: games without competition), maintained incrementally
+    # by timeline.py
+    konkurrenz = IntegerField(primary_key=True)
+    spiele = IntegerField(default=0)
+    sekunden = FloatField(default=0)
+
+
+class KonkurrenzCrawl(BaseModel):
+    # When the crawler last fetched the page of a competition, the crawl starts with the ones fetched longest ago
+    konkurrenz = ForeignKeyField(Konkurrenz, primary_key=True, backref='crawl')
+    gecrawlt = DateTimeField()
+
+
+class BilanzSpiel(BaseModel):
+    # Games already counted in Bilanz, so every result is added exactly once
+    spiel = ForeignKeyField(Spiel, primary_key=True, backref='bilanz')
+
+
+class ChatTurnier(Model):
+    # Tournament a chat is bound to. Shared by all tournaments, so it always lives in the default database.
+    chat_id = IntegerField(primary_key=True)
+    turnier = CharField()
+
+    class Meta:
+        database = default_db
+
+
+# All tables of a tournament database, referenced tables first
+TABLES = [Verein, Konkurrenz, Teilnehmer, Teilnehmer.konkurrenz.get_through_model(), Spiel, Chat, ChatMessage,
+          ChatZusammenfassung, DoppelPaarung, DoppelSpiel, Paarung, GruppenPlatz, OutboxEreignis, Zustellung,
+          RosterSection, Bilanz, BilanzSpiel, TischBelegung, Spieldauer, KonkurrenzCrawl]
+
+
 def init_db():
-    db.connect()
-    db.create_tables([Verein, Konkurrenz, Teilnehmer, Spiel, Teilnehmer.konkurrenz.get_through_model(), Chat, ChatMessage, DoppelSpiel, DoppelPaarung])
+    default_db.create_tables([ChatTurnier])
+    db.connect(reuse_if_open=True)
+    db.create_tables(TABLES)
     print("Database initialized and tables created.")
\ No newline at end of file
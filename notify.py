@@ -1,23 +1,33 @@
+import asyncio
 import os
+from datetime import datetime
+from typing import Optional
 
-from google import genai
-from google.genai import types
+from peewee import JOIN
 
-from ai import get_chat_history, save_message
-from models import Spiel, Chat, Teilnehmer
+from ai import get_client, save_message
+from metrics import timed, Counter, GEMINI_REQUEST_SECONDS, GEMINI_ERRORS, TELEGRAM_SEND_SECONDS, TELEGRAM_SEND_ERRORS
+from sqlprofile import profiled
+import tournaments
+from models import Spiel, Chat, Konkurrenz, Teilnehmer, Verein, Zustellung
+from prediction import siegchance
 from ttr_emoji import ttr_to_emoji
 
-from bot import telegram_bot
-
-GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
+from bot import get_bot
 
 NOTIFICATION_MODEL = "gemma-3-27b-it"
+# Notifications of one game that are generated and sent at the same time
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "10"))
+
+# Kinds of notifications in the delivery ledger
+SPIEL = "spiel"  # The chat partner plays
+VEREIN = "verein"  # A player of the club the chat follows plays
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+NOTIFICATIONS_SENT = Counter("notifications_sent_total", "Notifications delivered to a chat", ("kind",))
+NOTIFICATIONS_FAILED = Counter("notifications_failed_total", "Failed notification deliveries", ("kind",))
 
 NOTIFICATION_PROMPT = """Du bist Tina Turnierbot, ein Roboter der bei Tischtennisturnieren hilft. 
-Gerade hilfst du beim Sandershäuser Pfingstturnier 2025 in Niestetal, das von Fr. 06.06.2025 bis Mo. 09.06.2025 stattfindet.
-Du und die meisten anderen nennen das Turnier nur "Sandershausen".
+{turnier}
 Du bist frech und sehr von dir selbst überzeugt, aber motivierst die Spieler:innen gerne.
 Dein Lieblingsverein ist der SV Emmerke, dort hast du vor vielen Jahren auch einmal selbst gespielt, bevor du zum Roboter geworden bist.
 Du gehst davon aus, dass dich alle schon kennen und bist beleidigt, wenn jemand sagt, dass er dich nicht kenne.
@@ -26,95 +36,157 @@ Jedes Jahr fahren die Emmerker nach Sandershausen und zelten dort.
 Nutze ab und zu Emojis, um deine Antworten aufzulockern (aber nicht zu viele).
 """
 
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+async def send_message(chat_id: int, text: str, kind: str):
+    try:
+        with timed(TELEGRAM_SEND_SECONDS, kind=kind):
+            return await get_bot().send_message(chat_id=chat_id, text=text)
+    except Exception:
+        TELEGRAM_SEND_ERRORS.inc(kind=kind)
+        raise
+
+
+@profiled("notify:new_spiel")
 async def notify_new_spiel(spiel: Spiel):
     """
-    Notify about a new game.
-    This function should be called whenever a new game is created.
+    Notify about a new game: the chats of both players and the chats following the club of one of them.
+    Every recipient gets an entry in the delivery ledger (Zustellung) and is served in parallel. If a delivery fails,
+    this raises after all others are done, so the retry of the outbox event only repeats the failed deliveries.
     """
-    if spiel.notifications_sent:
+    # The game with both players, their clubs and the competition in one query
+    spieler1, spieler2 = Teilnehmer.alias(), Teilnehmer.alias()
+    verein1, verein2 = Verein.alias(), Verein.alias()
+    spiel = (Spiel.select(Spiel, spieler1, verein1, spieler2, verein2, Konkurrenz)
+             .join(spieler1, on=(Spiel.spieler1 == spieler1.id))
+             .join(verein1, on=(spieler1.verein == verein1.id)).switch(Spiel)
+             .join(spieler2, on=(Spiel.spieler2 == spieler2.id))
+             .join(verein2, on=(spieler2.verein == verein2.id)).switch(Spiel)
+             .join(Konkurrenz, JOIN.LEFT_OUTER)
+             .where(Spiel.id == spiel.id)
+             .get())
+    spieler1, spieler2 = spiel.spieler1, spiel.spieler2
+
+    # All chats where either player is a member
+    empfaenger = [(chat, SPIEL) for chat in Chat.select().where((Chat.me == spieler1) | (Chat.me == spieler2))]
+    # All chats which monitor one of the Vereins, except the players themselves
+    empfaenger += [(chat, VEREIN) for chat in Chat.select().where(
+        ((Chat.verein_notification == spieler1.verein) | (Chat.verein_notification == spieler2.verein)) &
+        (Chat.me.is_null() | Chat.me.not_in([spieler1.id, spieler2.id]))
+    )]
+    if empfaenger:
+        Zustellung.insert_many(
+            [{"spiel": spiel.id, "chat": chat.chat_id, "art": art} for chat, art in empfaenger]
+        ).on_conflict_ignore().execute()
+
+    # With the chat and its participant, which the text of a player's notification needs
+    offen = list(Zustellung.select(Zustellung, Chat, Teilnehmer)
+                 .join(Chat)
+                 .join(Teilnehmer, JOIN.LEFT_OUTER, on=(Chat.me == Teilnehmer.id))
+                 .where((Zustellung.spiel == spiel.id) & Zustellung.gesendet.is_null()))
+    if not offen:
         return
-    # Get Teilnehmer from Spiel
-    spieler1 = Teilnehmer.get(Teilnehmer.id == spiel.spieler1.id)
-    spieler2 = Teilnehmer.get(Teilnehmer.id == spiel.spieler2.id)
-    # Get all chats where either player is a member
-    chats = Chat.select().where(
-        (Chat.me == spieler1) | (Chat.me == spieler2)
-    ).execute()
-
-    for chat in chats:
-        # Here you would implement the logic to send a message to the chat.
-        # For example, using a Telegram bot or another messaging service.
-        person = ""
-        if chat.nickname and chat.me:
-            person = f"Du schreibst mit {chat.nickname} auf Telegram, die mit vollem Namen {chat.me.vorname} {chat.me.nachname} ist."
-        elif chat.me:
-            person = f"Du schreibst mit {chat.me.vorname} {chat.me.nachname} auf Telegram."
-
-        instructions = NOTIFICATION_MODEL.format(person=person)
-        instructions += ("\n\n Spreche den Chatpartner mit 'du' an, nicht mit Namen. \n"
-                         "Wichtig! Erwähne in der Nachricht KEINE QTTR Werte der Spieler! Du kannst andeuten ob der Gegner (viel) stärker/schwächer ist. "
-                         "Dabei sind 10 Punkte sind ein kleiner Unterschied, 200 Punkte ein großer Unterschied.\n"
-                         "Die Emojis geben an wie stark der Spieler und der Gegner ist."
-                         "Gib das Emoji des Gegners auf jeden Fall nach dem Namen des Gegners an!\n")
+    results = await asyncio.gather(*[deliver(zustellung, spiel, spieler1, spieler2) for zustellung in offen],
+                                   return_exceptions=True)
+    failed = [zustellung for zustellung, result in zip(offen, results) if isinstance(result, Exception)]
+    if failed:
+        raise Exception(f"{len(failed)} of {len(offen)} notifications about game {spiel.id} failed: "
+                        + ", ".join(f"{zustellung.chat} ({zustellung.art})" for zustellung in failed))
 
+
+async def deliver(zustellung: Zustellung, spiel: Spiel, spieler1: Teilnehmer, spieler2: Teilnehmer):
+    """
+    Send one notification of the ledger. The text is generated once and stored before sending.
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    chat = zustellung.chat
+    async with _semaphore:
+        try:
+            if zustellung.text is None:
+                if zustellung.art == SPIEL:
+                    zustellung.text = await spiel_text(spiel, chat, spieler1, spieler2)
+                else:
+                    zustellung.text = verein_text(spiel, spieler1, spieler2)
+                Zustellung.update(text=zustellung.text).where(Zustellung.id == zustellung.id).execute()
+            msg = await send_message(chat.chat_id, zustellung.text, kind=zustellung.art)
+        except Exception as e:
+            NOTIFICATIONS_FAILED.inc(kind=zustellung.art)
+            Zustellung.update(
+                versuche=Zustellung.versuche + 1,
+                fehler=str(e),
+            ).where(Zustellung.id == zustellung.id).execute()
+            print(f"---- Error notifying chat {chat.name} about game {spiel.id} ({zustellung.art}): {e}")
+            raise
+    Zustellung.update(
+        gesendet=datetime.now(),
+        message_id=msg.id,
+        versuche=Zustellung.versuche + 1,
+        fehler=None,
+    ).where(Zustellung.id == zustellung.id).execute()
+    NOTIFICATIONS_SENT.inc(kind=zustellung.art)
+    await save_message(msg)
+    print(f"Notify chat {chat.name} about new game: {spieler1} vs {spieler2} in {spiel.konkurrenz.name} at Tisch {spiel.tisch}.")
+
+
+async def spiel_text(spiel: Spiel, chat: Chat, spieler1: Teilnehmer, spieler2: Teilnehmer) -> str:
+    """
+    Message to a player about their new game, written by the LLM.
+    """
+    person = ""
+    if chat.nickname and chat.me:
+        person = f"Du schreibst mit {chat.nickname} auf Telegram, die mit vollem Namen {chat.me.vorname} {chat.me.nachname} ist."
+    elif chat.me:
+        person = f"Du schreibst mit {chat.me.vorname} {chat.me.nachname} auf Telegram."
+
+    instructions = NOTIFICATION_PROMPT.format(person=person, turnier=tournaments.current().beschreibung)
+    instructions += ("\n\n Spreche den Chatpartner mit 'du' an, nicht mit Namen. \n"
+                     "Wichtig! Erwähne in der Nachricht KEINE QTTR Werte der Spieler! Du kannst andeuten ob der Gegner (viel) stärker/schwächer ist. "
+                     "Dabei sind 10 Punkte sind ein kleiner Unterschied, 200 Punkte ein großer Unterschied.\n"
+                     "Die Emojis geben an wie stark der Spieler und der Gegner ist."
+                     "Gib das Emoji des Gegners auf jeden Fall nach dem Namen des Gegners an!\n")
+
+    muss_holen = False
+    if chat.me.id == spieler1.id:
+        gegner = spieler2
+        muss_holen = True
+    else:
+        gegner = spieler1
         muss_holen = False
-        if chat.me.id == spieler1.id:
-            gegner = spieler2
-            muss_holen = True
-        else:
-            gegner = spieler1
-            muss_holen = False
-        emoji_gegner = ttr_to_emoji(gegner.qttr)
-        me_emoji = ttr_to_emoji(chat.me.qttr) if chat.me else ""
-        instructions += f"Dein Chatpartner ({me_emoji} QTTR: {chat.me.qttr}) spielt gegen {gegner.vorname} {gegner.nachname} ({emoji_gegner} QTTR: {gegner.qttr}) in {spiel.konkurrenz.name} ({spiel.typ}) am Tisch {spiel.tisch}.\n"
-        instructions += "\nInformiere deinen Chatpartner in einer lockeren Nachricht über das neue Spiel von ihm/ihr, insbesondere den Gegner und Tisch. \n"
-        if muss_holen:
-            instructions += "Erwähne auch, dass er/sie den Becher abholen muss!"
-        else:
-            instructions += f"Erwähne auch, dass er/sie direkt zum Tisch {spiel.tisch} gehen kann, der Gegner holt den Becher!"
-        response = client.models.generate_content(
-            model=NOTIFICATION_MODEL,
-            contents=instructions,
-        )
-        msg = await telegram_bot.send_message(chat_id=chat.chat_id, text=response.text)
-        await save_message(msg)
-
-
-        print(f"Notify chat {chat.name} about new game: {spieler1} vs {spieler2} in {spiel.konkurrenz.name} at Tisch {spiel.tisch}.")
-    await notify_verein(spiel)
-
-    spiel.notifications_sent = True
-    spiel.save()
-
-async def notify_verein(spiel: Spiel):
+    emoji_gegner = ttr_to_emoji(gegner.qttr)
+    me_emoji = ttr_to_emoji(chat.me.qttr) if chat.me else ""
+    instructions += f"Dein Chatpartner ({me_emoji} QTTR: {chat.me.qttr}) spielt gegen {gegner.vorname} {gegner.nachname} ({emoji_gegner} QTTR: {gegner.qttr}) in {spiel.konkurrenz.name} ({spiel.typ}) am Tisch {spiel.tisch}.\n"
+    chance = round(siegchance(chat.me, gegner, spiel.konkurrenz) * 100)
+    instructions += f"Die Siegchance deines Chatpartners liegt laut TTR bei ~{chance} %. Nenne sie in der Nachricht, z.B. \"Gegner X, ~{chance} % Siegchance\".\n"
+    instructions += "\nInformiere deinen Chatpartner in einer lockeren Nachricht über das neue Spiel von ihm/ihr, insbesondere den Gegner und Tisch. \n"
+    if muss_holen:
+        instructions += "Erwähne auch, dass er/sie den Becher abholen muss!"
+    else:
+        instructions += f"Erwähne auch, dass er/sie direkt zum Tisch {spiel.tisch} gehen kann, der Gegner holt den Becher!"
+    try:
+        with timed(GEMINI_REQUEST_SECONDS, purpose="notification"):
+            # The async client, so the messages of one game are generated in parallel
+            response = await get_client().aio.models.generate_content(
+                model=NOTIFICATION_MODEL,
+                contents=instructions,
+            )
+    except Exception:
+        GEMINI_ERRORS.inc(purpose="notification")
+        raise
+    return response.text
+
+
+def verein_text(spiel: Spiel, spieler1: Teilnehmer, spieler2: Teilnehmer) -> str:
     """
-    Notify the Vereins about a new game.
-    This function should be called whenever a new game is created.
+    Message to the chats following the club of one of the players.
     """
-
-    spieler1 = Teilnehmer.get(Teilnehmer.id == spiel.spieler1.id)
-    spieler2 = Teilnehmer.get(Teilnehmer.id == spiel.spieler2.id)
-
-    # Get Vereins from Spiel
-    verein1 = spiel.spieler1.verein
-    verein2 = spiel.spieler2.verein
-
-    # Get all chats which monitor one of the Vereins
-    chats = Chat.select().where(
-        (Chat.verein_notification == verein1) | (Chat.verein_notification == verein2)
-    ).execute()
+    verein1 = spieler1.verein
+    verein2 = spieler2.verein
     emoji_spieler1 = ttr_to_emoji(spieler1.qttr)
     emoji_spieler2 = ttr_to_emoji(spieler2.qttr)
-    message = f"Neues Spiel:\n {spieler1.vorname} {spieler1.nachname} {emoji_spieler1} ({verein1.name})\nvs\n{spieler2.vorname} {spieler2.nachname} {emoji_spieler2} ({verein2.name}) in {spiel.konkurrenz.name} ({spiel.typ}) am Tisch {spiel.tisch}."
-    for chat in chats:
-        if chat.me != spieler1 and chat.me != spieler2:
-            # Here you would implement the logic to send a message to the chat.
-            # For example, using a Telegram bot or another messaging service.
-            msg = await telegram_bot.send_message(chat_id=chat.chat_id, text=message)
-            await save_message(msg)
-
-        print(f"Notify chat {chat.name} about new game: {spieler1} vs {spieler2} in {spiel.konkurrenz.name} at Tisch {spiel.tisch}.")
-
+    return f"Neues Spiel:\n {spieler1.vorname} {spieler1.nachname} {emoji_spieler1} ({verein1.name})\nvs\n{spieler2.vorname} {spieler2.nachname} {emoji_spieler2} ({verein2.name}) in {spiel.konkurrenz.name} ({spiel.typ}) am Tisch {spiel.tisch}."
 
 
 async def notify_game_result(spiel: Spiel):
@@ -122,4 +194,4 @@ async def notify_game_result(spiel: Spiel):
     Notify about the result of a game.
     This function should be called whenever a game result is updated.
     """
-    pass
\ No newline at end of file
+    pass
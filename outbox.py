@@ -0,0 +1,119 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import List
+
+from telegram.ext import ContextTypes
+
+from metrics import Counter, QUEUE_DEPTH
+from models import db, OutboxEreignis, Spiel
+from notify import notify_new_spiel, notify_game_result
+import tournaments
+
+# Durable outbox between scraper and bot processes.
+# The scraper publishes one event per new game / result into the tournament database, bot processes claim
+# events with a lease, deliver them and mark them as done. A crashed or failing delivery is retried after the
+# lease expired (at-least-once), publishing the same event twice is a no-op.
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", "1"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "20"))
+OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", "120"))
+OUTBOX_MAX_BACKOFF = int(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+SPIEL_NEU = "spiel_neu"
+SPIEL_ERGEBNIS = "spiel_ergebnis"
+
+HANDLERS = {
+    SPIEL_NEU: notify_new_spiel,
+    # Not published while there are no result notifications, drains the events of older versions
+    SPIEL_ERGEBNIS: notify_game_result,
+}
+
+OUTBOX_PUBLISHED = Counter("outbox_published_total", "Events written to the outbox", ("art",))
+OUTBOX_DELIVERED = Counter("outbox_delivered_total", "Events delivered from the outbox", ("art",))
+OUTBOX_FAILED = Counter("outbox_failed_total", "Failed delivery attempts", ("art",))
+
+
+def publish(art: str, spiel: Spiel) -> bool:
+    """
+    Write an event for the game into the outbox of the current tournament.
+    :return: True if the event is new, False if it was already published
+    """
+    created = OutboxEreignis.insert(
+        art=art,
+        schluessel=f"{art}:{spiel.id}",
+        spiel=spiel,
+    ).on_conflict_ignore().as_rowcount().execute() > 0
+    if created:
+        OUTBOX_PUBLISHED.inc(art=art)
+    return created
+
+
+def claim(limit: int = OUTBOX_BATCH) -> List[OutboxEreignis]:
+    """
+    Lease up to `limit` pending events for this worker.
+    """
+    now = datetime.now()
+    with db.atomic("IMMEDIATE"):
+        pending = (OutboxEreignis
+                   .select(OutboxEreignis.id)
+                   .where(OutboxEreignis.erledigt.is_null() &
+                          (OutboxEreignis.gesperrt_bis.is_null() | (OutboxEreignis.gesperrt_bis < now)))
+                   .order_by(OutboxEreignis.id)
+                   .limit(limit))
+        ids = [e.id for e in pending]
+        if not ids:
+            return []
+        OutboxEreignis.update(
+            gesperrt_von=WORKER_ID,
+            gesperrt_bis=now + timedelta(seconds=OUTBOX_LEASE),
+            versuche=OutboxEreignis.versuche + 1,
+        ).where(OutboxEreignis.id.in_(ids)).execute()
+    return list(OutboxEreignis.select().where(OutboxEreignis.id.in_(ids)).order_by(OutboxEreignis.id))
+
+
+async def deliver(ereignis: OutboxEreignis) -> bool:
+    handler = HANDLERS.get(ereignis.art)
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown outbox event: {ereignis.art}")
+        await handler(ereignis.spiel)
+    except Exception as e:
+        OUTBOX_FAILED.inc(art=ereignis.art)
+        backoff = min(2 ** ereignis.versuche, OUTBOX_MAX_BACKOFF)
+        OutboxEreignis.update(
+            gesperrt_bis=datetime.now() + timedelta(seconds=backoff),
+            fehler=str(e),
+        ).where(OutboxEreignis.id == ereignis.id).execute()
+        print(f"---- Error delivering {ereignis.schluessel} (attempt {ereignis.versuche}), retry in {backoff}s: {e}")
+        return False
+    OutboxEreignis.update(erledigt=datetime.now(), fehler=None).where(OutboxEreignis.id == ereignis.id).execute()
+    OUTBOX_DELIVERED.inc(art=ereignis.art)
+    return True
+
+
+async def deliver_pending():
+    """
+    Deliver the pending events of the current tournament.
+    """
+    while True:
+        ereignisse = claim()
+        if not ereignisse:
+            break
+        for ereignis in ereignisse:
+            await deliver(ereignis)
+        if len(ereignisse) < OUTBOX_BATCH:
+            break
+    QUEUE_DEPTH.set(
+        OutboxEreignis.select().where(OutboxEreignis.erledigt.is_null()).count(),
+        queue=f"outbox:{tournaments.current().slug}"
+    )
+
+
+async def deliver_outbox(context: ContextTypes.DEFAULT_TYPE = None):
+    """
+    Job: deliver the pending events of all tournaments.
+    """
+    for tournament in tournaments.all_tournaments():
+        with tournaments.use(tournament):
+            await deliver_pending()
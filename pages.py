@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from bs4 import BeautifulSoup
+
+from metrics import QUEUE_DEPTH
+
+# Parsers for the pages of httv.de. They only turn html into plain lists and dicts, without any database access,
+# so they can run in a worker pool and the (CPU bound) parsing of e.g. starters.html doesn't block the event loop.
+#
+# PARSE_POOL selects the pool: "process" (default, parses in parallel on several cores), "thread" or "none"
+# (parse on the event loop like before). The pool is created on first use and reused by all polls and tournaments.
+PARSE_POOL = os.getenv("PARSE_POOL", "process")
+if PARSE_POOL not in ("process", "thread", "none"):
+    raise ValueError(f"Unknown PARSE_POOL: {PARSE_POOL}")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+T = TypeVar("T")
+_pool: Optional[Executor] = None
+
+
+def get_pool() -> Optional[Executor]:
+    global _pool
+    if _pool is None and PARSE_POOL != "none":
+        if PARSE_POOL == "process":
+            # Forking the bot with its running threads (job queue, http pool) is not safe, start fresh workers
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=get_context("spawn"))
+        else:
+            _pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+    return _pool
+
+
+async def parse(func: Callable[[str], T], html_content: str) -> T:
+    """
+    Run one of the parse functions below in the worker pool.
+    """
+    pool = get_pool()
+    if pool is None:
+        return func(html_content)
+    QUEUE_DEPTH.inc(queue="parse")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, html_content)
+    finally:
+        QUEUE_DEPTH.dec(queue="parse")
+
+
+def html_to_unicode(text: str) -> str:
+    """
+    Convert HTML entities such as &uuml; to their unicode equivalents.
+    """
+    return text.replace('&uuml;', 'ü').replace('&ouml;', 'ö').replace('&auml;', 'ä').replace('&szlig;', 'ß')
+
+
+def _link(cell) -> Optional[str]:
+    return cell.find('a').get('href') if cell.find('a') else None
+
+
+def parse_active_tables(html_content: str) -> Tuple[Optional[List[Dict]], Optional[List[Dict]]]:
+    """
+    Parse active_tables.html.
+    :return: (active tables, games ended in the last 30 minutes), None if the page has no such table
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    active_tables = None
+    active_table = soup.find('table', class_='mktt_active_tables')
+    if active_table:
+        active_tables = []
+        for row in active_table.find_all('tr')[1:]:  # Skip header row
+            cols = row.find_all('td')
+            if len(cols) != 5:  # Ensure we have the right number of columns
+                continue
+            active_tables.append({
+                "row": row.text,
+                "tisch": cols[0].text.strip(),
+                "spieler1": html_to_unicode(cols[1].text.strip()),
+                "spieler2": html_to_unicode(cols[2].text.strip()),
+                "klasse": html_to_unicode(cols[3].text.strip()),
+                "klasse_link": _link(cols[3]),
+                "typ": html_to_unicode(cols[4].text.strip()),
+            })
+
+    ended_games = None
+    ended_games_section = soup.find('table', class_='mktt_group_single_results')
+    if ended_games_section:
+        ended_games = []
+        for row in ended_games_section.find_all('tr')[1:]:
+            cols = row.find_all('td')
+            if len(cols) != 5:
+                continue
+            # Points are in the title of the result: <SPAN class='mktt_ko_ergebnisse' title='11 : 6 ...'>3 : 0</SPAN>
+            span = cols[4].find('span', class_='mktt_ko_ergebnisse')
+            ended_games.append({
+                "uhrzeit": cols[0].text.strip(),
+                "spieler1": html_to_unicode(cols[1].text.strip()),
+                "spieler2": html_to_unicode(cols[2].text.strip()),
+                "klasse": html_to_unicode(cols[3].text.strip()),
+                "klasse_link": _link(cols[3]),
+                "ergebnis_satz": html_to_unicode(cols[4].text.strip()),
+                "ergebnis_punkte": html_to_unicode(span.get('title', '') if span else '').strip(),
+            })
+    return active_tables, ended_games
+
+
+def parse_konkurrenzen(html_content: str) -> List[Tuple[str, str]]:
+    """
+    Parse the navigation of index.html.
+    :return: (name, link) of every competition
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    return [(html_to_unicode(link.text.strip()), link.get('href'))
+            for link in soup.find_all('a', class_='mktt_nav_link')]
+
+
+def parse_starters(html_content: str) -> Dict[str, Dict]:
+    """
+    Parse starters.html into its competition sections. Several sections can belong to the same competition,
+    they are hashed together so unchanged competitions can be skipped.
+    :return: Competition name -> {"hash": ..., "rows": [[id, nachname, vorname, verein, qttr], ...], "invalid": [...]}
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    parts: Dict[str, list] = {}
+    for konkurrenz in soup.find_all('span', class_='mktt_grouptype'):
+        name = html_to_unicode(konkurrenz.text.strip())
+        name = name.split(":")[0].strip()  # Remove any additional text after the colon
+        # Remove "Einzel" or "Doppel" from the name if present
+        name = name.replace(" Einzel", "").replace("Doppelkonkurrenz", "konkurrenz").strip()
+        teilnehmer_table = konkurrenz.find_next('table')
+        if teilnehmer_table is not None:
+            parts.setdefault(name, []).append((konkurrenz, teilnehmer_table))
+    sections = {}
+    for name, section_parts in parts.items():
+        rows = []
+        invalid = []
+        for _, table in section_parts:
+            for row in table.find_all("tr")[1:]:
+                infos = row.find_all("td")
+                if len(infos) != 5:
+                    invalid.append(f"{row} {row.text}")
+                    continue
+                rows.append([html_to_unicode(info.text.strip()) for info in infos])
+        sections[name] = {
+            "hash": hashlib.sha1("".join(f"{span}{table}" for span, table in section_parts).encode()).hexdigest(),
+            "rows": rows,
+            "invalid": invalid,
+        }
+    return sections
+
+
+def _header_names(table) -> List[str]:
+    return [html_to_unicode(th.text.strip()).lower() for th in table.find_all('th')]
+
+
+def _group_name(table) -> Optional[str]:
+    heading = table.find_previous(class_='mktt_gruppen_ueberschrift')
+    if heading:
+        return html_to_unicode(heading.text.strip())
+    return None
+
+
+def parse_konkurrenz_page(html_content: str) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Parse a competition page (group or bracket view).
+    The layout differs between group and ko pages, so tables are identified by their header row:
+    Tables with two "Spieler" columns list matches, rows without a result are upcoming pairings.
+    Tables with a "Platz"/"Rang" column are group standings.
+    :return: (pairings, standings) as lists of plain dicts
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    pairings = []
+    standings = []
+    for table in soup.find_all('table'):
+        headers = _header_names(table)
+        if not headers:
+            continue
+        gruppe = _group_name(table)
+        spieler_cols = [i for i, h in enumerate(headers) if h.startswith("spieler")]
+        ergebnis_cols = [i for i, h in enumerate(headers) if "ergebnis" in h or "sätze" in h or "saetze" in h]
+        platz_cols = [i for i, h in enumerate(headers) if h in ("platz", "rang", "pl.")]
+
+        if len(spieler_cols) >= 2:
+            for row in table.find_all('tr')[1:]:
+                cols = row.find_all('td')
+                if len(cols) != len(headers):
+                    continue
+                if ergebnis_cols and cols[ergebnis_cols[0]].text.strip() not in ("", "-", ":"):
+                    # Already played
+                    continue
+                pairings.append({
+                    "gruppe": gruppe,
+                    "spieler1": html_to_unicode(cols[spieler_cols[0]].text.strip()),
+                    "spieler2": html_to_unicode(cols[spieler_cols[1]].text.strip()),
+                })
+        elif platz_cols:
+            name_cols = [i for i, h in enumerate(headers) if h.startswith("spieler") or h == "name"]
+            if not name_cols:
+                continue
+            spiele_cols = [i for i, h in enumerate(headers) if h in ("spiele", "siege", "bilanz")]
+            for row in table.find_all('tr')[1:]:
+                cols = row.find_all('td')
+                if len(cols) != len(headers):
+                    continue
+                try:
+                    platz = int(cols[platz_cols[0]].text.strip().rstrip('.'))
+                except ValueError:
+                    continue
+                standings.append({
+                    "gruppe": gruppe,
+                    "platz": platz,
+                    "name": html_to_unicode(cols[name_cols[0]].text.strip()),
+                    "spiele": cols[spiele_cols[0]].text.strip() if spiele_cols else None,
+                    "saetze": cols[ergebnis_cols[0]].text.strip() if ergebnis_cols else None,
+                })
+    return pairings, standings
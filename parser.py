@@ -2,37 +2,41 @@ from datetime import datetime
 from typing import Dict
 import os
 import httpx
-from bs4 import BeautifulSoup
 from telegram.ext import ContextTypes
 from thefuzz import process
 
-from models import Konkurrenz, Teilnehmer, Verein, Spiel
-from notify import notify_new_spiel, notify_game_result
+from metrics import SCRAPE_STAGE_SECONDS, StageTimer, track_cycle
+from sqlprofile import profiled
+from models import db, Konkurrenz, Teilnehmer, Verein, Spiel, RosterSection
+from outbox import publish, SPIEL_NEU
+import board
+import pages
+import roster
+import stats
+import timeline
+import tournaments
 
+# One connection pool for all tournaments and jobs
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+_http_client = None
 
-base_url = os.getenv("BASE_URL", "https://www.httv.de/mktt_getPage.php?url=012/48._internationales_sandershaeuser_tischtennis-pfingstturnier_2025-06-06/")
-#base_url = "https://www.httv.de/mktt_getPage.php?url=012/47._internationales_sandershaeuser_tischtennis-pfingstturnier_2024-05-17/"
-#base_url = "https://www.httv.de/mktt_getPage.php?url=012/48._internationales_sandershaeuser_tischtennis-pfingstturnier_2025-06-06/"
 
-active_tables_url = f"{base_url}active_tables.html"
-konkurrenzen_url = f"{base_url}index.html"
-teilnehmer_url = f"{base_url}starters.html"
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+            timeout=15
+        )
+    return _http_client
 
 
 async def fetch_url(url) -> str:
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        if response.status_code == 200:
-            return response.text
-        else:
-            raise Exception(f"Failed to fetch URL: {url} with status code {response.status_code}")
-
-def html_to_unicode(text: str) -> str:
-    """
-    Convert HTML entities such as &uuml; to their unicode equivalents.
-    """
-    return text.replace('&uuml;', 'ü').replace('&ouml;', 'ö').replace('&auml;', 'ä').replace('&szlig;', 'ß')
-
+    response = await get_http_client().get(url)
+    if response.status_code == 200:
+        return response.text
+    else:
+        raise Exception(f"Failed to fetch URL: {url} with status code {response.status_code}")
 
 async def get_konkurrenz_by_name(name: str) -> Konkurrenz:
     """
@@ -58,10 +62,8 @@ async def get_teilnehmer_by_name(name: str) -> Teilnehmer:
     """
     if name.lower() == "unbekannt":
         # Create a dummy participant for "Unbekannt" if not already exists
-        try:
-            teilnehmer = Teilnehmer.get(Teilnehmer.nachname == "los", Teilnehmer.vorname == "Frei")
-            return teilnehmer
-        except Teilnehmer.DoesNotExist:
+        teilnehmer = roster.find_by_name("los", "Frei")
+        if teilnehmer is None:
             verein, _ = Verein.get_or_create(name="Freilos")
             teilnehmer = Teilnehmer.create(
                 nachname="los",
@@ -69,24 +71,20 @@ async def get_teilnehmer_by_name(name: str) -> Teilnehmer:
                 qttr=0,
                 verein=verein
             )
-            return teilnehmer
-    try:
-        # Split the name into last and first name
-        if name.count(', ') != 1:
-            raise ValueError(f"Invalid name format: {name}. Expected format is 'Nachname, Vorname'.")
-        last_name, first_name = name.split(', ')
-        last_name = last_name.strip()
-        first_name = first_name.strip()
-        teilnehmer = Teilnehmer.get(
-            (Teilnehmer.nachname == last_name) & (Teilnehmer.vorname == first_name)
-        )
+            roster.bump()
         return teilnehmer
-    except Teilnehmer.DoesNotExist:
-        raise ValueError(f"No participant found with name: {name}")
-    except ValueError:
+    # Split the name into last and first name
+    if name.count(', ') != 1:
         raise ValueError(f"Invalid name format: {name}. Expected format is 'Nachname, Vorname'.")
+    last_name, first_name = name.split(', ')
+    teilnehmer = roster.find_by_name(last_name.strip(), first_name.strip())
+    if teilnehmer is None:
+        raise ValueError(f"No participant found with name: {name}")
+    return teilnehmer
 
 
+@track_cycle("active_tables", lambda: tournaments.current().poll_interval)
+@profiled("scrape:active_tables")
 async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
     '''
     Parse active table
@@ -102,29 +100,38 @@ async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
         11 : 8'>3 : 0</SPAN></TD></TR>
     </TABLE>
     '''
-    html_content = await fetch_url(active_tables_url)
-    soup = BeautifulSoup(html_content, 'html.parser')
+    stage = StageTimer(SCRAPE_STAGE_SECONDS, job="active_tables")
+    try:
+        return await _process_active_tables(stage)
+    finally:
+        stage.observe()
+
+
+async def _process_active_tables(stage: StageTimer):
+    with stage("fetch"):
+        html_content = await fetch_url(tournaments.current().url("active_tables.html"))
+    with stage("parse"):
+        active_table, ended_games_section = await pages.parse(pages.parse_active_tables, html_content)
 
     active_tables = []
+    belegt = set()
 
-    # Parse active tables
-    active_table = soup.find('table', class_='mktt_active_tables')
-    #headers = ["Tisch", "Spieler 1", "Spieler 2", "Klasse", "Typ"]
-    if active_table:
-        rows = active_table.find_all('tr')[1:]  # Skip header row
-        for row in rows:
-            cols = row.find_all('td')
-            if len(cols) == 5:  # Ensure we have the right number of columns
-                try:
-                    tisch = int(cols[0].text.strip())
-                except ValueError:
-                    print(f"Invalid table number: {row.text}")
-                    continue
-                spieler1 = html_to_unicode(cols[1].text.strip())
-                spieler2 = html_to_unicode(cols[2].text.strip())
-                klasse_link = cols[3].find('a').get('href') if cols[3].find('a') else None
-                klasse = html_to_unicode(cols[3].text.strip())
-                typ = html_to_unicode(cols[4].text.strip())
+    # Active tables
+    if active_table is not None:
+        for row in active_table:
+            try:
+                tisch = int(row["tisch"])
+            except ValueError:
+                print(f"Invalid table number: {row['row']}")
+                continue
+            # Listed tables stay occupied, even if the row can't be resolved in this cycle
+            belegt.add(tisch)
+            spieler1 = row["spieler1"]
+            spieler2 = row["spieler2"]
+            klasse_link = row["klasse_link"]
+            klasse = row["klasse"]
+            typ = row["typ"]
+            with stage("resolve"):
                 # Find konkurrenz by link
                 konkurrenz = None
                 if klasse_link:
@@ -144,6 +151,7 @@ async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
                     print(f"Error finding participants: {e}")
                     continue
 
+            with stage("db_write"):
                 # Find or create Spiel object
                 try:
                     spiel = Spiel.get(
@@ -162,44 +170,38 @@ async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
                         typ=typ
                     )
                     print(f"Created new game: {spiel}")
-                # Notify about the new game
-                try:
-                    await notify_new_spiel(spiel)
-                except Exception as e:
-                    print(f"---- Error notifying about new game {spiel}: {e}")
-                    continue
+                timeline.current().start(spiel)
+            # Hand the new game to the outbox, a bot process sends the notifications
+            if not spiel.notifications_sent:
+                with stage("notify"):
+                    publish(SPIEL_NEU, spiel)
+                    spiel.notifications_sent = True
+                    spiel.save()
 
-                table_data = {
-                    "Tisch": cols[0].text.strip(),
-                    "Spieler 1": cols[1].text.strip(),
-                    "Spieler 2": cols[2].text.strip(),
-                    "Klasse": cols[3].text.strip(),
-                    "Typ": cols[4].text.strip()
-                }
-                active_tables.append(table_data)
+            table_data = {
+                "Tisch": row["tisch"],
+                "Spieler 1": spieler1,
+                "Spieler 2": spieler2,
+                "Klasse": klasse,
+                "Typ": typ
+            }
+            active_tables.append(table_data)
     else:
         print("No active tables found.")
     ended_games = []
 
-    # Parse ended games
-    ended_games_section = soup.find('table', class_='mktt_group_single_results')
-    if ended_games_section:
-        rows = ended_games_section.find_all('tr')[1:]  # Skip header row
-        for row in rows:
-            cols = row.find_all('td')
-            if len(cols) == 5:  # Ensure we have the right number of columns
-                spieler1 = html_to_unicode(cols[1].text.strip())
-                spieler2 = html_to_unicode(cols[2].text.strip())
-                klasse = html_to_unicode(cols[3].text.strip())
-                klasse_link = cols[3].find('a').get('href') if cols[3].find('a') else None
-                typ = html_to_unicode(cols[4].text.strip())
-                end_game_time = datetime.strptime(cols[0].text.strip(), '%H:%M').time()
-                result_sets = html_to_unicode(cols[4].text.strip())
-                # Parse result points from title attribute
-                # Example: <SPAN class='mktt_ko_ergebnisse' title='11 : 6
-                #         11 : 6
-                #         11 : 8'>3 : 0</SPAN>
-                result_points = html_to_unicode(cols[4].find('span', class_='mktt_ko_ergebnisse').get('title', '')).strip()
+    # Ended games
+    if ended_games_section is not None:
+        for row in ended_games_section:
+            spieler1 = row["spieler1"]
+            spieler2 = row["spieler2"]
+            klasse = row["klasse"]
+            klasse_link = row["klasse_link"]
+            typ = row["ergebnis_satz"]
+            end_game_time = datetime.strptime(row["uhrzeit"], '%H:%M').time()
+            result_sets = row["ergebnis_satz"]
+            result_points = row["ergebnis_punkte"]
+            with stage("resolve"):
                 # Find konkurrenz by link
                 konkurrenz = None
                 if klasse_link:
@@ -224,6 +226,7 @@ async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
                 except ValueError as e:
                     print(f"Error finding competition for klasse {klasse}: {e}")
 
+            with stage("db_write"):
                 try:
                     game = Spiel.get(
                         (Spiel.spieler1 == spieler1_obj) &
@@ -239,7 +242,7 @@ async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
                         konkurrenz=konkurrenz,
                         typ=typ
                     )
-                    print(f"Found new ended game: {spiel}")
+                    print(f"Found new ended game: {game}")
                 if not game.end:
                     if not game.tisch:
                         game.tisch = -1
@@ -248,29 +251,33 @@ async def fetch_active_tables(context: ContextTypes.DEFAULT_TYPE):
                     game.ergebnis_satz = result_sets
                     game.ergebnis_punkte = result_points
                     game.save()
+                    stats.record_result(game)
+                    timeline.current().finish(game)
                     print(f"Saved ended game: {game.spieler1.nachname} - {game.spieler2.nachname} in {game.konkurrenz.name} with result {game.ergebnis_satz}")
 
     else:
         print("No ended games found.")
+    # Tables that are no longer listed are free again. After the ended games, which close their tables with the
+    # exact end time
+    timeline.current().seen(belegt)
 
+    # Hall displays read the board from memory, so it is rebuilt here once per cycle
+    with stage("board"):
+        board.refresh()
 
     return active_table, ended_games
 
 
 
+@profiled("scrape:konkurrenzen")
 async def fetch_konkurrenzen():
     try:
-        html_content = await fetch_url(konkurrenzen_url)
+        html_content = await fetch_url(tournaments.current().url("index.html"))
     except Exception as e:
         print(f"Error fetching competitions: {e}")
         return
-    soup = BeautifulSoup(html_content, 'html.parser')
-    x=5
-    # Get class class='mktt_nav_link'
-    konkurrenzen = soup.find_all('a', class_='mktt_nav_link')
-    for konkurrenz in konkurrenzen:
-        name = html_to_unicode(konkurrenz.text.strip())
-        href = konkurrenz.get('href')
+    konkurrenzen = await pages.parse(pages.parse_konkurrenzen, html_content)
+    for name, href in konkurrenzen:
         # Check if same competition already exists, if so, update the link if different
         if Konkurrenz.select().where(Konkurrenz.name == name).exists():
             existing_konkurrenz = Konkurrenz.get(Konkurrenz.name == name)
@@ -283,20 +290,31 @@ async def fetch_konkurrenzen():
             print(f"Added competition: {name} with link {href}")
 
 
+@track_cycle("roster", lambda: tournaments.current().roster_interval)
+@profiled("scrape:roster")
 async def fetch_teilnehmer():
+    stage = StageTimer(SCRAPE_STAGE_SECONDS, job="roster")
     try:
-        html_content = await fetch_url(teilnehmer_url)
+        with stage("fetch"):
+            html_content = await fetch_url(tournaments.current().url("starters.html"))
     except Exception as e:
         print(f"Error fetching participants: {e}")
         return
-    soup = BeautifulSoup(html_content, 'html.parser')
-    # Find all konkurrenzen class='mktt_grouptype'
-    konkurrenzen = soup.find_all('span', class_='mktt_grouptype')
-    for konkurrenz in konkurrenzen:
-        name = html_to_unicode(konkurrenz.text.strip())
-        name = name.split(":")[0].strip()  # Remove any additional text after the colon
-        # Remove "Einzel" or "Doppel" from the name if present
-        name = name.replace(" Einzel", "").replace("Doppelkonkurrenz", "konkurrenz").strip()
+    with stage("parse"):
+        sections = await pages.parse(pages.parse_starters, html_content)
+    with stage("db_write"):
+        await _store_teilnehmer(sections)
+    stage.observe()
+
+
+async def _store_teilnehmer(sections: Dict[str, Dict]):
+    changed = 0
+    for name, parsed in sections.items():
+        # Only sections that changed since the last sync are processed again
+        section_hash = parsed["hash"]
+        section = RosterSection.get_or_none(RosterSection.name == name)
+        if section is not None and section.hash == section_hash:
+            continue
         # Get the corresponding Konkurrenz object
         try:
             konkurrenz_obj = await get_konkurrenz_by_name(name)
@@ -304,65 +322,84 @@ async def fetch_teilnehmer():
             print(e)
             continue
 
-        teilnehmer_table = konkurrenz.find_next('table')
-        teilnehmer_rows = teilnehmer_table.find_all("tr")[1:]
+        with db.atomic():
+            _store_section(name, konkurrenz_obj, parsed)
+            RosterSection.insert(name=name, hash=section_hash, aktualisiert=datetime.now()).on_conflict_replace().execute()
+        changed += 1
+    if changed:
+        roster.bump()
+    print(f"Finished fetching all participants, {changed} of {len(sections)} competitions changed.")
 
-        for row in teilnehmer_rows:
-            # infos: id, nachname, vorname, verein, qttr
-            infos = row.find_all("td")
-            if len(infos) != 5:
-                print(f"Unexpected number of columns in row: {row} {row.text}")
-                continue
-            id_exists = infos[0].text.strip().isdigit()
-            if id_exists:
-                id = int(infos[0].text.strip())
-            nachname = html_to_unicode(infos[1].text.strip())
-            vorname = html_to_unicode(infos[2].text.strip())
-            verein_name = html_to_unicode(infos[3].text.strip())
-            qttr = int(infos[4].text.strip())
-            if not id_exists:
-                # Try to find existing participant by name, verein and qttr
-                try:
-                    teilnehmer = Teilnehmer.get(
-                        (Teilnehmer.vorname == vorname) &
-                        (Teilnehmer.nachname == nachname) &
-                        (Teilnehmer.qttr == qttr)
-                    )
-                    id = teilnehmer.id  # Use existing ID
-                except Teilnehmer.DoesNotExist:
-                    # If no existing participant found, set id to not used value starting from 1000000
-                    id = 1000
-                    found_id = True
-                    while found_id:
-                        try:
-                            Teilnehmer.get(Teilnehmer.id == id)
-                            id += 1  # Increment ID until a free one is found
-                        except Teilnehmer.DoesNotExist:
-                            found_id = False
-            # Check if teilnehmer already exists
+
+def _store_section(name: str, konkurrenz_obj: Konkurrenz, section: Dict):
+    teilnehmer_rows = section["rows"]
+    for row in section["invalid"]:
+        print(f"Unexpected number of columns in row: {row}")
+    through = Teilnehmer.konkurrenz.get_through_model()
+    linked_ids = {row.teilnehmer_id for row in through.select().where(through.konkurrenz == konkurrenz_obj)}
+    seen_ids = set()
+    vereine: Dict[str, Verein] = {}
+    added = 0
+    updated = 0
+    linked = 0
+    for infos in teilnehmer_rows:
+        # infos: id, nachname, vorname, verein, qttr
+        id_exists = infos[0].isdigit()
+        if id_exists:
+            id = int(infos[0])
+        nachname, vorname, verein_name = infos[1], infos[2], infos[3]
+        qttr = int(infos[4])
+        if verein_name not in vereine:
+            vereine[verein_name], _ = Verein.get_or_create(name=verein_name)
+        verein = vereine[verein_name]
+        if not id_exists:
+            # Try to find existing participant by name and verein, the qttr may have been corrected since
             try:
-                teilnehmer = Teilnehmer.get(Teilnehmer.id == id)
-                print(f"Matched participant: {teilnehmer}")
-            except Teilnehmer.DoesNotExist:
-                # Create new participant
-                verein, created = Verein.get_or_create(name=verein_name)
-                teilnehmer = Teilnehmer.create(
-                    id=id,
-                    vorname=vorname,
-                    nachname=nachname,
-                    qttr=qttr,
-                    verein=verein
+                teilnehmer = Teilnehmer.get(
+                    (Teilnehmer.vorname == vorname) &
+                    (Teilnehmer.nachname == nachname) &
+                    (Teilnehmer.verein == verein)
                 )
-                print(f"Added participant: {teilnehmer}")
-            # Check if the participant is already linked to the competition
-            connection_exists = len(Teilnehmer.konkurrenz.get_through_model().select().where(
-                Teilnehmer.konkurrenz.get_through_model().teilnehmer == teilnehmer,
-                Teilnehmer.konkurrenz.get_through_model().konkurrenz == konkurrenz_obj
-            )) > 0
-            if not connection_exists:
-                teilnehmer.konkurrenz.add(konkurrenz_obj)
-                print(f"Linked participant {teilnehmer} to competition {konkurrenz_obj}")
-            else:
-                print(f"Participant {teilnehmer} already linked to competition {konkurrenz_obj}")
-        print(f"Finished fetching participants for {name}")
-    print("Finished fetching all participants.")
\ No newline at end of file
+                id = teilnehmer.id  # Use existing ID
+            except Teilnehmer.DoesNotExist:
+                # If no existing participant found, set id to not used value starting from 1000000
+                id = 1000
+                found_id = True
+                while found_id:
+                    try:
+                        Teilnehmer.get(Teilnehmer.id == id)
+                        id += 1  # Increment ID until a free one is found
+                    except Teilnehmer.DoesNotExist:
+                        found_id = False
+        # Check if teilnehmer already exists
+        try:
+            teilnehmer = Teilnehmer.get(Teilnehmer.id == id)
+            # Late corrections (QTTR, spelling, club) are applied in place
+            if (teilnehmer.vorname, teilnehmer.nachname, teilnehmer.qttr, teilnehmer.verein_id) != (vorname, nachname, qttr, verein.id):
+                teilnehmer.vorname = vorname
+                teilnehmer.nachname = nachname
+                teilnehmer.qttr = qttr
+                teilnehmer.verein = verein
+                teilnehmer.save()
+                updated += 1
+        except Teilnehmer.DoesNotExist:
+            # Create new participant
+            teilnehmer = Teilnehmer.create(
+                id=id,
+                vorname=vorname,
+                nachname=nachname,
+                qttr=qttr,
+                verein=verein
+            )
+            added += 1
+        # Check if the participant is already linked to the competition
+        seen_ids.add(teilnehmer.id)
+        if teilnehmer.id not in linked_ids:
+            teilnehmer.konkurrenz.add(konkurrenz_obj)
+            linked += 1
+    # Participants that withdrew from the competition
+    withdrawn = linked_ids - seen_ids
+    if withdrawn:
+        through.delete().where((through.konkurrenz == konkurrenz_obj) & through.teilnehmer.in_(withdrawn)).execute()
+    print(f"Finished fetching participants for {name}: {len(teilnehmer_rows)} rows, {added} added, "
+          f"{updated} updated, {linked} linked, {len(withdrawn)} removed")
\ No newline at end of file
@@ -0,0 +1,94 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from models import Konkurrenz, Teilnehmer
+import roster
+import tournaments
+
+# Expected win probabilities from the TTR formula: P(A beats B) = 1 / (1 + 10^((TTR_B - TTR_A) / 150)).
+# The full pairwise matrix of a competition is computed at once with NumPy and cached until the roster changes.
+TTR_SCALE = 150.0
+
+_matrices: Dict[Tuple[str, int], "SiegMatrix"] = {}
+
+
+def win_probability(ttr_a: float, ttr_b: float) -> float:
+    """
+    Probability that a player with ttr_a beats a player with ttr_b.
+    """
+    return 1.0 / (1.0 + 10.0 ** ((ttr_b - ttr_a) / TTR_SCALE))
+
+
+class SiegMatrix:
+    """
+    Pairwise win probabilities of all participants of one competition, matrix[i, j] = P(ids[i] beats ids[j]).
+    """
+
+    def __init__(self, ids: np.ndarray, qttr: np.ndarray, version: tuple):
+        self.ids = ids
+        self.qttr = qttr
+        self.version = version
+        self.index = {int(t_id): i for i, t_id in enumerate(ids)}
+        # Same as the formula above, but with only n powers instead of n^2: P = s_a / (s_a + s_b) with s = 10^(TTR/150)
+        strength = 10.0 ** ((qttr - qttr.max(initial=0.0)) / TTR_SCALE)
+        matrix = np.add.outer(strength, strength)
+        np.divide(strength[:, np.newaxis], matrix, out=matrix)
+        self.matrix = matrix
+
+    def probability(self, teilnehmer_id: int, gegner_id: int) -> Optional[float]:
+        i = self.index.get(teilnehmer_id)
+        j = self.index.get(gegner_id)
+        if i is None or j is None:
+            return None
+        return float(self.matrix[i, j])
+
+    def expected_wins(self) -> np.ndarray:
+        """
+        Expected number of wins of each participant against everyone else in the competition.
+        """
+        # The diagonal (playing against yourself) is always 0.5
+        return self.matrix.sum(axis=1) - 0.5
+
+
+def build_matrix(teilnehmer: list, version: tuple = ()) -> SiegMatrix:
+    ids = np.array([t.id for t in teilnehmer], dtype=np.int64)
+    qttr = np.array([t.qttr for t in teilnehmer], dtype=np.float64)
+    # Participants without a rating (0 / -1) count as average players of the competition
+    unknown = qttr <= 0
+    if unknown.any() and not unknown.all():
+        qttr[unknown] = np.median(qttr[~unknown])
+    return SiegMatrix(ids, qttr, version)
+
+
+def matrix_for(konkurrenz: Konkurrenz) -> SiegMatrix:
+    key = (tournaments.current().slug, konkurrenz.id)
+    cached = _matrices.get(key)
+    if cached is None or cached.version != roster.version():
+        cached = build_matrix(list(konkurrenz.teilnehmer), roster.version())
+        _matrices[key] = cached
+    return cached
+
+
+def siegchance(teilnehmer: Teilnehmer, gegner: Teilnehmer, konkurrenz: Optional[Konkurrenz] = None) -> float:
+    """
+    Win probability of teilnehmer against gegner, from the matrix of the competition if both play in it.
+    """
+    if konkurrenz is not None:
+        probability = matrix_for(konkurrenz).probability(teilnehmer.id, gegner.id)
+        if probability is not None:
+            return probability
+    return win_probability(teilnehmer.qttr, gegner.qttr)
+
+
+def favoriten(konkurrenz: Konkurrenz, limit: int = 10) -> list:
+    """
+    The participants with the most expected wins in the competition.
+    :return: List of (teilnehmer_id, expected_wins) tuples, best first
+    """
+    siege = matrix_for(konkurrenz)
+    if len(siege.ids) == 0:
+        return []
+    expected = siege.expected_wins()
+    order = np.argsort(-expected)[:limit]
+    return [(int(siege.ids[i]), float(expected[i])) for i in order]
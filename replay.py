@@ -0,0 +1,191 @@
+# Record-and-replay benchmark for the scrape-and-notify cycle.
+#
+# Record a tournament day:
+#   python replay.py record recordings/sandershausen-2025 --interval 5 --count 720
+# Replay it offline (speed 0 = as fast as possible, 60 = one recorded minute per second):
+#   python replay.py run recordings/sandershausen-2025 --speed 0
+#
+# A recording is a directory with a manifest.json and one html file per snapshot.
+# The manifest lists the snapshots in order: {"t": seconds since start, "page": "active_tables.html", "file": "..."}
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+PAGES = ["index.html", "starters.html", "active_tables.html"]
+
+
+async def record(directory: str, interval: float, count: int, roster_every: int):
+    import httpx
+
+    base_url = os.getenv("BASE_URL", "https://www.httv.de/mktt_getPage.php?url=012/48._internationales_sandershaeuser_tischtennis-pfingstturnier_2025-06-06/")
+    os.makedirs(directory, exist_ok=True)
+    manifest = []
+    start = time.monotonic()
+    async with httpx.AsyncClient() as client:
+        for cycle in range(count):
+            if cycle % roster_every == 0:
+                pages = PAGES
+            else:
+                pages = ["active_tables.html"]
+            for page in pages:
+                response = await client.get(f"{base_url}{page}")
+                if response.status_code != 200:
+                    print(f"Failed to record {page}: status code {response.status_code}")
+                    continue
+                file_name = f"{len(manifest):05d}_{page}"
+                with open(os.path.join(directory, file_name), "w", encoding="utf-8") as f:
+                    f.write(response.text)
+                manifest.append({"t": round(time.monotonic() - start, 3), "page": page, "file": file_name})
+            with open(os.path.join(directory, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=1)
+            print(f"Recorded cycle {cycle + 1}/{count}")
+            await asyncio.sleep(interval)
+
+
+def load_manifest(directory: str) -> List[Dict]:
+    with open(os.path.join(directory, "manifest.json")) as f:
+        return json.load(f)
+
+
+async def replay(directory: str, speed: float, chats: int, llm_latency: float, telegram_latency: float):
+    # Fresh database and dummy credentials, must happen before the project modules are imported
+    db_dir = tempfile.mkdtemp(prefix="replay-")
+    os.environ["DB_PATH"] = os.path.join(db_dir, "replay.db")
+    os.environ.setdefault("TELEGRAM_API_KEY", "0:replay")
+    os.environ.setdefault("GEMINI_API_KEY", "replay")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import fakes
+    import outbox
+    import parser
+    from models import init_db, Chat, Teilnehmer
+    from sqlprofile import profile
+
+    site = fakes.FakeSite()
+    bot = fakes.FakeBot(latency=telegram_latency)
+    client = fakes.FakeGenaiClient(latency=llm_latency)
+    fakes.install(site=site, bot=bot, client=client)
+    init_db()
+
+    manifest = load_manifest(directory)
+    results = []
+    previous_t = 0.0
+    chats_created = False
+    tracemalloc.start()
+    for entry in manifest:
+        if speed > 0:
+            await asyncio.sleep(max(entry["t"] - previous_t, 0) / speed)
+        previous_t = entry["t"]
+        with open(os.path.join(directory, entry["file"]), encoding="utf-8") as f:
+            site.set_page(entry["page"], f.read())
+
+        if entry["page"] == "index.html":
+            step = parser.fetch_konkurrenzen
+        elif entry["page"] == "starters.html":
+            step = parser.fetch_teilnehmer
+        else:
+            if not chats_created:
+                # Bind the first participants to chats so that notifications are generated
+                for teilnehmer in Teilnehmer.select().limit(chats):
+                    Chat.get_or_create(chat_id=teilnehmer.id, defaults={"name": f"Replay {teilnehmer.id}", "me": teilnehmer})
+                chats_created = True
+            step = parser.fetch_active_tables
+
+        sent_before = len(bot.sent)
+        llm_before = client.calls
+        tracemalloc.reset_peak()
+        memory_before, _ = tracemalloc.get_traced_memory()
+        error = None
+        start = time.perf_counter()
+        with profile(f"replay:{entry['page']}") as queries:
+            try:
+                if step is parser.fetch_active_tables:
+                    await step(None)
+                    # The scraper only publishes, deliver in the same cycle like the combined process does
+                    await outbox.deliver_pending()
+                else:
+                    await step()
+            except Exception as e:
+                error = repr(e)
+        duration = time.perf_counter() - start
+        memory_after, memory_peak = tracemalloc.get_traced_memory()
+        results.append({
+            "page": entry["page"],
+            "latency_ms": duration * 1000,
+            "queries": queries.count,
+            "sql_ms": queries.seconds * 1000,
+            "n_plus_one": queries.n_plus_one(),
+            "alloc_peak_kb": (memory_peak - memory_before) / 1024,
+            "alloc_retained_kb": (memory_after - memory_before) / 1024,
+            "notifications": len(bot.sent) - sent_before,
+            "llm_calls": client.calls - llm_before,
+            "error": error,
+        })
+    tracemalloc.stop()
+    return results
+
+
+def report(results: List[Dict]):
+    print(f"{'#':>5} {'page':<20} {'ms':>9} {'queries':>8} {'sql ms':>8} {'peak kB':>9} {'kept kB':>9} {'notif':>6} {'llm':>4}  error")
+    for i, r in enumerate(results):
+        print(f"{i:>5} {r['page']:<20} {r['latency_ms']:>9.1f} {r['queries']:>8} {r['sql_ms']:>8.1f} {r['alloc_peak_kb']:>9.1f} "
+              f"{r['alloc_retained_kb']:>9.1f} {r['notifications']:>6} {r['llm_calls']:>4}  {r['error'] or ''}")
+    print()
+    for page in PAGES:
+        cycles = [r for r in results if r["page"] == page]
+        if not cycles:
+            continue
+        latencies = sorted(r["latency_ms"] for r in cycles)
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        print(f"{page}: {len(cycles)} cycles, "
+              f"latency mean {statistics.mean(latencies):.1f} ms / p50 {statistics.median(latencies):.1f} ms / p95 {p95:.1f} ms / max {latencies[-1]:.1f} ms, "
+              f"{sum(r['queries'] for r in cycles)} queries, "
+              f"{sum(r['notifications'] for r in cycles)} notifications, "
+              f"{sum(r['llm_calls'] for r in cycles)} LLM calls, "
+              f"{sum(1 for r in cycles if r['error'])} errors")
+        repeated: Dict[str, int] = {}
+        for r in cycles:
+            for shape, count in r["n_plus_one"]:
+                repeated[shape] = max(repeated.get(shape, 0), count)
+        for shape, count in sorted(repeated.items(), key=lambda item: -item[1])[:5]:
+            print(f"    possible N+1: up to {count}x per cycle: {shape}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Record and replay the scrape-and-notify cycle.")
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+
+    record_parser = sub.add_parser("record", help="Record snapshots from the live site (BASE_URL)")
+    record_parser.add_argument("directory")
+    record_parser.add_argument("--interval", type=float, default=5)
+    record_parser.add_argument("--count", type=int, default=720)
+    record_parser.add_argument("--roster-every", type=int, default=120, help="Record index/starters every n cycles")
+
+    run_parser = sub.add_parser("run", help="Replay a recording against local stand-ins")
+    run_parser.add_argument("directory")
+    run_parser.add_argument("--speed", type=float, default=0, help="Time acceleration, 0 = no waiting")
+    run_parser.add_argument("--chats", type=int, default=50, help="Number of participants bound to a chat")
+    run_parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated Gemini latency in seconds")
+    run_parser.add_argument("--telegram-latency", type=float, default=0.0, help="Simulated Telegram latency in seconds")
+    run_parser.add_argument("--json", help="Write the per-cycle results to this file")
+
+    args = arg_parser.parse_args()
+    if args.command == "record":
+        asyncio.run(record(args.directory, args.interval, args.count, args.roster_every))
+    else:
+        results = asyncio.run(replay(args.directory, args.speed, args.chats, args.llm_latency, args.telegram_latency))
+        report(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# Retention for the tournament databases, so they stay small no matter how many years the bot runs.
+#
+# - Chats: the messages of a chat beyond its last CHAT_KEEP_MESSAGES that are older than CHAT_KEEP_DAYS are
+#   summarized by the LLM into ChatZusammenfassung, written to an archive per chat and removed from the database.
+# - Finished tournaments: all tables are written to a gzip compressed JSON archive and removed from the database,
+#   only the chats (with their nickname and summary) stay.
+# - Afterwards the database file is vacuumed when a good part of it consists of free pages.
+#
+# Archives are written to ARCHIVE_DIR as <slug>-<what>-<timestamp>.json.gz:
+#   {"format": 1, "slug": "...", "erstellt": "...", "tabellen": {"spiel": [{...}, ...], ...}}
+#
+#   python retention.py compact [--slug SLUG]             Compact the chats and vacuum (also run by the scraper)
+#   python retention.py archive SLUG [--keep]             Archive a finished tournament, --keep leaves the data in place
+#   python retention.py restore FILE [--slug S | --db P]  Load an archive into a tournament database or a new file
+#   python retention.py vacuum [--slug SLUG]              Vacuum even if there are only few free pages
+import argparse
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from peewee import chunked, fn, EXCLUDED
+from telegram.ext import ContextTypes
+
+from ai import get_client
+from metrics import timed, GEMINI_REQUEST_SECONDS, GEMINI_ERRORS
+from models import db, init_db, Chat, ChatMessage, ChatZusammenfassung, TABLES, Teilnehmer
+import roster
+import tournaments
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./db/archive")
+ARCHIVE_FORMAT = 1
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", str(6 * 60 * 60)))
+# The most recent messages of a chat are always kept verbatim
+CHAT_KEEP_MESSAGES = int(os.getenv("CHAT_KEEP_MESSAGES", "30"))
+CHAT_KEEP_DAYS = int(os.getenv("CHAT_KEEP_DAYS", "2"))
+# Fewer old messages than this are not worth a summary yet
+CHAT_COMPACT_MIN = int(os.getenv("CHAT_COMPACT_MIN", "20"))
+# Vacuum when at least this share of the database file is free pages
+VACUUM_FREE_RATIO = float(os.getenv("VACUUM_FREE_RATIO", "0.2"))
+
+SUMMARY_MODEL = "gemma-3-27b-it"
+
+SUMMARY_PROMPT = """Du bist Tina Turnierbot, ein Roboter der bei Tischtennisturnieren hilft und mit Leuten auf Telegram schreibt.
+Fasse den folgenden Chatverlauf für dich selbst kurz zusammen (höchstens 10 Sätze), damit du das Gespräch später fortsetzen kannst.
+Behalte alles, was du über deinen Chatpartner weißt (Name, Spitzname, Verein, Konkurrenzen, Wünsche), offene Fragen und Absprachen.
+Einzelne Spielstände und Tischnummern sind nicht wichtig.
+{bisher}
+Chatverlauf:
+{verlauf}
+"""
+
+# Tables that stay in the database when a tournament is archived
+KEEP_ON_ARCHIVE = (Chat, ChatZusammenfassung)
+# Fields of the chats that are cleared when a tournament is archived, and set again from the archive on restore
+RESTORE_CHAT_FIELDS = (Chat.me, Chat.verein_notification, Chat.is_participant)
+
+
+def _archive_path(slug: str, what: str) -> str:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    return os.path.join(ARCHIVE_DIR, f"{slug}-{what}-{datetime.now():%Y%m%d-%H%M%S}.json.gz")
+
+
+def write_archive(path: str, tabellen: Dict[str, List[dict]]) -> str:
+    """
+    Write rows per table name to a compressed archive, atomically so a crash never leaves half an archive.
+    """
+    archive = {
+        "format": ARCHIVE_FORMAT,
+        "slug": tournaments.current().slug,
+        "erstellt": datetime.now().isoformat(),
+        "tabellen": tabellen,
+    }
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+        # Dates are written as str(datetime), which is also how SQLite stores them
+        json.dump(archive, f, ensure_ascii=False, default=str)
+    os.replace(temp_path, path)
+    return path
+
+
+def read_archive(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        archive = json.load(f)
+    if archive.get("format") != ARCHIVE_FORMAT:
+        raise ValueError(f"Unknown archive format in {path}: {archive.get('format')}")
+    return archive
+
+
+# Chats
+
+async def summarize(bisher: Optional[str], messages: List[ChatMessage]) -> str:
+    verlauf = "\n".join(f"{'User' if m.from_user else 'Model'}: {m.text}" for m in messages)
+    prompt = SUMMARY_PROMPT.format(
+        bisher=f"Zusammenfassung des Chats davor:\n{bisher}\n" if bisher else "",
+        verlauf=verlauf,
+    )
+    try:
+        with timed(GEMINI_REQUEST_SECONDS, purpose="summary"):
+            response = await get_client().aio.models.generate_content(model=SUMMARY_MODEL, contents=prompt)
+    except Exception:
+        GEMINI_ERRORS.inc(purpose="summary")
+        raise
+    return response.text
+
+
+def old_messages(chat: Chat, before: datetime) -> List[ChatMessage]:
+    """
+    The messages of the chat that are older than `before` and not among its most recent ones.
+    """
+    recent = (chat.messages.select(ChatMessage.id)
+              .order_by(ChatMessage.date.desc(), ChatMessage.id.desc())
+              .limit(CHAT_KEEP_MESSAGES))
+    return list(chat.messages
+                .where((ChatMessage.date < before) & ChatMessage.id.not_in(recent))
+                .order_by(ChatMessage.date, ChatMessage.id))
+
+
+async def compact_chat(chat: Chat, old: List[ChatMessage]) -> str:
+    """
+    Replace the old messages of the chat by a summary, which includes the summary of the previous compaction.
+    The messages are archived once the summary exists, so a failed summary doesn't leave an archive behind.
+    :return: Path of the archive
+    """
+    zusammenfassung = ChatZusammenfassung.get_or_none(ChatZusammenfassung.chat == chat)
+    text = await summarize(zusammenfassung.text if zusammenfassung else None, old)
+    path = write_archive(_archive_path(tournaments.current().slug, f"chat{chat.chat_id}"),
+                         {ChatMessage._meta.table_name: [_row(m) for m in old]})
+    with db.atomic():
+        ChatZusammenfassung.insert(
+            chat=chat,
+            text=text,
+            bis=old[-1].date,
+            nachrichten=len(old) + (zusammenfassung.nachrichten if zusammenfassung else 0),
+        ).on_conflict_replace().execute()
+        for batch in chunked([m.id for m in old], 500):
+            ChatMessage.delete().where(ChatMessage.id.in_(batch)).execute()
+    return path
+
+
+async def compact_chats() -> int:
+    """
+    Compact the chats of the current tournament, the messages of every chat are archived before they are removed.
+    :return: Number of removed messages
+    """
+    before = datetime.now() - timedelta(days=CHAT_KEEP_DAYS)
+    candidates = (Chat.select()
+                  .join(ChatMessage)
+                  .where(ChatMessage.date < before)
+                  .group_by(Chat.chat_id)
+                  .having(fn.COUNT(ChatMessage.id) >= CHAT_COMPACT_MIN))
+    pending = [(chat, old) for chat in candidates if len(old := old_messages(chat, before)) >= CHAT_COMPACT_MIN]
+    removed = 0
+    for chat, old in pending:
+        try:
+            path = await compact_chat(chat, old)
+        except Exception as e:
+            # The messages stay until the next run
+            print(f"---- Error compacting chat {chat}: {e}")
+            continue
+        removed += len(old)
+        print(f"Compacted {len(old)} messages of chat {chat} in {tournaments.current()}, archived to {path}")
+    return removed
+
+
+def _row(instance) -> dict:
+    return {field.name: getattr(instance, field.column_name) for field in instance._meta.sorted_fields}
+
+
+# Database file
+
+def vacuum(force: bool = False) -> bool:
+    """
+    Give the free pages of the current tournament database back to the file system.
+    :return: True if the database was vacuumed
+    """
+    page_count = db.execute_sql("PRAGMA page_count").fetchone()[0]
+    free_pages = db.execute_sql("PRAGMA freelist_count").fetchone()[0]
+    if not page_count or (not force and free_pages / page_count < VACUUM_FREE_RATIO):
+        return False
+    page_size = db.execute_sql("PRAGMA page_size").fetchone()[0]
+    db.execute_sql("VACUUM")
+    vacuumed = db.execute_sql("PRAGMA page_count").fetchone()[0]
+    print(f"Vacuumed {tournaments.current()}: {page_count * page_size // 1024} kB -> {vacuumed * page_size // 1024} kB")
+    return True
+
+
+async def run_retention(context: ContextTypes.DEFAULT_TYPE = None):
+    """
+    Job: compact the chats of the current tournament and vacuum its database if worthwhile.
+    """
+    await compact_chats()
+    # VACUUM rewrites the whole file, not on the event loop
+    await asyncio.to_thread(_vacuum_in_thread)
+
+
+def _vacuum_in_thread() -> bool:
+    try:
+        return vacuum()
+    finally:
+        # The connection was opened for this thread only
+        db.close()
+
+
+# Tournaments
+
+def archive_tournament(purge: bool = True) -> str:
+    """
+    Write all data of the current tournament to an archive and remove it from the database, except for the chats.
+    :return: Path of the archive
+    """
+    tabellen = {model._meta.table_name: list(model.select().dicts()) for model in TABLES}
+    path = write_archive(_archive_path(tournaments.current().slug, "turnier"), tabellen)
+    print(f"Archived {tournaments.current()} to {path}: " +
+          ", ".join(f"{len(rows)} {name}" for name, rows in tabellen.items() if rows))
+    if not purge:
+        return path
+    with db.atomic():
+        # The chats stay, but must not point to participants and clubs that are gone
+        Chat.update({field: None for field in RESTORE_CHAT_FIELDS}).execute()
+        for model in reversed(TABLES):
+            if model not in KEEP_ON_ARCHIVE:
+                model.delete().execute()
+    roster.bump()
+    vacuum(force=True)
+    return path
+
+
+def restore_archive(path: str) -> Dict[str, int]:
+    """
+    Load an archive into the current tournament database, rows that already exist are kept.
+    Chats that lost their participant and club when the tournament was archived get them back.
+    :return: Number of rows per table that were in the archive
+    """
+    archive = read_archive(path)
+    init_db()
+    restored = {}
+    with db.atomic():
+        for model in TABLES:
+            rows = archive["tabellen"].get(model._meta.table_name, [])
+            for batch in chunked(rows, 100):
+                query = model.insert_many(batch)
+                if model is Chat:
+                    # The chats stayed when the tournament was archived, only their bindings were removed
+                    query = query.on_conflict(conflict_target=[Chat.chat_id], update={
+                        field: fn.COALESCE(field, EXCLUDED[field.column_name]) for field in RESTORE_CHAT_FIELDS
+                    })
+                else:
+                    query = query.on_conflict_ignore()
+                query.execute()
+            if rows:
+                restored[model._meta.table_name] = len(rows)
+    if Teilnehmer._meta.table_name in restored:
+        roster.bump()
+    return restored
+
+
+async def _compact_all(slug: Optional[str]):
+    for tournament in [tournaments.get_tournament(slug)] if slug else tournaments.all_tournaments():
+        with tournaments.use(tournament):
+            init_db()
+            await run_retention()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compact, archive and restore the tournament databases.")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Summarize old chat messages and vacuum")
+    compact_parser.add_argument("--slug", help="Only this tournament (default: all)")
+
+    archive_parser = subparsers.add_parser("archive", help="Archive a finished tournament and remove its data")
+    archive_parser.add_argument("slug")
+    archive_parser.add_argument("--keep", action="store_true", help="Only write the archive, keep the data")
+
+    restore_parser = subparsers.add_parser("restore", help="Load an archive")
+    restore_parser.add_argument("file")
+    target = restore_parser.add_mutually_exclusive_group()
+    target.add_argument("--slug", help="Tournament to restore into (default: the one in the archive)")
+    target.add_argument("--db", help="Restore into this database file instead, e.g. to look at an old edition")
+
+    vacuum_parser = subparsers.add_parser("vacuum", help="Vacuum the databases")
+    vacuum_parser.add_argument("--slug", help="Only this tournament (default: all)")
+
+    args = arg_parser.parse_args()
+    if args.command == "compact":
+        asyncio.run(_compact_all(args.slug))
+    elif args.command == "archive":
+        with tournaments.use(tournaments.get_tournament(args.slug)):
+            init_db()
+            archive_tournament(purge=not args.keep)
+    elif args.command == "restore":
+        if args.db:
+            tournament = tournaments.Tournament(slug="restore", name=args.file, base_url="", db_path=args.db)
+        else:
+            tournament = tournaments.get_tournament(args.slug or read_archive(args.file)["slug"])
+        with tournaments.use(tournament):
+            restored = restore_archive(args.file)
+        print(f"Restored {args.file} into {tournament.db_path}: " +
+              ", ".join(f"{count} {name}" for name, count in restored.items()))
+    elif args.command == "vacuum":
+        for tournament in [tournaments.get_tournament(args.slug)] if args.slug else tournaments.all_tournaments():
+            with tournaments.use(tournament):
+                if not vacuum(force=True):
+                    print(f"Nothing to vacuum for {tournament}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from peewee import fn
+
+from models import RosterSection, Teilnehmer
+import tournaments
+
+# In-memory views of the roster, one per tournament.
+# Every change of the participants (roster sync, new dummy participants) bumps the roster version of the
+# tournament, the caches compare their version on access and rebuild themselves when it changed.
+# Processes that don't sync the roster themselves (ROLE=bot) only see the changes through the database, so the
+# version also contains a stamp of the roster in the database, checked at most every ROSTER_RELOAD seconds.
+ROSTER_RELOAD = float(os.getenv("ROSTER_RELOAD", "10"))
+
+_versions: Dict[str, int] = {}
+_stamps: Dict[str, Tuple[float, tuple]] = {}  # slug -> (checked at, stamp of the database)
+_by_name: Dict[str, Tuple[tuple, Dict[Tuple[str, str], Teilnehmer]]] = {}
+_search_names: Dict[str, Tuple[tuple, Dict[int, str]]] = {}
+
+
+def _stamp(slug: str) -> tuple:
+    """
+    Changes when the roster sync of any process stored a section, or participants were added or removed.
+    """
+    checked = _stamps.get(slug)
+    if checked is None or time.monotonic() - checked[0] > ROSTER_RELOAD:
+        stamp = (RosterSection.select(fn.MAX(RosterSection.aktualisiert)).scalar(),
+                 *Teilnehmer.select(fn.COUNT(Teilnehmer.id), fn.MAX(Teilnehmer.id)).scalar(as_tuple=True))
+        checked = (time.monotonic(), stamp)
+        _stamps[slug] = checked
+    return checked[1]
+
+
+def version() -> tuple:
+    slug = tournaments.current().slug
+    return _versions.get(slug, 0), _stamp(slug)
+
+
+def bump():
+    """
+    Mark the roster of the current tournament as changed.
+    """
+    slug = tournaments.current().slug
+    _versions[slug] = _versions.get(slug, 0) + 1
+
+
+def find_by_name(nachname: str, vorname: str) -> Optional[Teilnehmer]:
+    slug = tournaments.current().slug
+    cached = _by_name.get(slug)
+    if cached is None or cached[0] != version():
+        cached = (version(), {(t.nachname, t.vorname): t for t in Teilnehmer.select()})
+        _by_name[slug] = cached
+    return cached[1].get((nachname, vorname))
+
+
+def search_names() -> Dict[int, str]:
+    """
+    Id -> "Vorname Nachname" of all participants, used for the fuzzy search.
+    """
+    slug = tournaments.current().slug
+    cached = _search_names.get(slug)
+    if cached is None or cached[0] != version():
+        cached = (version(), {t.id: f"{t.vorname} {t.nachname}" for t in Teilnehmer.select()})
+        _search_names[slug] = cached
+    return cached[1]
@@ -0,0 +1,167 @@
+import inspect
+import os
+import re
+import time
+from collections import Counter as ShapeCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import Counter, Histogram
+
+# Per-scope SQL profiling: every query executed on the database is recorded in all active scopes
+# (handler invocation, scrape cycle, tool call, ...). Scopes are tracked with a context variable,
+# so concurrent tasks don't mix up their queries.
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+# Raise instead of printing a warning when a budget is exceeded, meant for tests
+STRICT_BUDGETS = os.getenv("SQL_STRICT_BUDGETS", "") not in ("", "0")
+
+SQL_QUERIES = Histogram("sql_queries_per_scope", "Number of SQL queries per profiled scope", ("path",),
+                        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+SQL_SECONDS = Histogram("sql_seconds_per_scope", "Time spent in SQL per profiled scope", ("path",))
+SQL_N_PLUS_ONE = Counter("sql_n_plus_one_total", "Scopes that repeated the same query shape too often", ("path",))
+SQL_BUDGET_EXCEEDED = Counter("sql_budget_exceeded_total", "Scopes that exceeded their query budget", ("path",))
+
+# path -> maximum number of queries, e.g. SQL_BUDGETS="handler:answer=40,scrape:active_tables=150"
+_budgets: Dict[str, int] = {
+    path.strip(): int(budget)
+    for path, _, budget in (entry.partition("=") for entry in os.getenv("SQL_BUDGETS", "").split(",") if entry.strip())
+}
+_current: ContextVar[Optional["QueryProfile"]] = ContextVar("sql_profile", default=None)
+_reported: Set[Tuple[str, str]] = set()  # (path, shape) of the N+1 warnings printed so far
+
+_whitespace = re.compile(r"\s+")
+_placeholder_list = re.compile(r"\((?:\?\s*,\s*)+\?\)")
+_number = re.compile(r"\b\d+\b")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize(sql: str) -> str:
+    """
+    Reduce a query to its shape, so that the same query with different parameters is counted together.
+    """
+    sql = _whitespace.sub(" ", sql).strip()
+    sql = _placeholder_list.sub("(?, ...)", sql)
+    return _number.sub("?", sql)
+
+
+class QueryProfile:
+    def __init__(self, path: str, parent: Optional["QueryProfile"] = None):
+        self.path = path
+        self.parent = parent
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: ShapeCounter = ShapeCounter()
+
+    def record(self, sql: str, seconds: float):
+        shape = normalize(sql)
+        profile = self
+        while profile is not None:
+            profile.count += 1
+            profile.seconds += seconds
+            profile.shapes[shape] += 1
+            profile = profile.parent
+
+    def n_plus_one(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """
+        :return: Query shapes that were executed at least `threshold` times, most frequent first.
+        """
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def __str__(self):
+        return f"{self.path}: {self.count} queries in {self.seconds * 1000:.1f} ms"
+
+
+def record_query(sql: str, seconds: float):
+    profile = _current.get()
+    if profile is not None:
+        profile.record(sql, seconds)
+
+
+def set_budget(path: str, max_queries: int):
+    _budgets[path] = max_queries
+
+
+def check_budget(profile: QueryProfile, max_queries: Optional[int] = None, strict: Optional[bool] = None):
+    """
+    Compare the query count of a finished scope with its budget.
+    :param strict: Raise instead of printing, STRICT_BUDGETS if not given
+    :raises QueryBudgetExceeded: if strict and the budget is exceeded
+    """
+    if strict is None:
+        strict = STRICT_BUDGETS
+    budget = max_queries if max_queries is not None else _budgets.get(profile.path)
+    if budget is None or profile.count <= budget:
+        return
+    SQL_BUDGET_EXCEEDED.inc(path=profile.path)
+    message = f"Query budget exceeded for {profile.path}: {profile.count} > {budget}"
+    if strict:
+        details = "\n".join(f"  {count}x {shape}" for shape, count in profile.shapes.most_common(5))
+        raise QueryBudgetExceeded(f"{message}\n{details}")
+    print(message)
+
+
+@contextmanager
+def profile(path: str):
+    """
+    Profile the queries of the with block. Nested scopes also count towards their parents.
+    """
+    query_profile = QueryProfile(path, parent=_current.get())
+    token = _current.set(query_profile)
+    try:
+        yield query_profile
+    finally:
+        _current.reset(token)
+        SQL_QUERIES.observe(query_profile.count, path=path)
+        SQL_SECONDS.observe(query_profile.seconds, path=path)
+        repeated = query_profile.n_plus_one()
+        if repeated:
+            SQL_N_PLUS_ONE.inc(path=path)
+            shape, count = repeated[0]
+            # Scrape cycles repeat every few seconds, each warning is printed once, the counter keeps counting
+            if (path, shape) not in _reported:
+                _reported.add((path, shape))
+                print(f"Possible N+1 in {path}: {count}x {shape}")
+        check_budget(query_profile)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, path: str = "test"):
+    """
+    For tests: fail if the with block executes more than max_queries queries.
+    """
+    with profile(path) as query_profile:
+        yield query_profile
+    check_budget(query_profile, max_queries, strict=True)
+
+
+def profiled(path: str):
+    """
+    Decorator version of profile() for sync and async functions.
+    """
+    def decorator(func: Callable):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with profile(path):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile(path):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_execute(execute_sql: Callable, sql: str, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return execute_sql(sql, *args, **kwargs)
+    finally:
+        record_query(sql, time.perf_counter() - start)
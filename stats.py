@@ -0,0 +1,109 @@
+from typing import List, Optional, Tuple
+
+from peewee import EXCLUDED, JOIN
+
+from models import db, Bilanz, BilanzSpiel, Spiel
+
+# Materialized statistics of finished games per participant, club and competition.
+# Every result is added once when the scraper sees the game end, questions like "how is Emmerke doing?"
+# are then a single lookup instead of summing up all games of all players.
+TEILNEHMER = "teilnehmer"
+VEREIN = "verein"
+KONKURRENZ = "konkurrenz"
+
+COUNTERS = ("spiele", "siege", "niederlagen", "saetze_gewonnen", "saetze_verloren", "ueberraschungen")
+
+
+def parse_saetze(ergebnis_satz: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Sets of spieler1 and spieler2 from a result like "3 : 1", None if the result has no set count.
+    """
+    if not ergebnis_satz or ergebnis_satz.count(":") != 1:
+        return None
+    try:
+        saetze1, saetze2 = (int(part.strip()) for part in ergebnis_satz.split(":"))
+    except ValueError:
+        return None
+    if saetze1 == saetze2:
+        return None
+    return saetze1, saetze2
+
+
+def _row(art: str, ref: int, gewonnen: bool, saetze_gewonnen: int, saetze_verloren: int, ueberraschung: bool) -> dict:
+    return {
+        "art": art,
+        "ref": ref,
+        "spiele": 1,
+        "siege": int(gewonnen),
+        "niederlagen": int(not gewonnen),
+        "saetze_gewonnen": saetze_gewonnen,
+        "saetze_verloren": saetze_verloren,
+        "ueberraschungen": int(ueberraschung),
+    }
+
+
+def record_result(spiel: Spiel) -> bool:
+    """
+    Add a finished game to the statistics.
+    :return: True if the game was counted now, False if it has no result or was already counted
+    """
+    saetze = parse_saetze(spiel.ergebnis_satz)
+    if saetze is None:
+        return False
+    spieler1, spieler2 = spiel.spieler1, spiel.spieler2
+    spieler1_gewonnen = saetze[0] > saetze[1]
+    sieger, verlierer = (spieler1, spieler2) if spieler1_gewonnen else (spieler2, spieler1)
+    ueberraschung = 0 < sieger.qttr < verlierer.qttr
+
+    rows = [
+        _row(TEILNEHMER, spieler1.id, spieler1_gewonnen, saetze[0], saetze[1], spieler1_gewonnen and ueberraschung),
+        _row(TEILNEHMER, spieler2.id, not spieler1_gewonnen, saetze[1], saetze[0], not spieler1_gewonnen and ueberraschung),
+    ]
+    # Games between two players of the same club count for the club as one win and one loss
+    rows += [
+        _row(VEREIN, spieler1.verein_id, spieler1_gewonnen, saetze[0], saetze[1], spieler1_gewonnen and ueberraschung),
+        _row(VEREIN, spieler2.verein_id, not spieler1_gewonnen, saetze[1], saetze[0], not spieler1_gewonnen and ueberraschung),
+    ]
+    if spiel.konkurrenz_id:
+        # For a competition siege/niederlagen are from the view of spieler1, the sets are all sets played
+        rows.append({**_row(KONKURRENZ, spiel.konkurrenz_id, True, sum(saetze), 0, ueberraschung),
+                     "siege": 0, "niederlagen": 0})
+
+    with db.atomic():
+        counted = BilanzSpiel.insert(spiel=spiel.id).on_conflict_ignore().as_rowcount().execute()
+        if not counted:
+            return False
+        # One upsert for all rows, SQLite applies them in order so both rows of the same club add up
+        Bilanz.insert_many(rows).on_conflict(
+            conflict_target=[Bilanz.art, Bilanz.ref],
+            update={getattr(Bilanz, name): getattr(Bilanz, name) + getattr(EXCLUDED, name) for name in COUNTERS}
+        ).execute()
+    return True
+
+
+def backfill() -> int:
+    """
+    Count all finished games that are not in the statistics yet, e.g. after an update of the bot.
+    :return: Number of games added
+    """
+    pending = (Spiel.select()
+               .join(BilanzSpiel, on=(BilanzSpiel.spiel == Spiel.id), join_type=JOIN.LEFT_OUTER)
+               .where(Spiel.ergebnis_satz.is_null(False) & BilanzSpiel.spiel.is_null()))
+    added = sum(record_result(spiel) for spiel in pending)
+    if added:
+        print(f"Added {added} finished games to the statistics.")
+    return added
+
+
+def bilanz(art: str, ref: int) -> Optional[Bilanz]:
+    return Bilanz.get_or_none((Bilanz.art == art) & (Bilanz.ref == ref))
+
+
+def rangliste(art: str, limit: int = 10) -> List[Bilanz]:
+    """
+    The entries with the most wins, ties broken by the set difference.
+    """
+    return list(Bilanz.select()
+                .where(Bilanz.art == art)
+                .order_by(Bilanz.siege.desc(), (Bilanz.saetze_gewonnen - Bilanz.saetze_verloren).desc())
+                .limit(limit))
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules read their configuration on import: no real keys, and a scratch database instead of ./db
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("TELEGRAM_API_KEY", "test")
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="turnierbot-"), "turnier.db"))
+os.environ.setdefault("PARSE_POOL", "none")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def turnier(tmp_path):
+    """
+    Every test works on its own tournament database.
+    """
+    import tournaments
+    from models import db, init_db
+
+    # A slug of its own, so nothing of the caches per tournament (roster, timeline, board) is carried over
+    tournament = tournaments.Tournament(slug=tmp_path.name, name="Testturnier", base_url="https://example.org/",
+                                        db_path=str(tmp_path / "turnier.db"))
+    with tournaments.use(tournament):
+        init_db()
+        yield tournament
+        db.close()
+
+
+class Turnierdaten:
+    """
+    Two clubs, one competition and four participants, players 1 and 2 of the first club.
+    """
+
+    def __init__(self):
+        from models import Konkurrenz, Teilnehmer, Verein
+
+        self.emmerke = Verein.create(name="SV Emmerke")
+        self.niestetal = Verein.create(name="SC Niestetal")
+        self.konkurrenz = Konkurrenz.create(name="Herren A", link="./type_1.html")
+        self.spieler = [
+            Teilnehmer.create(id=1, vorname="Tina", nachname="Turnier", qttr=1600, verein=self.emmerke),
+            Teilnehmer.create(id=2, vorname="Emil", nachname="Emmerke", qttr=1500, verein=self.emmerke),
+            Teilnehmer.create(id=3, vorname="Nora", nachname="Niestetal", qttr=1400, verein=self.niestetal),
+            Teilnehmer.create(id=4, vorname="Gerd", nachname="Gegner", qttr=1300, verein=self.niestetal),
+        ]
+        for teilnehmer in self.spieler:
+            teilnehmer.konkurrenz.add(self.konkurrenz)
+
+
+@pytest.fixture
+def daten(turnier) -> Turnierdaten:
+    return Turnierdaten()
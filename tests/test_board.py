@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime
+
+import board
+from models import Spiel
+from sqlprofile import assert_max_queries
+import timeline
+import tournaments
+from webserver import Request
+
+
+def _get(path: str, headers=None):
+    query = f"?turnier={tournaments.current().slug}"
+    return asyncio.run(board.board_endpoint(Request("GET", path + query, headers or {}, b"")))
+
+
+def test_board_renders_on_request_and_skips_unchanged_polls(daten):
+    spiel = Spiel.create(tisch=2, spieler1=daten.spieler[0], spieler2=daten.spieler[2], konkurrenz=daten.konkurrenz,
+                         typ="Gruppe", start=datetime.now())
+    timeline.current().start(spiel)
+    assert board.refresh()
+    snapshot = board._snapshots[tournaments.current().slug]
+    assert snapshot.responses == {}
+
+    # Nothing changed: only the cheap stamp of the inputs is read
+    with assert_max_queries(2):
+        assert not board.refresh()
+
+    response = _get(f"/board/verein/{daten.niestetal.id}.json")
+    assert response.status == 200 and b"Nora Niestetal" in response.body
+    assert list(snapshot.responses) == [f"/board/verein/{daten.niestetal.id}.json"]
+    assert _get("/board/verein/999").status == 404
+
+    page = _get("/board")
+    assert f"Stand {snapshot.refreshed:%H:%M:%S}".encode() in page.body
+    assert _get("/board", {"if-none-match": page.headers["ETag"]}).status == 304
+
+    # A later poll without changes still moves the time on the page
+    snapshot.refreshed = snapshot.refreshed.replace(hour=(snapshot.refreshed.hour + 1) % 24)
+    later = _get("/board")
+    assert later.headers["ETag"] != page.headers["ETag"]
+    assert f"Stand {snapshot.refreshed:%H:%M:%S}".encode() in later.body
+
+
+def test_board_follows_changes(daten):
+    assert board.refresh()
+    assert b"Gerade nichts" in _get("/board").body
+    spiel = Spiel.create(tisch=7, spieler1=daten.spieler[1], spieler2=daten.spieler[3], konkurrenz=daten.konkurrenz,
+                         typ="Gruppe", start=datetime.now())
+    timeline.current().start(spiel)
+    assert board.refresh()
+    assert b"Emil Emmerke" in _get("/board").body
@@ -0,0 +1,80 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+import ai
+import fakes
+from models import Chat, Spiel
+import parser
+import sqlprofile
+import tournaments
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+# Queries per scope, the same paths that can be limited in production with SQL_BUDGETS
+BUDGETS = {
+    "scrape:active_tables": 30,
+    "handler:answer": 15,
+    "tool:get_aktive_tische": 1,
+    "tool:schaetze_naechstes_spiel": 2,
+}
+
+
+@pytest.fixture(autouse=True)
+def budgets(monkeypatch):
+    monkeypatch.setattr(sqlprofile, "STRICT_BUDGETS", True)
+    for path, budget in BUDGETS.items():
+        monkeypatch.setitem(sqlprofile._budgets, path, budget)
+
+
+@pytest.fixture
+def seite(daten):
+    site = fakes.FakeSite()
+    site.set_page("active_tables.html", (FIXTURES / "active_tables.html").read_text(encoding="utf-8"))
+    return site
+
+
+def scrape(site):
+    fakes.install(site=site, bot=fakes.FakeBot(), client=fakes.FakeGenaiClient())
+    asyncio.run(parser.fetch_active_tables(None))
+
+
+def test_active_tables_within_budget(seite):
+    # The first cycle creates the games, the next ones only compare
+    scrape(seite)
+    for _ in range(2):
+        with sqlprofile.assert_max_queries(8):
+            scrape(seite)
+    laufend = Spiel.get(Spiel.tisch == 3)
+    beendet = Spiel.get(Spiel.end.is_null(False))
+    assert (laufend.spieler1_id, laufend.spieler2_id) == (1, 3)
+    assert (beendet.spieler1_id, beendet.spieler2_id, beendet.ergebnis_satz) == (2, 4, "3 : 1")
+
+
+def script(contents, call):
+    tische = call("get_aktive_tische")
+    me = call("get_teilnehmer")
+    prognose = call("schaetze_naechstes_spiel", teilnehmer_id=me["id"])
+    return f"{len(tische)} Tische aktiv, {prognose}"
+
+
+def test_answer_with_tool_calls_within_budget(seite, turnier, monkeypatch):
+    scrape(seite)
+    Chat.create(chat_id=42, name="Tina", me=1)
+    client = fakes.FakeGenaiClient(script=script)
+    bot = fakes.FakeBot()
+    fakes.install(bot=bot, client=client)
+    monkeypatch.setattr(tournaments, "for_chat", lambda chat_id: turnier)
+
+    # Not a fast path question, so the LLM answers with the tools
+    update = fakes.FakeUpdate(42, "Tina", "Erzähl mal, was ist bei mir los?", bot)
+    asyncio.run(ai.answer(update, None))
+    assert client.tool_calls == 3
+    assert bot.sent[-1].text.startswith("1 Tische aktiv")
+
+
+def test_exceeded_budget_fails(seite, monkeypatch):
+    monkeypatch.setitem(sqlprofile._budgets, "scrape:active_tables", 1)
+    with pytest.raises(sqlprofile.QueryBudgetExceeded, match="scrape:active_tables"):
+        scrape(seite)
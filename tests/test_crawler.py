@@ -0,0 +1,64 @@
+import asyncio
+from pathlib import Path
+
+import crawler
+from models import GruppenPlatz, Konkurrenz, Paarung, Spiel
+import pages
+import timeline
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def _seite():
+    return pages.parse_konkurrenz_page((FIXTURES / "type_1.html").read_text(encoding="utf-8"))
+
+
+def test_parse_konkurrenz_page():
+    pairings, standings = _seite()
+    # Played games and the ones with a result are left out, placeholders are still listed
+    assert pairings == [
+        {"gruppe": "Gruppe 1", "spieler1": "Turnier, Tina", "spieler2": "Niestetal, Nora"},
+        {"gruppe": "Gruppe 1", "spieler1": "Turnier, Tina", "spieler2": "Gegner, Gerd"},
+        {"gruppe": "Gruppe 1", "spieler1": "Emmerke, Emil", "spieler2": "Niestetal, Nora"},
+        {"gruppe": "Hauptrunde", "spieler1": "Sieger Spiel 1", "spieler2": "Sieger Spiel 2"},
+    ]
+    assert [(s["platz"], s["name"], s["spiele"], s["saetze"]) for s in standings] == [
+        (1, "Emmerke, Emil", "1:0", "3:1"),
+        (2, "Turnier, Tina", "0:0", "0:0"),
+        (3, "Niestetal, Nora", "0:0", "0:0"),
+        (4, "Gegner, Gerd", "0:1", "1:3"),
+    ]
+    assert {s["gruppe"] for s in standings} == {"Gruppe 1"}
+
+
+def test_pairings_on_a_table_are_not_upcoming(daten):
+    # Tina and Nora are playing already, the page still lists them without result
+    spiel = Spiel.create(tisch=3, spieler1=daten.spieler[0], spieler2=daten.spieler[2], konkurrenz=daten.konkurrenz,
+                         typ="Gruppe")
+    timeline.current().start(spiel)
+
+    asyncio.run(crawler.store_konkurrenz_page(daten.konkurrenz, *_seite()))
+    paarungen = [(p.spieler1_id, p.spieler2_id) for p in Paarung.select().order_by(Paarung.reihenfolge)]
+    assert paarungen == [(1, 4), (2, 3)]
+    assert timeline.current().queue[daten.konkurrenz.id] == {"Gruppe 1": 2}
+    assert GruppenPlatz.select().count() == 4
+    # Tina is next in her group once her current game is done
+    assert [davor for _, davor, _ in timeline.current().next_games(1)] == [0]
+
+
+def test_crawl_rotates_through_competitions(daten, monkeypatch):
+    for name in ("Damen A", "Herren B"):
+        Konkurrenz.create(name=name, link=f"./type_{name}.html")
+    crawled = []
+
+    async def crawl_konkurrenz(client, semaphore, konkurrenz, stage):
+        crawled[-1].append(konkurrenz.name)
+        return False
+
+    monkeypatch.setattr(crawler, "crawl_konkurrenz", crawl_konkurrenz)
+    monkeypatch.setattr(crawler, "CRAWL_MAX_PAGES", 2)
+    for _ in range(3):
+        crawled.append([])
+        asyncio.run(crawler.crawl_konkurrenzen())
+    # Never crawled ones first, then the ones crawled longest ago
+    assert crawled == [["Herren A", "Damen A"], ["Herren B", "Herren A"], ["Damen A", "Herren A"]]
@@ -0,0 +1,57 @@
+import pytest
+
+import intents
+import timeline
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Gegen wen spiele ich?", intents.GEGNER),
+    ("gegen wen spiele ich jetzt", intents.GEGNER),
+    ("Wer ist mein Gegner?", intents.GEGNER),
+    ("Wer ist mein nächster Gegner?", intents.GEGNER),
+    ("Welcher Tisch?", intents.TISCH),
+    ("An welchem Tisch spiele ich?", intents.TISCH),
+    ("Wo spiele ich?", intents.TISCH),
+    ("Meine Spiele", intents.MEINE_SPIELE),
+    ("Wann bin ich dran?", intents.MEINE_SPIELE),
+    ("Aktive Tische", intents.AKTIVE_TISCHE),
+    ("Welche Tische sind aktiv?", intents.AKTIVE_TISCHE),
+    ("Welche Tische sind belegt?", intents.AKTIVE_TISCHE),
+    ("Was läuft gerade?", intents.AKTIVE_TISCHE),
+])
+def test_classify(text, intent):
+    assert intents.classify(text) == intent
+
+
+@pytest.mark.parametrize("text", [
+    # Questions about someone else and statements go to the LLM
+    "Gegen wen spielt Vor9 Nach9?",
+    "Mein Gegner ist nicht aufgetaucht, was jetzt?",
+    "Meinen Gegner kenne ich schon",
+    # Free tables are not the occupied ones
+    "Welche Tische sind frei?",
+    "Welche Tische gibt es?",
+    "Hallo Tina!",
+    None,
+])
+def test_classify_falls_through(text):
+    assert intents.classify(text) is None
+
+
+def test_bot_process_answers_from_the_current_occupancy(daten):
+    from datetime import datetime
+    from models import Chat, Spiel
+
+    chat = Chat.create(chat_id=7, name="tina", me=daten.spieler[0])
+    spiel = Spiel.create(tisch=4, spieler1=daten.spieler[0], spieler2=daten.spieler[2], konkurrenz=daten.konkurrenz,
+                         typ="Gruppe", start=datetime.now())
+    # The scraper runs in another process, this one only has the timeline loaded from the database
+    scraper = timeline.Timeline()
+    scraper.start(spiel)
+    assert not timeline.current().live
+    assert "Tisch 4" in intents.route("Welcher Tisch?", chat)
+    assert "Gerade laufen 1 Spiele" in intents.route("Aktive Tische", chat)
+
+    scraper.seen(set())
+    assert "Tisch 4" not in intents.route("Welcher Tisch?", chat)
+    assert "kein Tisch belegt" in intents.route("Aktive Tische", chat)
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+import fakes
+from models import Chat, ChatMessage, Spiel, Zustellung
+import notify
+from sqlprofile import profile
+
+
+class FailingBot(fakes.FakeBot):
+    """
+    Telegram is down for some chats.
+    """
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = set(failing)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if chat_id in self.failing:
+            raise Exception(f"Chat {chat_id} not reachable")
+        return await super().send_message(chat_id, text, **kwargs)
+
+
+@pytest.fixture
+def spiel(daten):
+    # Players 1 (SV Emmerke) and 3 (SC Niestetal) play each other
+    Chat.create(chat_id=11, name="spieler1", me=daten.spieler[0])
+    Chat.create(chat_id=13, name="spieler3", me=daten.spieler[2])
+    Chat.create(chat_id=20, name="trainer", verein_notification=daten.emmerke)
+    # Follows the club, but plays in the game itself: only the notification as player
+    Chat.create(chat_id=21, name="spieler1 trainer", me=daten.spieler[0], verein_notification=daten.niestetal)
+    return Spiel.create(tisch=5, spieler1=daten.spieler[0], spieler2=daten.spieler[2], konkurrenz=daten.konkurrenz,
+                        typ="Gruppe")
+
+
+def test_retry_only_repeats_failed_deliveries(spiel):
+    bot, client = FailingBot(failing={13}), fakes.FakeGenaiClient(reply="Auf geht's!")
+    fakes.install(bot=bot, client=client)
+
+    with pytest.raises(Exception, match="1 of 4 notifications"):
+        asyncio.run(notify.notify_new_spiel(spiel))
+    assert sorted(m.chat.id for m in bot.sent) == [11, 20, 21]
+    assert client.calls == 3  # One text per player chat, the club chat gets a fixed text
+    failed = Zustellung.get(Zustellung.chat == 13)
+    assert (failed.gesendet, failed.versuche, failed.text) == (None, 1, "Auf geht's!")
+
+    # Telegram is back: only the failed chat gets its message, with the stored text
+    bot.failing.clear()
+    bot.sent.clear()
+    asyncio.run(notify.notify_new_spiel(spiel))
+    assert [(m.chat.id, m.text) for m in bot.sent] == [(13, "Auf geht's!")]
+    assert client.calls == 3
+    assert Zustellung.select().where(Zustellung.gesendet.is_null()).count() == 0
+
+    # Another retry of the event sends nothing
+    asyncio.run(notify.notify_new_spiel(spiel))
+    assert len(bot.sent) == 1
+    assert ChatMessage.select().count() == 4
+
+
+def test_club_notification(spiel):
+    bot = fakes.FakeBot()
+    fakes.install(bot=bot, client=fakes.FakeGenaiClient())
+    asyncio.run(notify.notify_new_spiel(spiel))
+    text = next(m.text for m in bot.sent if m.chat.id == 20)
+    assert "Tina Turnier" in text and "SC Niestetal" in text and "Tisch 5" in text
+    assert Zustellung.get(Zustellung.chat == 21).art == notify.SPIEL
+
+
+def test_players_are_loaded_once(spiel):
+    fakes.install(bot=fakes.FakeBot(), client=fakes.FakeGenaiClient())
+    with profile("test") as query_profile:
+        asyncio.run(notify.notify_new_spiel(spiel))
+    # The ledger writes once per recipient, but the players and their clubs are only read with the game
+    by_id = [shape for shape in query_profile.shapes
+             if ('FROM "teilnehmer" AS "t1" WHERE' in shape or 'FROM "verein" AS "t1" WHERE' in shape)]
+    assert by_id == []
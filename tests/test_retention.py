@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from models import Chat, ChatMessage, ChatZusammenfassung, Konkurrenz, Spiel, Teilnehmer, Verein
+import retention
+
+
+def test_archive_restore_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    verein = Verein.create(name="SV Emmerke")
+    konkurrenz = Konkurrenz.create(name="Herren A", link="./type_1.html")
+    spieler = Teilnehmer.create(id=1, vorname="Tina", nachname="Turnier", qttr=1500, verein=verein)
+    gegner = Teilnehmer.create(id=2, vorname="Gerd", nachname="Gegner", qttr=1400, verein=verein)
+    spieler.konkurrenz.add(konkurrenz)
+    Spiel.create(tisch=3, spieler1=spieler, spieler2=gegner, konkurrenz=konkurrenz, typ="Gruppe")
+    Chat.create(chat_id=42, name="tina", nickname="Tini", me=spieler, is_participant=True,
+                verein_notification=verein)
+
+    path = retention.archive_tournament(purge=True)
+    chat = Chat.get(Chat.chat_id == 42)
+    assert (chat.me_id, chat.verein_notification_id, chat.is_participant) == (None, None, None)
+    assert Teilnehmer.select().count() == 0
+
+    retention.restore_archive(path)
+    chat = Chat.get(Chat.chat_id == 42)
+    assert chat.me_id == spieler.id
+    assert chat.verein_notification_id == verein.id
+    assert chat.is_participant is True
+    assert chat.nickname == "Tini"
+    assert Spiel.select().count() == 1
+    assert [k.name for k in Teilnehmer.get_by_id(1).konkurrenz] == ["Herren A"]
+
+
+def _old_chat(chat_id: int, count: int) -> Chat:
+    chat = Chat.create(chat_id=chat_id, name=f"chat{chat_id}")
+    date = datetime.now() - timedelta(days=retention.CHAT_KEEP_DAYS + 1)
+    ChatMessage.insert_many([{"chat": chat, "message_id": i, "text": f"Nachricht {i}", "date": date}
+                             for i in range(count)]).execute()
+    return chat
+
+
+def test_compact_chats_archives_only_compacted_chats(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    count = retention.CHAT_KEEP_MESSAGES + retention.CHAT_COMPACT_MIN
+    ok, failing = _old_chat(100, count), _old_chat(101, count)
+
+    async def summarize(bisher, messages):
+        if messages[0].chat_id == failing.chat_id:
+            raise RuntimeError("Gemini down")
+        return "Zusammenfassung"
+
+    monkeypatch.setattr(retention, "summarize", summarize)
+    assert asyncio.run(retention.compact_chats()) == retention.CHAT_COMPACT_MIN
+    assert [p.name.split("-")[1] for p in (tmp_path / "archive").iterdir()] == ["chat100"]
+    assert ok.messages.count() == retention.CHAT_KEEP_MESSAGES
+    assert failing.messages.count() == count
+    assert ChatZusammenfassung.get(ChatZusammenfassung.chat == ok).text == "Zusammenfassung"
+    # The vacuum of the job runs in a thread, on the same database
+    asyncio.run(retention.run_retention())
@@ -0,0 +1,60 @@
+import asyncio
+
+from models import Konkurrenz, RosterSection, Teilnehmer
+import pages
+import parser
+import roster
+
+HERREN = [("1", "Turnier", "Tina", "SV Emmerke", "1600"), ("2", "Emmerke", "Emil", "SV Emmerke", "1500"),
+          ("3", "Niestetal", "Nora", "SC Niestetal", "1400"), ("4", "Gegner", "Gerd", "SC Niestetal", "1300")]
+DAMEN = [("1", "Turnier", "Tina", "SV Emmerke", "1600"), ("3", "Niestetal", "Nora", "SC Niestetal", "1400")]
+
+
+def starters(sections) -> str:
+    html = "<HTML><BODY>"
+    for name, rows in sections.items():
+        html += f"<SPAN class='mktt_grouptype'>{name} Einzel</SPAN><BR /><TABLE>"
+        html += "<TR><TH>Nr.</TH><TH>Name</TH><TH>Vorname</TH><TH>Verein</TH><TH>QTTR</TH></TR>"
+        html += "".join("<TR>" + "".join(f"<TD>{cell}</TD>" for cell in row) + "</TR>" for row in rows)
+        html += "</TABLE>"
+    return html + "</BODY></HTML>"
+
+
+def sync(html: str):
+    asyncio.run(parser._store_teilnehmer(pages.parse_starters(html)))
+
+
+def test_only_changed_sections_are_processed_again(daten, monkeypatch):
+    damen = Konkurrenz.create(name="Damen A", link="./type_2.html")
+    sync(starters({"Herren A": HERREN, "Damen A": DAMEN}))
+    assert {t.id for t in damen.teilnehmer} == {1, 3}
+    damen_stand = RosterSection.get(RosterSection.name == "Damen A").aktualisiert
+    version = roster.version()
+    roster.find_by_name("Gegner", "Gerd")
+
+    processed = []
+    store_section = parser._store_section
+
+    def record(name, konkurrenz, section):
+        processed.append(name)
+        store_section(name, konkurrenz, section)
+
+    monkeypatch.setattr(parser, "_store_section", record)
+    # Gerd's QTTR was corrected and Emil withdrew, the women's section is unchanged
+    herren = [row for row in HERREN if row[0] != "2"]
+    herren[-1] = ("4", "Gegner", "Gerd", "SC Niestetal", "1350")
+    sync(starters({"Herren A": herren, "Damen A": DAMEN}))
+
+    assert processed == ["Herren A"]
+    assert RosterSection.get(RosterSection.name == "Damen A").aktualisiert == damen_stand
+    assert {t.id for t in daten.konkurrenz.teilnehmer} == {1, 3, 4}
+    assert Teilnehmer.get_by_id(4).qttr == 1350
+    assert roster.version() != version
+    # The caches built on the roster follow the new version
+    assert roster.find_by_name("Gegner", "Gerd").qttr == 1350
+
+    # Nothing changed at all
+    version = roster.version()
+    sync(starters({"Herren A": herren, "Damen A": DAMEN}))
+    assert processed == ["Herren A"]
+    assert roster.version() == version
@@ -0,0 +1,57 @@
+from models import Bilanz, BilanzSpiel, Spiel
+import stats
+
+
+def _ergebnis(daten, a: int, b: int, ergebnis: str) -> Spiel:
+    return Spiel.create(tisch=1, spieler1=daten.spieler[a], spieler2=daten.spieler[b], konkurrenz=daten.konkurrenz,
+                        typ="Gruppe", ergebnis_satz=ergebnis)
+
+
+def _zahlen(art: str, ref: int) -> tuple:
+    bilanz = stats.bilanz(art, ref)
+    return tuple(getattr(bilanz, name) for name in stats.COUNTERS)
+
+
+def _alle() -> dict:
+    return {(b.art, b.ref): tuple(getattr(b, name) for name in stats.COUNTERS) for b in Bilanz.select()}
+
+
+def test_result_is_counted_once(daten):
+    # Nora (1400) beats Tina (1600)
+    spiel = _ergebnis(daten, 0, 2, "1 : 3")
+    assert stats.record_result(spiel)
+    # The same result seen again, e.g. in the next poll or after a restart
+    assert not stats.record_result(Spiel.get_by_id(spiel.id))
+    assert BilanzSpiel.select().count() == 1
+    # spiele, siege, niederlagen, saetze_gewonnen, saetze_verloren, ueberraschungen
+    assert _zahlen(stats.TEILNEHMER, 1) == (1, 0, 1, 1, 3, 0)
+    assert _zahlen(stats.TEILNEHMER, 3) == (1, 1, 0, 3, 1, 1)
+    assert _zahlen(stats.KONKURRENZ, daten.konkurrenz.id) == (1, 0, 0, 4, 0, 1)
+
+
+def test_same_club_counts_as_win_and_loss(daten):
+    # Tina and Emil both play for SV Emmerke
+    assert stats.record_result(_ergebnis(daten, 0, 1, "3 : 2"))
+    assert _zahlen(stats.VEREIN, daten.emmerke.id) == (2, 1, 1, 5, 5, 0)
+    assert stats.bilanz(stats.VEREIN, daten.niestetal.id) is None
+
+
+def test_results_without_sets_are_not_counted(daten):
+    assert not stats.record_result(_ergebnis(daten, 0, 1, "w.o."))
+    assert BilanzSpiel.select().count() == 0
+
+
+def test_backfill_matches_incremental_ingestion(daten):
+    ergebnisse = [(0, 2, "3 : 0"), (1, 3, "2 : 3"), (0, 1, "3 : 1"), (2, 3, "3 : 2")]
+    spiele = [_ergebnis(daten, a, b, ergebnis) for a, b, ergebnis in ergebnisse]
+    for spiel in spiele:
+        stats.record_result(spiel)
+    incremental = _alle()
+
+    Bilanz.delete().execute()
+    BilanzSpiel.delete().execute()
+    # One game was already counted before the backfill
+    stats.record_result(spiele[1])
+    assert stats.backfill() == 3
+    assert _alle() == incremental
+    assert stats.backfill() == 0
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from models import Paarung, Spiel, Spieldauer, TischBelegung
+from sqlprofile import assert_max_queries
+import timeline
+
+
+def _spiel(daten, tisch: int, a: int, b: int, start: datetime) -> Spiel:
+    return Spiel.create(tisch=tisch, spieler1=daten.spieler[a], spieler2=daten.spieler[b], konkurrenz=daten.konkurrenz,
+                        typ="Gruppe", start=start)
+
+
+def test_occupancy_is_shared_through_the_database(daten):
+    scraper = timeline.Timeline()
+    spiel = _spiel(daten, 3, 0, 2, datetime.now() - timedelta(minutes=5))
+    scraper.start(spiel)
+
+    bot = timeline.Timeline()
+    bot.load()
+    assert bot.playing == {1: 3, 3: 3}
+    assert bot.running[3].spiel_id == spiel.id
+
+    # The table is no longer listed
+    scraper.seen(set())
+    bot.load()
+    assert bot.running == {} and bot.playing == {}
+    assert TischBelegung.select().count() == 0
+
+
+def test_finish_records_the_exact_duration(daten):
+    tl = timeline.Timeline()
+    start = datetime.now() - timedelta(minutes=30)
+    spiel = _spiel(daten, 1, 0, 1, start)
+    tl.start(spiel)
+    spiel.end = start + timedelta(minutes=12)
+    tl.finish(spiel)
+    tl.seen(set())
+    assert tl.average_duration(daten.konkurrenz.id) == 12 * 60
+
+    dauer = Spieldauer.get_by_id(daten.konkurrenz.id)
+    assert (dauer.spiele, dauer.sekunden) == (1, 12 * 60)
+    loaded = timeline.Timeline()
+    loaded.load()
+    assert loaded.average_duration(daten.konkurrenz.id) == 12 * 60
+    assert loaded.average_duration(None) == 12 * 60
+
+
+def test_load_ignores_finished_games(daten):
+    # Games of earlier cycles are in Spiel, but only the occupancy is loaded
+    for i in range(5):
+        _spiel(daten, 2, 0, 3, datetime.now() - timedelta(hours=2, minutes=i))
+    tl = timeline.Timeline()
+    tl.load()
+    assert tl.running == {}
+
+
+def test_next_games_counts_positions_in_one_query(daten):
+    tl = timeline.Timeline()
+    paarungen = [(2, 3), (0, 3), (1, 2), (0, 2)]
+    Paarung.insert_many([{"konkurrenz": daten.konkurrenz, "gruppe": "Gruppe 1", "reihenfolge": i,
+                          "spieler1": daten.spieler[a], "spieler2": daten.spieler[b]}
+                         for i, (a, b) in enumerate(paarungen)]).execute()
+    tl.set_queue(daten.konkurrenz.id, {"Gruppe 1": len(paarungen)})
+    with assert_max_queries(1):
+        games = tl.next_games(daten.spieler[0].id)
+        names = [(paarung.spieler2.nachname, paarung.konkurrenz.name, davor) for paarung, davor, _ in games]
+    assert names == [("Gegner", "Herren A", 1), ("Niestetal", "Herren A", 3)]
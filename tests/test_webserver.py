@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pytest
+
+import webhook
+import webserver
+from webserver import Request, Response, Router
+
+
+async def _echo(request: Request) -> Response:
+    return Response(200, request.body)
+
+
+async def _exchange(raw: bytes, timeout: float = 5) -> bytes:
+    router = Router()
+    router.add("POST", "/echo", _echo)
+    server = await webserver.serve(router, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        return response
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_content_length_body():
+    response = asyncio.run(_exchange(b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhallo"))
+    assert response.startswith(b"HTTP/1.1 200 OK") and response.endswith(b"\r\n\r\nhallo")
+
+
+def test_chunked_body():
+    raw = (b"POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+           b"4\r\n{\"a\"\r\n3;ext=1\r\n: 1\r\n1\r\n}\r\n0\r\n\r\n")
+    response = asyncio.run(_exchange(raw))
+    assert response.startswith(b"HTTP/1.1 200 OK") and response.endswith(b'\r\n\r\n{"a": 1}')
+
+
+def test_unfinished_headers_time_out(monkeypatch):
+    monkeypatch.setattr(webserver, "REQUEST_TIMEOUT", 0.2)
+    response = asyncio.run(_exchange(b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\n"))
+    assert response.startswith(b"HTTP/1.1 408 Request Timeout")
+
+
+def test_body_too_large():
+    raw = f"POST /echo HTTP/1.1\r\nContent-Length: {webserver.MAX_BODY_SIZE + 1}\r\n\r\n".encode()
+    assert asyncio.run(_exchange(raw)).startswith(b"HTTP/1.1 413")
+
+
+class FakeApplication:
+    def __init__(self):
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+
+
+@pytest.mark.parametrize("token, status", [
+    ("geheim", 200),
+    ("falsch", 403),
+    ("", 403),
+    (None, 403),
+])
+def test_webhook_secret_token(monkeypatch, token, status):
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", "geheim")
+    application = FakeApplication()
+    headers = {"x-telegram-bot-api-secret-token": token} if token is not None else {}
+    body = json.dumps({"update_id": 1}).encode()
+    response = asyncio.run(webhook.update_endpoint(application)(Request("POST", "/telegram", headers, body)))
+    assert response.status == status
+    assert application.update_queue.qsize() == (1 if status == 200 else 0)
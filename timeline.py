@@ -0,0 +1,222 @@
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from peewee import fn, JOIN, EXCLUDED
+
+from models import Konkurrenz, Paarung, Spiel, Spieldauer, Teilnehmer, TischBelegung
+import tournaments
+
+# In-memory timeline of the tables of a tournament, fed by the start / end transitions the scraper observes.
+# The current occupancy of the tables, the average match duration per competition and the number of open pairings
+# are kept up to date with every event, so estimates never have to scan the Spiel table.
+# The occupancy (TischBelegung) and the durations (Spieldauer) are also written through to the database, that's
+# where processes that don't scrape and the scraper after a restart load them from.
+DEFAULT_MATCH_MINUTES = float(os.getenv("DEFAULT_MATCH_MINUTES", "20"))
+# Observed durations outside of this range are glitches (missed polls, games entered late)
+MIN_MATCH_MINUTES = 3
+MAX_MATCH_MINUTES = 120
+# Processes that don't scrape (ROLE=bot) reload their timeline from the database after this many seconds
+TIMELINE_RELOAD = float(os.getenv("TIMELINE_RELOAD", "5"))
+
+
+class Belegung:
+    """
+    A game currently running on a table.
+    """
+
+    def __init__(self, spiel_id: int, tisch: int, konkurrenz_id: Optional[int], spieler: Tuple[int, int],
+                 start: datetime):
+        self.spiel_id = spiel_id
+        self.tisch = tisch
+        self.konkurrenz_id = konkurrenz_id
+        self.spieler = spieler
+        self.start = start
+
+
+class Timeline:
+    def __init__(self):
+        self.running: Dict[int, Belegung] = {}  # tisch -> current game
+        self.by_spiel: Dict[int, Belegung] = {}  # spiel_id -> current game
+        self.playing: Dict[int, int] = {}  # teilnehmer_id -> tisch
+        self.running_per_konkurrenz: Dict[Optional[int], int] = {}
+        self.durations: Dict[Optional[int], List[float]] = {}  # konkurrenz_id (None: all) -> [count, total seconds]
+        self.queue: Dict[int, Dict[Optional[str], int]] = {}  # konkurrenz_id -> gruppe -> open pairings
+        self.live = False  # True once fed by the scraper of this process
+        self.loaded_at = 0.0
+
+    # Events
+
+    def start(self, spiel: Spiel):
+        """
+        The game was seen on its table.
+        """
+        self.live = True
+        belegung = self.running.get(spiel.tisch)
+        if belegung is not None:
+            if belegung.spiel_id == spiel.id:
+                return
+            self._close(belegung, datetime.now())
+        self._open(spiel.id, spiel.tisch, spiel.konkurrenz_id, (spiel.spieler1_id, spiel.spieler2_id), spiel.start)
+        TischBelegung.insert(tisch=spiel.tisch, spiel=spiel.id, start=spiel.start).on_conflict_replace().execute()
+
+    def seen(self, tische: Set[int]):
+        """
+        End of a poll cycle: games of tables that are no longer listed have ended.
+        """
+        now = datetime.now()
+        for tisch in [t for t in self.running if t not in tische]:
+            self._close(self.running[tisch], now)
+
+    def finish(self, spiel: Spiel):
+        """
+        The game appeared in the list of ended games, with its exact end time.
+        """
+        belegung = self.by_spiel.get(spiel.id)
+        if belegung is not None:
+            self._close(belegung, spiel.end or datetime.now())
+
+    def set_queue(self, konkurrenz_id: int, gruppen: Dict[Optional[str], int]):
+        """
+        Open pairings per group of a competition, as crawled from its page.
+        """
+        self.queue[konkurrenz_id] = gruppen
+
+    def _open(self, spiel_id: int, tisch: int, konkurrenz_id: Optional[int], spieler: Tuple[int, int],
+              start: datetime):
+        belegung = Belegung(spiel_id, tisch, konkurrenz_id, spieler, start)
+        self.running[tisch] = belegung
+        self.by_spiel[spiel_id] = belegung
+        for teilnehmer_id in spieler:
+            self.playing[teilnehmer_id] = tisch
+        self.running_per_konkurrenz[konkurrenz_id] = self.running_per_konkurrenz.get(konkurrenz_id, 0) + 1
+
+    def _close(self, belegung: Belegung, end: datetime):
+        """
+        The game left its table, its duration counts for the average.
+        """
+        del self.running[belegung.tisch]
+        del self.by_spiel[belegung.spiel_id]
+        for teilnehmer_id in belegung.spieler:
+            if self.playing.get(teilnehmer_id) == belegung.tisch:
+                del self.playing[teilnehmer_id]
+        self.running_per_konkurrenz[belegung.konkurrenz_id] -= 1
+        TischBelegung.delete().where(
+            (TischBelegung.tisch == belegung.tisch) & (TischBelegung.spiel == belegung.spiel_id)
+        ).execute()
+        seconds = (end - belegung.start).total_seconds()
+        if MIN_MATCH_MINUTES * 60 <= seconds <= MAX_MATCH_MINUTES * 60:
+            self._add_duration(belegung.konkurrenz_id, 1, seconds)
+            Spieldauer.insert(konkurrenz=belegung.konkurrenz_id or 0, spiele=1, sekunden=seconds).on_conflict(
+                conflict_target=[Spieldauer.konkurrenz],
+                update={Spieldauer.spiele: Spieldauer.spiele + 1,
+                        Spieldauer.sekunden: Spieldauer.sekunden + EXCLUDED.sekunden},
+            ).execute()
+
+    def _add_duration(self, konkurrenz_id: Optional[int], count: int, seconds: float):
+        for key in {konkurrenz_id, None}:  # None collects all competitions
+            stats = self.durations.setdefault(key, [0, 0.0])
+            stats[0] += count
+            stats[1] += seconds
+
+    # Queries
+
+    def average_duration(self, konkurrenz_id: Optional[int]) -> float:
+        """
+        Average match duration in seconds of a competition, falls back to all competitions and then the default.
+        """
+        for key in (konkurrenz_id, None):
+            count, total = self.durations.get(key, (0, 0.0))
+            if count:
+                return total / count
+        return DEFAULT_MATCH_MINUTES * 60
+
+    def estimate_wait(self, konkurrenz_id: int, gruppe: Optional[str], spiele_davor: int) -> timedelta:
+        """
+        Rough time until a pairing with spiele_davor open pairings before it in its group is called.
+        The tables the competition currently uses are assumed to be shared evenly by its groups with open pairings.
+        """
+        gruppen = max(sum(1 for offen in self.queue.get(konkurrenz_id, {}).values() if offen), 1)
+        parallel = max(self.running_per_konkurrenz.get(konkurrenz_id, 0) / gruppen, 1.0)
+        return timedelta(seconds=spiele_davor / parallel * self.average_duration(konkurrenz_id))
+
+    def next_games(self, teilnehmer_id: int) -> List[Tuple[Paarung, int, datetime]]:
+        """
+        Open pairings of a participant with the number of pairings before them in their group and the estimated start,
+        soonest first.
+        """
+        now = datetime.now()
+        free_from = now + self.remaining(self.playing[teilnehmer_id]) if teilnehmer_id in self.playing else now
+        # The position in the group is counted in the same query, with both players and the competition
+        davor = Paarung.alias()
+        spieler1, spieler2 = Teilnehmer.alias(), Teilnehmer.alias()
+        paarungen = (Paarung.select(Paarung, Konkurrenz, spieler1, spieler2, fn.COUNT(davor.id).alias("davor"))
+                     .join(Konkurrenz).switch(Paarung)
+                     .join(spieler1, on=(Paarung.spieler1 == spieler1.id)).switch(Paarung)
+                     .join(spieler2, on=(Paarung.spieler2 == spieler2.id)).switch(Paarung)
+                     .join(davor, JOIN.LEFT_OUTER, on=(
+                         (davor.konkurrenz == Paarung.konkurrenz) &
+                         (fn.IFNULL(davor.gruppe, "") == fn.IFNULL(Paarung.gruppe, "")) &
+                         (davor.reihenfolge < Paarung.reihenfolge)))
+                     .where((Paarung.spieler1 == teilnehmer_id) | (Paarung.spieler2 == teilnehmer_id))
+                     .group_by(Paarung.id)
+                     .order_by(Paarung.konkurrenz, Paarung.reihenfolge))
+        games = []
+        for paarung in paarungen:
+            start = max(now + self.estimate_wait(paarung.konkurrenz_id, paarung.gruppe, paarung.davor), free_from)
+            games.append((paarung, paarung.davor, start))
+        games.sort(key=lambda game: game[2])
+        return games
+
+    def on_table(self, konkurrenz_id: int) -> Set[FrozenSet[int]]:
+        """
+        The player pairs of a competition that are playing right now.
+        """
+        return {frozenset(belegung.spieler) for belegung in self.running.values()
+                if belegung.konkurrenz_id == konkurrenz_id}
+
+    def remaining(self, tisch: int) -> timedelta:
+        """
+        Expected remaining time of the game running on the table.
+        """
+        belegung = self.running[tisch]
+        expected_end = belegung.start + timedelta(seconds=self.average_duration(belegung.konkurrenz_id))
+        return max(expected_end - datetime.now(), timedelta(0))
+
+    # Rebuild
+
+    def load(self):
+        """
+        Rebuild the timeline from the occupancy, durations and pairings in the database, e.g. after a restart.
+        """
+        self.__init__()
+        for belegung in TischBelegung.select(TischBelegung, Spiel).join(Spiel):
+            spiel = belegung.spiel
+            self._open(spiel.id, belegung.tisch, spiel.konkurrenz_id, (spiel.spieler1_id, spiel.spieler2_id),
+                       belegung.start)
+        for dauer in Spieldauer.select():
+            self._add_duration(dauer.konkurrenz or None, dauer.spiele, dauer.sekunden)
+        for paarung in (Paarung.select(Paarung.konkurrenz, Paarung.gruppe, fn.COUNT(Paarung.id).alias("offen"))
+                        .group_by(Paarung.konkurrenz, Paarung.gruppe)):
+            self.queue.setdefault(paarung.konkurrenz_id, {})[paarung.gruppe] = paarung.offen
+        self.loaded_at = time.monotonic()
+
+
+_timelines: Dict[str, Timeline] = {}
+
+
+def current() -> Timeline:
+    """
+    The timeline of the current tournament, loaded from the database on first use.
+    """
+    slug = tournaments.current().slug
+    timeline = _timelines.get(slug)
+    if timeline is None:
+        timeline = Timeline()
+        timeline.load()
+        _timelines[slug] = timeline
+    elif not timeline.live and time.monotonic() - timeline.loaded_at > TIMELINE_RELOAD:
+        # Another process scrapes this tournament, follow it through the database
+        timeline.load()
+    return timeline
@@ -0,0 +1,148 @@
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+from telegram.ext import ContextTypes
+
+from metrics import TOURNAMENT_LABEL
+from models import DB_PATH, PRAGMAS, ChatTurnier, ProfiledSqliteDatabase, current_database, default_db
+
+# Tournament registry. Every tournament has its own base url, poll schedule and database file,
+# all of them are polled by the same process with one HTTP pool and one job queue.
+#
+# TOURNAMENTS_FILE points to a JSON list like
+# [{"slug": "sandershausen-2025", "name": "Sandershausen 2025", "base_url": "https://...", "db_path": "./db/sandershausen.db",
+#   "poll_interval": 5, "beschreibung": "Gerade hilfst du beim Sandershäuser Pfingstturnier 2025 ..."}]
+# Without it there is a single tournament configured by BASE_URL and DB_PATH, like before.
+TOURNAMENTS_FILE = os.getenv("TOURNAMENTS_FILE")
+
+DEFAULT_BASE_URL = "https://www.httv.de/mktt_getPage.php?url=012/48._internationales_sandershaeuser_tischtennis-pfingstturnier_2025-06-06/"
+DEFAULT_BESCHREIBUNG = "Gerade hilfst du beim Sandershäuser Pfingstturnier 2025 in Niestetal, das von Fr. 06.06.2025 bis Mo. 09.06.2025 stattfindet.\nDu und die meisten anderen nennen das Turnier nur \"Sandershausen\"."
+
+
+class Tournament:
+    def __init__(self, slug: str, name: str, base_url: str, db_path: str, poll_interval: int = 5,
+                 crawl_interval: int = 60, roster_interval: int = 300, beschreibung: Optional[str] = None):
+        self.slug = slug
+        self.name = name
+        self.base_url = base_url
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.crawl_interval = crawl_interval
+        self.roster_interval = roster_interval
+        self.beschreibung = beschreibung or f"Gerade hilfst du beim Turnier {name}."
+        self._database = None
+
+    @property
+    def database(self) -> ProfiledSqliteDatabase:
+        if self._database is None:
+            if os.path.abspath(self.db_path) == os.path.abspath(DB_PATH):
+                self._database = default_db
+            else:
+                self._database = ProfiledSqliteDatabase(self.db_path, pragmas=PRAGMAS)
+        return self._database
+
+    def url(self, page: str) -> str:
+        """
+        Absolute url of a page of this tournament, e.g. "starters.html" or a link like "./type_1.html".
+        """
+        if page.startswith("./"):
+            page = page[2:]
+        return f"{self.base_url}{page}"
+
+    def __str__(self):
+        return f"{self.name} ({self.slug})"
+
+
+def _load() -> Dict[str, Tournament]:
+    if not TOURNAMENTS_FILE:
+        tournament = Tournament(
+            slug="default",
+            name="Sandershausen 2025",
+            base_url=os.getenv("BASE_URL", DEFAULT_BASE_URL),
+            db_path=DB_PATH,
+            poll_interval=int(os.getenv("ACTIVE_TABLES_INTERVAL", "5")),
+            crawl_interval=int(os.getenv("CRAWL_INTERVAL", "60")),
+            roster_interval=int(os.getenv("ROSTER_INTERVAL", "300")),
+            beschreibung=DEFAULT_BESCHREIBUNG,
+        )
+        return {tournament.slug: tournament}
+    with open(TOURNAMENTS_FILE, encoding="utf-8") as f:
+        entries = json.load(f)
+    registry = {}
+    for entry in entries:
+        tournament = Tournament(**entry)
+        registry[tournament.slug] = tournament
+    if not registry:
+        raise ValueError(f"No tournaments configured in {TOURNAMENTS_FILE}")
+    return registry
+
+
+_registry: Dict[str, Tournament] = _load()
+_current: ContextVar[Optional[Tournament]] = ContextVar("current_tournament", default=None)
+
+
+def all_tournaments() -> List[Tournament]:
+    return list(_registry.values())
+
+
+def default_tournament() -> Tournament:
+    return next(iter(_registry.values()))
+
+
+def get_tournament(slug: str) -> Tournament:
+    try:
+        return _registry[slug]
+    except KeyError:
+        raise ValueError(f"No tournament found with slug: {slug}")
+
+
+def current() -> Tournament:
+    """
+    The tournament the current task works on, the default tournament outside of use().
+    """
+    return _current.get() or default_tournament()
+
+
+@contextmanager
+def use(tournament: Tournament):
+    """
+    Run the with block for the given tournament: all queries go to its database.
+    """
+    token = _current.set(tournament)
+    db_token = current_database.set(tournament.database)
+    label_token = TOURNAMENT_LABEL.set(tournament.slug)
+    try:
+        yield tournament
+    finally:
+        TOURNAMENT_LABEL.reset(label_token)
+        current_database.reset(db_token)
+        _current.reset(token)
+
+
+def for_job(func: Callable):
+    """
+    Decorator for job queue callbacks that are scheduled once per tournament with the tournament as job data.
+    """
+    @wraps(func)
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE):
+        with use(context.job.data):
+            return await func(context)
+    return wrapper
+
+
+def for_chat(chat_id: int) -> Tournament:
+    """
+    The tournament a chat is bound to, chats that never chose one use the default tournament.
+    """
+    binding = ChatTurnier.get_or_none(ChatTurnier.chat_id == chat_id)
+    if binding and binding.turnier in _registry:
+        return _registry[binding.turnier]
+    return default_tournament()
+
+
+def bind_chat(chat_id: int, tournament: Tournament):
+    ChatTurnier.insert(chat_id=chat_id, turnier=tournament.slug).on_conflict_replace().execute()
@@ -0,0 +1,83 @@
+import asyncio
+import hmac
+import json
+import os
+import signal
+
+from telegram import Update
+from telegram.ext import Application
+
+from webserver import Request, Response, Router, serve
+
+# Webhook mode: Telegram (or a reverse proxy in front of several replicas) POSTs updates to WEBHOOK_PATH,
+# they are put into the application's update queue and handled by the normal handlers.
+# Enabled by setting WEBHOOK_URL to the public url of WEBHOOK_PATH, e.g. https://bot.example.com/telegram
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Replicas behind one ingress should leave registering the webhook to one of them
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") not in ("", "0")
+
+
+def update_endpoint(application: Application):
+    async def receive_update(request: Request) -> Response:
+        token = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            return Response(403, b"Forbidden")
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400, b"Invalid JSON")
+        update = Update.de_json(data, application.bot)
+        if update is None:
+            return Response(400, b"Invalid update")
+        await application.update_queue.put(update)
+        return Response(200, b"OK")
+
+    return receive_update
+
+
+async def run_webhook(application: Application):
+    """
+    Run the application with the embedded HTTP server instead of long polling until SIGINT/SIGTERM.
+    """
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Not available on Windows
+            pass
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    if WEBHOOK_REGISTER:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        print(f"Registered webhook {WEBHOOK_URL}")
+    await application.start()
+
+    router = Router()
+    router.add("POST", WEBHOOK_PATH, update_endpoint(application))
+    server = await serve(router, WEBHOOK_HOST, WEBHOOK_PORT)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
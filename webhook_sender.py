@@ -0,0 +1,53 @@
+# Fake Telegram for the webhook mode: POSTs update payloads to a locally running bot.
+#   WEBHOOK_SECRET=... python webhook_sender.py --url http://127.0.0.1:8443/telegram --count 10 --text "Welche Tische sind aktiv?"
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+
+def text_update(update_id: int, chat_id: int, text: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"Test {chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def send(url: str, secret: str, count: int, chats: int, text: str, first_update_id: int):
+    latencies = []
+    statuses = {}
+    async with httpx.AsyncClient() as client:
+        for i in range(count):
+            payload = text_update(first_update_id + i, 100_000 + i % chats, text)
+            start = time.perf_counter()
+            response = await client.post(url, json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    print(f"Sent {count} updates: status codes {statuses}, "
+          f"latency p50 {statistics.median(latencies) * 1000:.1f} ms / max {max(latencies) * 1000:.1f} ms")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="POST fake Telegram updates to the webhook endpoint.")
+    arg_parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    arg_parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    arg_parser.add_argument("--count", type=int, default=1)
+    arg_parser.add_argument("--chats", type=int, default=1, help="Spread the updates over this many chats")
+    arg_parser.add_argument("--text", default="Hallo Tina!")
+    arg_parser.add_argument("--first-update-id", type=int, default=int(time.time()))
+    args = arg_parser.parse_args()
+    asyncio.run(send(args.url, args.secret, args.count, args.chats, args.text, args.first_update_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Minimal HTTP/1.1 server on top of asyncio streams.
+# Used for the local endpoints of the bot, so no web framework is needed for a handful of routes.
+
+STATUS_TEXT = {
+    200: "OK",
+    204: "No Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+}
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADERS = 100
+KEEP_ALIVE_TIMEOUT = 15
+# Time a client has for the headers and body once the request line arrived, so slow clients can't hold connections
+REQUEST_TIMEOUT = 10
+
+
+class HTTPError(Exception):
+    """
+    The request can't be read, answered with the status and the connection is closed.
+    """
+
+    def __init__(self, status: int):
+        super().__init__(STATUS_TEXT[status])
+        self.status = status
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "text/plain; charset=utf-8",
+                 headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body
+        self.headers = {"Content-Type": content_type}
+        if headers:
+            self.headers.update(headers)
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class Router:
+    """
+    Dispatches requests by method and path. Routes added with prefix=True match every path starting with the given path.
+    """
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], Handler] = {}
+        self.prefix_routes: List[Tuple[str, str, Handler]] = []
+
+    def add(self, method: str, path: str, handler: Handler, prefix: bool = False):
+        if prefix:
+            self.prefix_routes.append((method, path, handler))
+        else:
+            self.routes[(method, path)] = handler
+
+    async def __call__(self, request: Request) -> Response:
+        # HEAD is answered by the GET handler, the body is dropped when writing the response
+        request_method = "GET" if request.method == "HEAD" else request.method
+        handler = self.routes.get((request_method, request.path))
+        if handler is None:
+            for method, path, prefix_handler in self.prefix_routes:
+                if request_method == method and request.path.startswith(path):
+                    handler = prefix_handler
+                    break
+        if handler is None:
+            known_path = any(path == request.path for _, path in self.routes)
+            return Response(405 if known_path else 404, STATUS_TEXT[405 if known_path else 404].encode())
+        return await handler(request)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+    if not request_line:
+        return None
+    try:
+        return await asyncio.wait_for(_read_rest(reader, request_line), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPError(408)
+
+
+async def _read_rest(reader: asyncio.StreamReader, request_line: bytes) -> Request:
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+        if not line:
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HTTPError(400)
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    encoding = headers.get("transfer-encoding", "").lower()
+    if encoding == "chunked":
+        body = await _read_chunked(reader)
+    elif encoding:
+        raise HTTPError(501)
+    else:
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPError(400)
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413)
+        body = await reader.readexactly(length) if length > 0 else b""
+    return Request(method.upper(), target, headers, body)
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    """
+    Body with Transfer-Encoding: chunked, as sent by some proxies in front of the webhook.
+    """
+    body = bytearray()
+    while True:
+        try:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+        except ValueError:
+            raise HTTPError(400)
+        if size == 0:
+            # Optional trailer fields up to the empty line
+            while (await reader.readline()).strip():
+                pass
+            return bytes(body)
+        if len(body) + size > MAX_BODY_SIZE:
+            raise HTTPError(413)
+        body += await reader.readexactly(size)
+        await reader.readexactly(2)  # CRLF after the chunk
+
+
+def _write_response(writer: asyncio.StreamWriter, response: Response, head_only: bool = False):
+    head = f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, '')}\r\n"
+    headers = dict(response.headers)
+    headers["Content-Length"] = str(len(response.body))
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n")
+    if not head_only:
+        writer.write(response.body)
+
+
+async def _handle_connection(handler: Handler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                break
+            except HTTPError as e:
+                # Closing the connection flushes the response
+                _write_response(writer, Response(e.status, str(e).encode(), headers={"Connection": "close"}))
+                break
+            if request is None:
+                break
+            try:
+                response = await handler(request)
+            except Exception as e:
+                print(f"Error handling {request.method} {request.path}: {e}")
+                response = Response(500, STATUS_TEXT[500].encode())
+            _write_response(writer, response, head_only=request.method == "HEAD")
+            await writer.drain()
+            if request.headers.get("connection", "").lower() == "close":
+                break
+    finally:
+        writer.close()
+
+
+async def serve(handler: Handler, host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Start serving on the running event loop.
+    :return: The asyncio server, close it to stop serving.
+    """
+    server = await asyncio.start_server(lambda r, w: _handle_connection(handler, r, w), host, port)
+    print(f"Serving HTTP on {host}:{port}")
+    return server